@@ -11,6 +11,39 @@ from config import model_type
 #: use tf.data.experimental.AUTOTUNE. This might yield a small gain in performance.
 TF_DATASET_NUM_PARALLEL_CALLS = 1
 
+#: Maximum number of free buffers kept for each image resolution in `src.BufferPool.BUFFER_POOL`.
+BUFFER_POOL_MAX_BUFFERS_PER_SHAPE = 4
+
+#: Maximum number of seconds between two attempts to access a file/directory which cannot be reached. The interval
+#: starts at `file_access_retry_seconds`, and is doubled after each failed attempt.
+FILE_ACCESS_MAX_RETRY_SECONDS = 120
+#: Relative random jitter added to the retry interval, so waiting threads and processes do not retry in lockstep.
+FILE_ACCESS_RETRY_JITTER = 0.2
+#: Number of seconds a base directory (input, output or archive root) is assumed to be reachable after it was last
+#: found.
+REACHABILITY_TTL_SECONDS = 5
+
+#: Number of masked images between each update of the number of asynchronous workers, when
+#: `autoscale_async_workers = True`.
+AUTOSCALE_INTERVAL_IMAGES = 10
+#: Weight of the newest measurement in the moving averages of the masking and worker times used for autoscaling.
+AUTOSCALE_SMOOTHING = 0.2
+
+#: Number of seconds before a failed worker is retried for the first time. The delay is doubled for each retry.
+WORKER_RETRY_BASE_SECONDS = 5
+#: Maximum number of seconds before a failed worker is retried.
+WORKER_RETRY_MAX_SECONDS = 120
+#: Number of consecutive worker failures for an output directory which pauses the retries for the directory.
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+#: Number of seconds the retries for an output directory are paused, before a single retry is attempted.
+CIRCUIT_BREAKER_RESET_SECONDS = 60
+
+#: Name of, or path to, the `jpegtran` executable used for selective re-encoding. Must support the `-drop` option.
+JPEGTRAN_EXECUTABLE = "jpegtran"
+#: Maximum fraction of the image area re-encoded selectively. Images where the bounding rectangle of the masks is larger
+#: are re-encoded in full.
+SELECTIVE_REENCODE_MAX_FRACTION = 0.5
+
 #: Actual name of the masking model. Controlled by the value of `model_type`
 MODEL_NAME = {
     "Slow": "mask_rcnn_inception_resnet_v2_atrous_coco_2018_01_28",
@@ -27,6 +60,20 @@ GRAPH_DIRECTORY = os.path.join(PROJECT_ROOT, "models")
 # Directory for cache files
 CACHE_DIRECTORY = os.path.join(PROJECT_ROOT, "_cache")
 
+#: Name of the journal file (in `CACHE_DIRECTORY`) which keeps track of unfinished images.
+JOURNAL_FILENAME = "journal.jsonl"
+#: Number of records in the journal file which triggers compaction of the journal.
+JOURNAL_COMPACT_THRESHOLD = 1000
+#: Maximum number of threads used to clear unfinished images and database cache files at startup.
+RECOVERY_MAX_THREADS = 16
+#: Suffix of the temporary files written by `src.io.atomic_write`. The temporary files are named
+#: `.<filename>.<random hex>ATOMIC_WRITE_TMP_SUFFIX`.
+ATOMIC_WRITE_TMP_SUFFIX = ".tmp"
+#: Maximum number of chunks read ahead of the writes, when copying files to the archive directory.
+COPY_READ_AHEAD_CHUNKS = 2
+#: Number of archive copies to a destination between each log message with the copy throughput.
+COPY_STATS_LOG_INTERVAL = 100
+
 # Full path to the saved model
 MODEL_PATH = os.path.join(GRAPH_DIRECTORY, MODEL_NAME)
 
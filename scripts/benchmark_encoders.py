@@ -0,0 +1,100 @@
+import os
+import logging
+import argparse
+import itertools
+
+import config
+from src.Logger import LOGGER, LOG_SEP
+from src.io import image_codecs
+
+
+def get_args():
+    """ Get the command-line arguments. """
+    parser = argparse.ArgumentParser(description="Benchmark the image encoders. Reports the encoding time and output "
+                                                 "size for each available encoder and combination of JPEG parameters.")
+    parser.add_argument("-i", "--input-folder", dest="input_folder", default=None,
+                        help="Folder with sample .jpg images. If not given, a synthetic image is used.")
+    parser.add_argument("-n", "--max-images", dest="max_images", type=int, default=10,
+                        help="Maximum number of sample images to use.")
+    parser.add_argument("-e", "--encoders", dest="encoders", nargs="+", default=None,
+                        help="Encoders to benchmark. Defaults to all available encoders.")
+    parser.add_argument("-q", "--quality", dest="quality", type=int, nargs="+", default=[config.jpeg_quality],
+                        help="JPEG qualities to benchmark.")
+    parser.add_argument("-s", "--subsampling", dest="subsampling", nargs="+", default=list(image_codecs.SUBSAMPLINGS),
+                        choices=image_codecs.SUBSAMPLINGS, help="Chroma subsamplings to benchmark.")
+    parser.add_argument("-r", "--repetitions", dest="repetitions", type=int,
+                        default=image_codecs.BENCHMARK_REPETITIONS,
+                        help="Number of repetitions for each image. The fastest repetition is used.")
+    args = parser.parse_args()
+    return args
+
+
+def load_images(input_folder, max_images):
+    """
+    Load the sample images.
+
+    :param input_folder: Folder with .jpg images. If None, a synthetic image is returned.
+    :type input_folder: str | None
+    :param max_images: Maximum number of images to load.
+    :type max_images: int
+    :return: Decoded images
+    :rtype: list of np.ndarray
+    """
+    if input_folder is None:
+        return [image_codecs._synthetic_image(image_codecs.BENCHMARK_IMAGE_SHAPE)]
+
+    decoder = image_codecs.get_codec("pil")
+    images = []
+    for filename in sorted(os.listdir(input_folder)):
+        if not filename.lower().endswith(".jpg"):
+            continue
+        with open(os.path.join(input_folder, filename), "rb") as f:
+            data = f.read()
+        try:
+            images.append(decoder.decode(data))
+        except image_codecs.CodecError as err:
+            LOGGER.warning(__name__, f"Skipping sample image '{filename}': {err}")
+        if len(images) >= max_images:
+            break
+    assert images, f"No .jpg images found in '{input_folder}'."
+    return images
+
+
+def get_encoder_names(encoders):
+    available = [name for name, codec_cls in image_codecs.CODECS.items() if codec_cls.is_available()]
+    if encoders is None:
+        return available
+    for name in encoders:
+        assert name in available, f"Encoder '{name}' is not available. Available encoders: {available}"
+    return encoders
+
+
+def main():
+    # Configure logger
+    logging.basicConfig(level=getattr(logging, config.log_level), format=LOGGER.fmt, datefmt=LOGGER.datefmt)
+
+    args = get_args()
+    images = load_images(args.input_folder, args.max_images)
+    encoder_names = get_encoder_names(args.encoders)
+    print(f"Benchmarking encoders {encoder_names} on {len(images)} image(s).\n{LOG_SEP}")
+
+    row = "{:12s}{:>9s}{:>13s}{:>10s}{:>13s}{:>12s}{:>13s}"
+    print(row.format("Encoder", "Quality", "Subsampling", "Optimize", "Progressive", "Time [ms]", "Size [KiB]"))
+    for name in encoder_names:
+        codec = image_codecs.get_codec(name)
+        for quality, subsampling, optimize, progressive in itertools.product(args.quality, args.subsampling,
+                                                                             [False, True], [False, True]):
+            params = dict(quality=quality, subsampling=subsampling, optimize=optimize, progressive=progressive)
+            try:
+                encode_time, size = image_codecs.benchmark_encoder(codec, images, repetitions=args.repetitions,
+                                                                   **params)
+                results = [f"{1000 * encode_time:.1f}", f"{size / 1024:.1f}"]
+            except image_codecs.CodecError:
+                # The encoder does not support this combination of parameters.
+                results = ["-", "-"]
+            print(row.format(name, str(quality), subsampling, str(optimize), str(progressive), *results))
+    print(LOG_SEP)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ from collections import namedtuple, OrderedDict
 import config
 from src.Logger import LOGGER, LOG_SEP
 from src.io.TreeWalker import TreeWalker
+from src.io.mask_formats import get_mask_extension
 
 
 def get_args():
@@ -31,11 +32,11 @@ def get_expected_files(args):
             ef(name="Output image", attr="output_file"),
             ef(name="Input json", attr="input_json"),
             ef(name="Output json", attr="output_json"),
-            ef(name="Input mask", attr="input_webp"),
-            ef(name="Output mask", attr="output_webp"),
+            ef(name="Input mask", attr="input_mask"),
+            ef(name="Output mask", attr="output_mask"),
             ef(name="Archive image", attr="archive_file"),
             ef(name="Archive json", attr="archive_json"),
-            ef(name="Archive mask", attr="archive_webp")
+            ef(name="Archive mask", attr="archive_mask")
         ]
     else:
         expected_files = [ef(name="Output image", attr="output_file")]
@@ -46,16 +47,16 @@ def get_expected_files(args):
             expected_files.append(ef(name="Output json", attr="output_json"))
 
         if config.local_mask:
-            expected_files.append(ef(name="Input mask", attr="input_webp"))
+            expected_files.append(ef(name="Input mask", attr="input_mask"))
         if config.remote_mask:
-            expected_files.append(ef(name="Output mask", attr="output_webp"))
+            expected_files.append(ef(name="Output mask", attr="output_mask"))
 
         if args.archive_folder is not None:
             expected_files.append(ef(name="Archive image", attr="archive_file"))
             if config.archive_json:
                 expected_files.append(ef(name="Archive json", attr="archive_json"))
             if config.archive_mask:
-                expected_files.append(ef(name="Archive mask", attr="archive_webp"))
+                expected_files.append(ef(name="Archive mask", attr="archive_mask"))
 
     return expected_files
 
@@ -70,7 +71,8 @@ def initialize_tree_walker(args):
         mirror_dirs.append(os.path.abspath(args.archive_folder))
 
     # Initialize the walker
-    tree_walker = TreeWalker(base_input_dir, mirror_dirs, skip_webp=False, precompute_paths=True)
+    tree_walker = TreeWalker(base_input_dir, mirror_dirs, skip_masked=False, precompute_paths=True,
+                             mask_ext=get_mask_extension(config.mask_format))
     return tree_walker
 
 
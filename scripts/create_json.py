@@ -73,7 +73,7 @@ def initialize():
     output_dir = os.path.abspath(args.output_folder)
 
     os.makedirs(args.output_folder, exist_ok=True)
-    tree_walker = TreeWalker(input_dir, [output_dir], skip_webp=False, precompute_paths=True)
+    tree_walker = TreeWalker(input_dir, [output_dir], skip_masked=False, precompute_paths=True)
     return tree_walker
 
 
@@ -72,7 +72,7 @@ def initialize():
         log_file = os.path.join(args.log_folder, log_file_name)
         LOGGER.set_log_file(log_file)
 
-    tree_walker = TreeWalker(args.input_dir, [], skip_webp=False, precompute_paths=True, ext="json")
+    tree_walker = TreeWalker(args.input_dir, [], skip_masked=False, precompute_paths=True, ext="json")
     database_client = DatabaseClient(table_name=args.table_name,
                                      max_n_accumulated_rows=config.db_max_n_accumulated_rows,
                                      max_n_errors=config.db_max_n_errors,
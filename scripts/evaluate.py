@@ -92,7 +92,7 @@ def get_results(coco, imgs_dir):
     """
     LOGGER.info(__name__, "Building results.")
 
-    tree_walker = TreeWalker(imgs_dir, [], skip_webp=False, precompute_paths=True)
+    tree_walker = TreeWalker(imgs_dir, [], skip_masked=False, precompute_paths=True)
     dataset = get_tf_dataset(tree_walker)
     dataset_iterator = iter(dataset)
 
@@ -0,0 +1,94 @@
+import math
+
+from src.Logger import LOGGER
+
+
+class Autoscaler:
+    """
+    Adjusts the number of images which can be post-processed by the asynchronous workers at the same time, based on the
+    measured masking time and worker time per image.
+
+    To keep the masking from waiting on the workers, the number of images in flight should be at least the number of
+    images masked while the workers process one image, i.e. `worker_time / mask_time` (Little's law). The limit is set
+    to this number, plus one image of headroom, and clipped to `[min_workers, max_workers]`. The times are smoothed with
+    an exponential moving average, and the limit is only updated every `interval` images, to avoid oscillations.
+
+    :param min_workers: Lower bound for the number of images in flight.
+    :type min_workers: int
+    :param max_workers: Upper bound for the number of images in flight.
+    :type max_workers: int
+    :param interval: Number of masked images between each update of the limit.
+    :type interval: int
+    :param smoothing: Weight of the newest measurement in the moving averages. Must be in (0, 1].
+    :type smoothing: float
+    """
+    def __init__(self, min_workers, max_workers, interval=10, smoothing=0.2):
+        assert 1 <= min_workers <= max_workers, f"Invalid worker bounds: min_workers={min_workers}, " \
+                                                f"max_workers={max_workers}"
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.smoothing = smoothing
+
+        self.mask_time = None
+        self.worker_time = None
+        self.n_workers = max_workers
+        self._n_since_update = 0
+
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return (1 - self.smoothing) * average + self.smoothing * value
+
+    def add_mask_time(self, seconds):
+        """
+        Add a measurement of the time used to mask an image.
+
+        :param seconds: Masking time
+        :type seconds: float
+        """
+        self.mask_time = self._smooth(self.mask_time, seconds)
+        self._n_since_update += 1
+
+    def add_worker_time(self, seconds):
+        """
+        Add a measurement of the time used by the workers to post-process an image.
+
+        :param seconds: Time from the workers' tasks were started in the worker processes until they were finished.
+                        This should not include the time spent waiting for a free worker process, since that time
+                        grows with the number of images in flight.
+        :type seconds: float
+        """
+        self.worker_time = self._smooth(self.worker_time, seconds)
+
+    def get_target(self):
+        """
+        Compute the target number of images in flight from the current measurements.
+
+        :return: Target number of images in flight, or None if there are not enough measurements.
+        :rtype: int | None
+        """
+        if self.mask_time is None or self.worker_time is None:
+            return None
+        in_flight = self.worker_time / max(self.mask_time, 1e-3)
+        return int(min(max(math.ceil(in_flight) + 1, self.min_workers), self.max_workers))
+
+    def update(self):
+        """
+        Update the number of images in flight, if `interval` images have been masked since the last update. Changes are
+        logged.
+
+        :return: Number of images in flight.
+        :rtype: int
+        """
+        if self._n_since_update < self.interval:
+            return self.n_workers
+        self._n_since_update = 0
+
+        target = self.get_target()
+        if target is not None and target != self.n_workers:
+            LOGGER.info(__name__, f"Changing the number of asynchronous workers from {self.n_workers} to {target}. "
+                                  f"Mean masking time: {self.mask_time:.3f} s. Mean worker time: "
+                                  f"{self.worker_time:.3f} s.")
+            self.n_workers = target
+        return self.n_workers
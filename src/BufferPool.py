@@ -0,0 +1,70 @@
+import threading
+from collections import defaultdict
+import numpy as np
+
+import config
+
+
+class BufferPool:
+    """
+    Pool of preallocated numpy arrays, keyed by shape and dtype. Arrays obtained with `BufferPool.get` should be
+    returned with `BufferPool.put` when they are no longer in use, so they can be reused for the next image with the
+    same resolution. This avoids allocating (and page-faulting) a new 12-20 MP array for every image.
+
+    The pool is process-local. Each asynchronous worker process has its own pool.
+
+    :param max_buffers_per_key: Maximum number of free buffers to keep for each shape/dtype. Buffers returned when the
+                                pool is full are left to the garbage collector.
+    :type max_buffers_per_key: int
+    """
+    def __init__(self, max_buffers_per_key=4):
+        self.max_buffers_per_key = max_buffers_per_key
+        self._free = defaultdict(list)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(shape, dtype):
+        return tuple(int(s) for s in shape), np.dtype(dtype).str
+
+    def get(self, shape, dtype=np.uint8):
+        """
+        Get a buffer with the given shape and dtype. The contents of the buffer are undefined.
+
+        :param shape: Shape of buffer
+        :type shape: tuple of int
+        :param dtype: Data type of buffer
+        :type dtype: np.dtype | type
+        :return: Buffer
+        :rtype: np.ndarray
+        """
+        key = self._key(shape, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+        return np.empty(key[0], dtype=dtype)
+
+    def put(self, buffer):
+        """
+        Return a buffer to the pool. The buffer must not be used by the caller afterwards.
+
+        :param buffer: Buffer to return. Must own its data (i.e. not be a view of another array).
+        :type buffer: np.ndarray
+        """
+        if not isinstance(buffer, np.ndarray) or buffer.base is not None or not buffer.flags.writeable:
+            return
+        key = self._key(buffer.shape, buffer.dtype)
+        with self._lock:
+            free = self._free[key]
+            if len(free) < self.max_buffers_per_key and not any(b is buffer for b in free):
+                free.append(buffer)
+
+    def clear(self):
+        """
+        Remove all free buffers from the pool.
+        """
+        with self._lock:
+            self._free.clear()
+
+
+BUFFER_POOL = BufferPool(max_buffers_per_key=config.BUFFER_POOL_MAX_BUFFERS_PER_SHAPE)
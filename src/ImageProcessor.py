@@ -1,13 +1,18 @@
-import os
 import time
-import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 import config
 from src.Logger import LOGGER
-from src.Workers import SaveWorker, EXIFWorker, ERROR_RETVAL
+from src.MemoryBudget import MEMORY_BUDGET
+from src.BufferPool import BUFFER_POOL
+from src.Autoscaler import Autoscaler
+from src.RetryQueue import RetryQueue, CircuitBreaker
+from src.Workers import SaveWorker, EXIFWorker, ERROR_RETVAL, create_worker_pool
 from src.io.file_checker import check_all_files_written
-from src.io.file_access_guard import wait_until_path_is_found
+from src.io.janitor import Janitor
+from src.io.journal import JOURNAL
+from src.io.atomic_write import sync_directories
 
 
 class ImageProcessor:
@@ -19,7 +24,8 @@ class ImageProcessor:
     :type masker: src.Masker.Masker
     :param max_num_async_workers: Maximum number of async workers. When the number of dispatched workers exceeds
                                   `max_num_async_workers`, `ImageProcessor.process_image` will stop and wait for all
-                                  dispatched workers to finish.
+                                  dispatched workers to finish. If `config.autoscale_async_workers` is True, the limit
+                                  is adjusted between `config.min_num_async_workers` and `max_num_async_workers`.
     :type max_num_async_workers: int
     """
 
@@ -28,14 +34,34 @@ class ImageProcessor:
         self.n_completed = 0
         self.max_worker_starts = 2
         self.workers = []
+        # Failed workers are retried after a delay, so the main loop can keep processing new images in the meantime.
+        self.retry_queue = RetryQueue(base_delay=config.WORKER_RETRY_BASE_SECONDS,
+                                      max_delay=config.WORKER_RETRY_MAX_SECONDS,
+                                      jitter=config.FILE_ACCESS_RETRY_JITTER)
+        self.circuit_breaker = CircuitBreaker(failure_threshold=config.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                              reset_timeout=config.CIRCUIT_BREAKER_RESET_SECONDS)
 
         if config.enable_async:
             self.max_num_async_workers = max_num_async_workers
-            self.pool = multiprocessing.Pool(processes=max_num_async_workers)
+            self.pool = create_worker_pool(processes=max_num_async_workers)
+            # File writes are I/O-bound, so they are done in a thread pool, leaving the processes free for rendering.
+            self.io_executor = ThreadPoolExecutor(max_workers=config.max_num_io_threads)
         else:
             self.pool = None
+            self.io_executor = None
             self.max_num_async_workers = 1
 
+        if config.enable_async and config.autoscale_async_workers:
+            self.autoscaler = Autoscaler(min_workers=min(config.min_num_async_workers, max_num_async_workers),
+                                         max_workers=max_num_async_workers,
+                                         interval=config.AUTOSCALE_INTERVAL_IMAGES,
+                                         smoothing=config.AUTOSCALE_SMOOTHING)
+        else:
+            self.autoscaler = None
+
+        # Input files are deleted in a background thread, so the main loop does not have to wait for the file system.
+        self.janitor = Janitor() if config.delete_input else None
+
         if config.write_exif_to_db:
             from src.db.DatabaseClient import DatabaseClient
             self.database_client = DatabaseClient(max_n_accumulated_rows=config.db_max_n_accumulated_rows,
@@ -44,7 +70,7 @@ class ImageProcessor:
         else:
             self.database_client = None
 
-    def _spawn_workers(self, paths, image, mask_results):
+    def _spawn_workers(self, paths, image, mask_results, exif, image_is_pooled=False, data=None):
         """
         Create workers for saving/archiving and EXIF export. The workers will work asynchronously if
         `config.enable_async = True`.
@@ -55,74 +81,133 @@ class ImageProcessor:
         :type image: np.ndarray
         :param mask_results: Results from `src.Masker.Masker.mask`
         :type mask_results: dict
+        :param exif: EXIF data for the image. See `src.io.exif_util.get_exif`.
+        :type exif: dict
+        :param image_is_pooled: Was `image` obtained from `src.BufferPool.BUFFER_POOL`? If True, it will be returned to
+                                the pool when the workers are finished.
+        :type image_is_pooled: bool
+        :param data: Contents of the input file. Passed to the SaveWorker for selective re-encoding.
+        :type data: bytes | None
         """
-        # Write the cache file indicating that the saving process has begun.
-        paths.create_cache_file()
-        # Create workers
+        # Write the journal record indicating that the saving process has begun.
+        JOURNAL.begin(paths)
+        # Create workers. The EXIFWorker gets the run-length encoded mask from the SaveWorker, if the masks are stored
+        # in the .json files.
+        save_worker = SaveWorker(self.pool, paths, image, mask_results, io_executor=self.io_executor,
+                                 original_data=data)
         worker = {
             "paths": paths,
-            "SaveWorker": SaveWorker(self.pool, paths, image, mask_results),
-            "EXIFWorker": EXIFWorker(self.pool, paths, mask_results)
+            "image_buffer": image if image_is_pooled else None,
+            "SaveWorker": save_worker,
+            "EXIFWorker": EXIFWorker(self.pool, paths, mask_results, exif, io_executor=self.io_executor,
+                                     save_worker=save_worker)
         }
         self.workers.append(worker)
 
-    def _wait_for_workers(self):
+    def _wait_for_workers(self, deadline=None):
         """
         Wait for all dispatched workers to finish. If any of the workers raise an exception, it will be handled, and the
-        worker will be restarted (unless it has been started `self.max_worker_starts` times already). When a worker is
-        finished, the output files and archive files will be checked, the cache file will be removed, and if
-        `config.delete_input`, the input image will be removed.
+        worker will be scheduled for a delayed retry (unless it has been started `self.max_worker_starts` times
+        already). When a worker is finished, the output files and archive files will be checked, the image will be
+        committed to the journal, and if `config.delete_input`, the input image will be removed.
+
+        :param deadline: Optional deadline, as a `time.monotonic` timestamp. If the deadline is reached, the remaining
+                         workers are left in `self.workers`.
+        :type deadline: float | None
         """
-        failed_workers = []
+        self._start_due_retries()
         while self.workers:
+            if deadline is not None and not all(self.workers[0][name].wait(timeout=max(deadline - time.monotonic(), 0))
+                                                 for name in ("EXIFWorker", "SaveWorker")):
+                return
             worker = self.workers.pop(0)
 
             paths = worker["paths"]
             exif_result = worker["EXIFWorker"].get()
             save_result = worker["SaveWorker"].get()
 
-            workers_restarted = False
-            if exif_result == ERROR_RETVAL:
-                workers_restarted = self._maybe_restart_worker(paths, worker["EXIFWorker"])
-            if save_result == ERROR_RETVAL:
-                workers_restarted = self._maybe_restart_worker(paths, worker["SaveWorker"])
-
-            if workers_restarted:
-                failed_workers.append(worker)
-            # Check that all expected output files exist, and log an error if any files are missing.
-            elif check_all_files_written(paths):
-                self._finish_image(paths, exif_result)
-
-        self.workers += failed_workers
-
-    def _maybe_restart_worker(self, paths, worker):
+            failed = [name for name, result in (("EXIFWorker", exif_result), ("SaveWorker", save_result))
+                      if result == ERROR_RETVAL]
+            destination = get_destination(paths)
+            if failed:
+                self.circuit_breaker.record_failure(destination)
+            else:
+                self.circuit_breaker.record_success(destination)
+
+            # Schedule the failed workers for a delayed retry, instead of restarting them right away.
+            worker["retry"] = [name for name in failed if self._can_retry_worker(paths, worker[name])]
+            if worker["retry"]:
+                n_starts = max(worker[name].n_starts for name in worker["retry"])
+                self.retry_queue.schedule(worker, delay=self.retry_queue.get_delay(n_starts))
+                continue
+
+            # The workers are done with the image, so its buffer can be reused.
+            BUFFER_POOL.put(worker["image_buffer"])
+            if self.autoscaler is not None:
+                # The service time of the workers is used, since the time spent waiting for a free worker process
+                # grows with the number of images in flight.
+                elapsed_times = [w.elapsed_time for w in (worker["EXIFWorker"], worker["SaveWorker"])]
+                if None not in elapsed_times:
+                    self.autoscaler.add_worker_time(max(elapsed_times))
+            # Check that all expected output files were written, and log an error if any files are missing.
+            manifest = {}
+            for result in (exif_result, save_result):
+                if result != ERROR_RETVAL:
+                    manifest.update(result["files"])
+            if check_all_files_written(paths, manifest=manifest):
+                exif = exif_result["exif"] if exif_result != ERROR_RETVAL else None
+                self._finish_image(paths, exif)
+
+    def _can_retry_worker(self, paths, worker):
         """
-        Restart the worker if it has been started less than `self.max_worker_starts` times previously. Otherwise, log an
+        Check if the worker has been started less than `self.max_worker_starts` times previously. Otherwise, log an
         error, and save the error image.
 
         :param paths: Paths object representing the image file.
         :type paths: src.io.TreeWalker.Paths
-        :param worker: Worker to maybe restart
+        :param worker: Failed worker
         :type worker: src.Workers.BaseWorker
-        :return: True if worker was restarted, False otherwise
+        :return: True if worker can be retried, False otherwise
         :rtype: bool
         """
         if worker.n_starts > self.max_worker_starts:
             LOGGER.error(__name__, f"{worker.__class__.__name__} failed for image: {paths.input_file}.", save=True,
                          email=True, email_mode="error")
             return False
-        else:
-            worker.start()
-            LOGGER.debug(__name__, f"Restarted {worker.__class__.__name__} for image: {paths.input_file}.")
-            return True
+        return True
+
+    def _start_due_retries(self):
+        """
+        Restart the failed workers which are due to be retried. Retries for a destination with an open circuit are
+        postponed until the circuit breaker allows a new attempt, and retries of a SaveWorker are postponed until the
+        memory for the image can be reserved again. This function does not block.
+        """
+        for worker in self.retry_queue.pop_due():
+            paths = worker["paths"]
+            destination = get_destination(paths)
+            if "SaveWorker" in worker["retry"] and not worker["SaveWorker"].reserve_memory(timeout=0):
+                # The image's memory was released when the SaveWorker failed. Postpone the retry until the memory can be
+                # reserved again.
+                self.retry_queue.schedule(worker, delay=config.WORKER_RETRY_BASE_SECONDS)
+                continue
+            if not self.circuit_breaker.allow(destination):
+                self.retry_queue.schedule(worker, delay=self.circuit_breaker.time_until_retry(destination))
+                continue
+
+            # The SaveWorker is restarted first, since the EXIFWorker might wait for its run-length encoded mask.
+            for name in sorted(worker.pop("retry"), key=lambda name: name != "SaveWorker"):
+                worker[name].start()
+                LOGGER.debug(__name__, f"Restarted {name} for image: {paths.input_file}.")
+            self.workers.append(worker)
 
     def _finish_image(self, paths, exif_result):
         """
         Finish processing for an image. This function will:
 
         - (optionally) Write the EXIF data to the database. (If `config.write_exif_to_db == True`.)
-        - Remove the cache file for the image
-        - (optionally) Remove the input image. (If `config.delete_input == True`.)
+        - Sync the output directories, if `config.fsync_policy == "directory"`.
+        - Commit the image to the journal
+        - (optionally) Submit the input image for deletion by the janitor. (If `config.delete_input == True`.)
 
         :param paths: Paths object representing the image file.
         :type paths: src.io.TreeWalker.Paths
@@ -134,74 +219,129 @@ class ImageProcessor:
         if self.database_client is not None and exif_result is not None:
             self.database_client.add_row(exif_result)
 
-        # Remove the cache file
-        paths.remove_cache_file()
-
-        # Delete the input file?
-        if config.delete_input:
-            wait_until_path_is_found(paths.input_file)
-            os.remove(paths.input_file)
-            LOGGER.debug(__name__, f"Input file removed: {paths.input_file}")
+        # Make sure that the renamed output files are durable before the image is committed.
+        sync_directories()
+        # Commit the image to the journal
+        JOURNAL.commit(paths)
 
-            # Remove the input folder if it is empty and it's not the base input folder.
-            remove_empty_folders(start_dir=paths.input_dir, top_dir=paths.base_input_dir)
+        # Delete the input file? The output files have been verified at this point, so it is safe to delete it.
+        if self.janitor is not None:
+            self.janitor.submit(paths)
 
         self.n_completed += 1
 
-    def process_image(self, image, paths):
+    def process_image(self, image, paths, exif, data=None, pooled=False):
         """
         Run the processing pipeline for `image`.
 
-        :param image: Input image. Must be a 4D color image tensor with shape (1, height, width, 3)
-        :type image: tf.python.framework.ops.EagerTensor
+        :param image: Input image. Must be a 4D color image with shape (1, height, width, 3)
+        :type image: np.ndarray | tf.python.framework.ops.EagerTensor
         :param paths: Paths object representing the image file.
         :type paths: src.io.TreeWalker.Paths
+        :param exif: EXIF data for the image, from `src.io.exif_util.exif_from_bytes`.
+        :type exif: dict
+        :param data: Contents of the input file. Only required when `config.selective_reencode = True`.
+        :type data: bytes | None
+        :param pooled: Was `image` obtained from `src.BufferPool.BUFFER_POOL`? If True, it will be returned to the pool
+                       when the workers for the image are finished.
+        :type pooled: bool
         """
         start_time = time.time()
         # Compute the detected objects and their masks.
         mask_results = self.masker.mask(image)
-        time_delta = "{:.3f}".format(time.time() - start_time)
+        mask_time = time.time() - start_time
+        time_delta = "{:.3f}".format(mask_time)
         LOGGER.info(__name__, f"Masked image in {time_delta} s. File: {paths.input_file}")
 
-        # Convert the image to a numpy array
-        if not isinstance(image, np.ndarray):
-            image = image.numpy()
+        # Adjust the number of workers to the measured masking and worker times.
+        if self.autoscaler is not None:
+            self.autoscaler.add_mask_time(mask_time)
+            self.max_num_async_workers = self.autoscaler.update()
+
+        # The workers draw on the image in place, so images which were not decoded into a pooled buffer are converted
+        # to writable numpy arrays. This only copies the image if it is a tensor or a read-only array.
+        if not pooled:
+            image = np.require(image, requirements="W")
+
+        # Restart the failed workers which are due to be retried.
+        self._start_due_retries()
 
         # If we have reached the maximum number of workers. Wait for them to finish
         if len(self.workers) >= self.max_num_async_workers:
             self._wait_for_workers()
+
+        # Reserve memory for the masks, which are held until the SaveWorker is finished. If the budget is exhausted,
+        # wait for the dispatched workers to release their memory. The reservation is then forced, since the remaining
+        # reservations belong to prefetched images, which can only be released by processing them.
+        mask_bytes = mask_results["detection_masks"].nbytes
+        if not MEMORY_BUDGET.acquire(paths.input_file, mask_bytes, timeout=0):
+            self._wait_for_workers()
+            MEMORY_BUDGET.acquire(paths.input_file, mask_bytes, force=True)
+
         # Create workers for the current image.
-        self._spawn_workers(paths, image, mask_results)
+        self._spawn_workers(paths, image, mask_results, exif, image_is_pooled=pooled, data=data)
+
+    def queue_depths(self):
+        """
+        Get the number of images waiting in the post-processing stages.
+
+        :return: Queue depths. <stage name>: <number of images>
+        :rtype: dict
+        """
+        depths = {"write": len(self.workers), "retry": len(self.retry_queue)}
+        if self.janitor is not None:
+            depths["delete"] = self.janitor.n_pending
+        if self.database_client is not None:
+            depths["db"] = len(self.database_client.accumulated_rows)
+        return depths
 
-    def close(self):
+    def close(self, timeout=None):
         """
-        Close the image processing instance. Waits for all dispatched workers to finish, and then closes the
-        multiprocessing pool.
+        Close the image processing instance. Waits for all dispatched workers, and all scheduled retries, to finish, and
+        then closes the multiprocessing pool, the I/O thread pool and the janitor.
+
+        :param timeout: Maximum number of seconds to wait for the workers. If this is None, wait until all workers are
+                        finished. Images which are not finished within the timeout are left unfinished in the journal,
+                        so their output files are removed and the images are processed again in the next run.
+        :type timeout: int | float | None
+        :return: Number of images which were not finished.
+        :rtype: int
         """
-        self._wait_for_workers()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._wait_for_workers(deadline=deadline)
+        while len(self.retry_queue) > 0 and not self.workers:
+            delay = self.retry_queue.time_until_next()
+            if deadline is not None and time.monotonic() + delay > deadline:
+                break
+            time.sleep(delay)
+            self._wait_for_workers(deadline=deadline)
+
+        n_unfinished = len(self.workers) + len(self.retry_queue)
+        if n_unfinished > 0:
+            LOGGER.warning(__name__, f"Timed out after {timeout} s while waiting for the workers. {n_unfinished} "
+                                     f"image(s) were not finished, and will be processed again in the next run.")
+
         if self.pool is not None:
-            self.pool.close()
+            if n_unfinished > 0:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+        if self.io_executor is not None:
+            self.io_executor.shutdown(wait=(n_unfinished == 0))
+        if self.janitor is not None:
+            self.janitor.close()
         if self.database_client is not None:
             self.database_client.close()
+        return n_unfinished
 
 
-def remove_empty_folders(start_dir, top_dir):
+def get_destination(paths):
     """
-    Bottom-up removal of empty folders. If `start_dir` is empty, it will be removed. If `start_dir`'s parent directory
-    is empty after removing `start_dir`, it too will be removed. This process i continued until a parent is non-empty,
-    or the current directory is equal to `top_dir`. (The `top_dir` directory will not be removed).
-
-    NOTE: Use full paths when using this function, to avoid problems when comparing the current directory to `top_dir`.
+    Get the destination directory used to group worker failures in the circuit breaker.
 
-    :param start_dir: Path to bottom directory to remove if empty.
-    :type start_dir: str
-    :param top_dir: Top directory. Only folders under this will be deleted.
-    :type top_dir:
+    :param paths: Paths object representing the image file.
+    :type paths: src.io.TreeWalker.Paths
+    :return: Base output directory, or the base input directory if there is no output directory.
+    :rtype: str
     """
-    assert start_dir.startswith(top_dir), f"remove_empty_folders: Invalid top directory '{top_dir}' for start " \
-                                          f"directory '{start_dir}'"
-    current_dir = start_dir
-    while not os.listdir(current_dir) and current_dir != top_dir:
-        os.rmdir(current_dir)
-        LOGGER.debug(__name__, f"Input folder removed: {current_dir}")
-        current_dir = os.path.dirname(current_dir)
+    return paths.base_output_dir if paths.base_output_dir is not None else paths.base_input_dir
@@ -47,11 +47,12 @@ class Masker:
         """
         Run the masking on `image`.
         
-        :param image: Input image. Must be a 4D color image tensor with shape (1, height, width, 3)
-        :type image: tf.python.framework.ops.EagerTensor
+        :param image: Input image. Must be a 4D color image with shape (1, height, width, 3)
+        :type image: np.ndarray | tf.python.framework.ops.EagerTensor
         :return: Dictionary containing masking results. Content depends on the model used.
         :rtype: dict
         """
+        image = tf.convert_to_tensor(image, dtype=tf.uint8)
         # Original image shape
         image_shape = image.shape
         # Resize the image if it is too large
@@ -0,0 +1,86 @@
+import threading
+
+import config
+from src.Logger import LOGGER
+
+
+class MemoryBudget:
+    """
+    Global byte budget shared by the stages of the processing pipeline. Memory is reserved under a key (usually the
+    path to the input image), and all memory reserved for a key is released at once when the image is done.
+
+    If a single reservation is larger than the whole budget, it is granted when nothing else is reserved. This makes
+    sure that very large images are processed (one at a time) instead of blocking the pipeline forever.
+
+    :param max_bytes: Maximum number of bytes reserved simultaneously. Set `max_bytes = None` to disable the budget.
+    :type max_bytes: int | None
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._reservations = {}
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return self.max_bytes is not None
+
+    def _can_reserve(self, n_bytes):
+        return (self.used_bytes == 0) or (self.used_bytes + n_bytes <= self.max_bytes)
+
+    def acquire(self, key, n_bytes, timeout=None, force=False):
+        """
+        Reserve `n_bytes` under `key`. Blocks until the reservation fits in the budget, or `timeout` is reached.
+
+        :param key: Key to reserve the memory under.
+        :type key: str
+        :param n_bytes: Number of bytes to reserve.
+        :type n_bytes: int
+        :param timeout: Maximum number of seconds to wait. `None` waits forever, and `0` does not wait at all.
+        :type timeout: float | None
+        :param force: Reserve the memory even if it exceeds the budget?
+        :type force: bool
+        :return: True if the memory was reserved, False otherwise.
+        :rtype: bool
+        """
+        if not self.enabled:
+            return True
+
+        n_bytes = int(n_bytes)
+        with self._cond:
+            if not force and not self._can_reserve(n_bytes):
+                LOGGER.debug(__name__, f"Memory budget exhausted ({self.used_bytes} of {self.max_bytes} bytes used). "
+                                       f"Waiting to reserve {n_bytes} bytes for '{key}'.")
+                if not self._cond.wait_for(lambda: self._can_reserve(n_bytes), timeout=timeout):
+                    return False
+
+            self.used_bytes += n_bytes
+            self._reservations[key] = self._reservations.get(key, 0) + n_bytes
+        return True
+
+    def release(self, key):
+        """
+        Release all memory reserved under `key`. Does nothing if nothing is reserved under `key`.
+
+        :param key: Key to release the memory for.
+        :type key: str
+        :return: Number of released bytes
+        :rtype: int
+        """
+        if not self.enabled:
+            return 0
+
+        with self._cond:
+            n_bytes = self._reservations.pop(key, 0)
+            self.used_bytes -= n_bytes
+            self._cond.notify_all()
+        return n_bytes
+
+
+def _get_max_bytes():
+    if config.memory_budget_mb is None:
+        return None
+    return int(config.memory_budget_mb * 1024 ** 2)
+
+
+MEMORY_BUDGET = MemoryBudget(max_bytes=_get_max_bytes())
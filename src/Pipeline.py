@@ -0,0 +1,196 @@
+import time
+import queue
+import threading
+
+from src.Logger import LOGGER
+
+# Sentinel which marks the end of the stream of items.
+_STOP = object()
+
+
+class PipelineItem:
+    """
+    Item passed between the stages of a `Pipeline`. Stages communicate by setting attributes on the item.
+
+    :param paths: Paths object representing the image file.
+    :type paths: src.io.TreeWalker.Paths
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        self.data = None
+        self.image = None
+        #: EXIF data parsed from `data`. See `src.io.exif_util.get_exif`.
+        self.exif = None
+        #: Was `image` obtained from `src.BufferPool.BUFFER_POOL`? If True, the buffer is returned to the pool when the
+        #: workers for the image are finished.
+        self.pooled = False
+        #: Exception raised while processing the item. Items with an error are passed through the remaining stages
+        #: without being processed.
+        self.error = None
+        #: Time spent in each stage. <stage name>: <seconds>
+        self.stage_times = {}
+
+
+class Stage:
+    """
+    A stage in a `Pipeline`. Items are taken from the input queue, processed with `func` in `n_workers` threads, and put
+    on the stage's output queue. The output queue is bounded, so a slow stage will block the stages before it.
+
+    :param name: Name of the stage. Used in logging.
+    :type name: str
+    :param func: Function which processes an item. Called with a `PipelineItem`, and should modify it in place.
+    :type func: function
+    :param n_workers: Number of threads for the stage.
+    :type n_workers: int
+    :param queue_size: Maximum number of items in the output queue.
+    :type queue_size: int
+    """
+    def __init__(self, name, func, n_workers=1, queue_size=4):
+        self.name = name
+        self.func = func
+        self.n_workers = int(n_workers)
+        self.output_queue = queue.Queue(maxsize=queue_size)
+        self.input_queue = None
+        self.n_processed = 0
+        self.busy_seconds = 0.0
+
+        self._n_active_workers = self.n_workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self, input_queue):
+        """
+        Start the worker threads of the stage.
+
+        :param input_queue: Queue to read items from
+        :type input_queue: queue.Queue
+        """
+        self.input_queue = input_queue
+        for i in range(self.n_workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self.input_queue.get()
+            if item is _STOP:
+                # Put the sentinel back, so the other workers in this stage also see it.
+                self.input_queue.put(_STOP)
+                with self._lock:
+                    self._n_active_workers -= 1
+                    is_last = (self._n_active_workers == 0)
+                # The last worker to finish passes the sentinel on to the next stage.
+                if is_last:
+                    self.output_queue.put(_STOP)
+                return
+
+            if item.error is None:
+                start_time = time.time()
+                try:
+                    self.func(item)
+                except Exception as err:
+                    item.error = err
+                elapsed = time.time() - start_time
+                item.stage_times[self.name] = elapsed
+                with self._lock:
+                    self.n_processed += 1
+                    self.busy_seconds += elapsed
+
+            self.output_queue.put(item)
+
+
+class Pipeline:
+    """
+    Streaming producer/consumer pipeline. Items are created from the elements of `source` in a separate thread, and
+    passed through `stages`, which are connected by bounded queues. Iterating over the pipeline yields the items from
+    the last stage, in the order they are finished.
+
+    :param source: Iterable with the elements to process. Each element is wrapped in a `PipelineItem`.
+    :type source: iterable
+    :param stages: Stages to pass the items through.
+    :type stages: list of Stage
+    :param source_name: Name of the source stage. Used in logging.
+    :type source_name: str
+    :param queue_size: Maximum number of items in the source's output queue.
+    :type queue_size: int
+    """
+    def __init__(self, source, stages, source_name="discover", queue_size=4):
+        self.source = source
+        self.stages = stages
+        self.source_name = source_name
+        self.source_queue = queue.Queue(maxsize=queue_size)
+        self.n_discovered = 0
+
+        self._stop_event = threading.Event()
+        self._source_error = None
+        self._started = False
+
+    def start(self):
+        """
+        Start the source thread and the worker threads of all stages.
+        """
+        input_queue = self.source_queue
+        for stage in self.stages:
+            stage.start(input_queue)
+            input_queue = stage.output_queue
+
+        thread = threading.Thread(target=self._run_source, name=self.source_name, daemon=True)
+        thread.start()
+        self._started = True
+
+    def stop(self):
+        """
+        Stop feeding new elements from the source. Items which are already in the pipeline will still be yielded.
+        """
+        self._stop_event.set()
+
+    @property
+    def output_queue(self):
+        if self.stages:
+            return self.stages[-1].output_queue
+        return self.source_queue
+
+    def _run_source(self):
+        try:
+            for element in self.source:
+                if self._stop_event.is_set():
+                    break
+                self.source_queue.put(PipelineItem(element))
+                self.n_discovered += 1
+        except Exception as err:
+            self._source_error = err
+        finally:
+            self.source_queue.put(_STOP)
+
+    def queue_depths(self):
+        """
+        Get the number of items waiting in each queue. The queue is named after the stage which writes to it.
+
+        :return: Queue depths. <stage name>: <number of items>
+        :rtype: dict
+        """
+        depths = {self.source_name: self.source_queue.qsize()}
+        for stage in self.stages:
+            depths[stage.name] = stage.output_queue.qsize()
+        return depths
+
+    def log_stats(self):
+        """
+        Log the number of processed items and the total busy time for each stage.
+        """
+        for stage in self.stages:
+            LOGGER.info(__name__, f"Stage '{stage.name}' ({stage.n_workers} worker(s)): Processed {stage.n_processed} "
+                                  f"item(s) in {stage.busy_seconds:.3f} s.")
+
+    def __iter__(self):
+        if not self._started:
+            self.start()
+        while True:
+            item = self.output_queue.get()
+            if item is _STOP:
+                break
+            yield item
+
+        if self._source_error is not None:
+            raise self._source_error
@@ -0,0 +1,170 @@
+import time
+import heapq
+import random
+import itertools
+
+from src.Logger import LOGGER
+
+
+class RetryQueue:
+    """
+    Queue of items which should be retried after a delay. The delay grows exponentially with the number of attempts,
+    with random jitter. Items are not retried by the queue itself. `RetryQueue.pop_due` returns the items which are due,
+    so they can be restarted without blocking the caller.
+
+    :param base_delay: Delay (in seconds) before the first retry.
+    :type base_delay: int | float
+    :param max_delay: Maximum delay (in seconds).
+    :type max_delay: int | float
+    :param jitter: Relative random jitter added to the delay.
+    :type jitter: float
+    """
+    def __init__(self, base_delay=5, max_delay=120, jitter=0.2):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def get_delay(self, n_attempts):
+        """
+        Get the delay before the next retry of an item which has been attempted `n_attempts` times.
+
+        :param n_attempts: Number of previous attempts.
+        :type n_attempts: int
+        :return: Delay in seconds
+        :rtype: float
+        """
+        delay = min(self.base_delay * 2 ** max(n_attempts - 1, 0), self.max_delay)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def schedule(self, item, delay):
+        """
+        Schedule `item` to be retried after `delay` seconds.
+
+        :param item: Item to retry
+        :type item:
+        :param delay: Delay in seconds
+        :type delay: int | float
+        """
+        # The counter makes sure that items are never compared, and that items with equal due times keep their order.
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), item))
+
+    def pop_due(self):
+        """
+        Remove and return the items which are due to be retried.
+
+        :return: Due items, in the order they became due.
+        :rtype: list
+        """
+        now = time.monotonic()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def time_until_next(self):
+        """
+        Get the number of seconds until the next item is due.
+
+        :return: Seconds until the next item is due. 0 if an item is already due, and None if the queue is empty.
+        :rtype: float | None
+        """
+        if not self._heap:
+            return None
+        return max(self._heap[0][0] - time.monotonic(), 0)
+
+
+class CircuitBreaker:
+    """
+    Per-destination circuit breaker. When `failure_threshold` consecutive failures have been recorded for a destination,
+    the circuit for the destination is opened, and `CircuitBreaker.allow` returns False for `reset_timeout` seconds.
+    After that, one attempt is allowed (half-open). If it succeeds, the circuit is closed. If it fails, the circuit is
+    opened again.
+
+    :param failure_threshold: Number of consecutive failures which opens the circuit.
+    :type failure_threshold: int
+    :param reset_timeout: Number of seconds the circuit is kept open.
+    :type reset_timeout: int | float
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = {}
+        self._opened_at = {}
+        self._half_open = set()
+
+    def is_open(self, destination):
+        """
+        Check if the circuit for `destination` is open.
+
+        :param destination: Destination
+        :type destination: str
+        :return: True if the circuit is open.
+        :rtype: bool
+        """
+        return destination in self._opened_at
+
+    def time_until_retry(self, destination):
+        """
+        Get the number of seconds until an attempt is allowed for `destination`.
+
+        :param destination: Destination
+        :type destination: str
+        :return: Number of seconds. 0 if an attempt is allowed now.
+        :rtype: float
+        """
+        opened_at = self._opened_at.get(destination)
+        if opened_at is None:
+            return 0
+        return max(opened_at + self.reset_timeout - time.monotonic(), 0)
+
+    def allow(self, destination):
+        """
+        Check if an attempt is allowed for `destination`. When the circuit is open, and the reset timeout has expired,
+        a single attempt is allowed.
+
+        :param destination: Destination
+        :type destination: str
+        :return: True if the attempt is allowed.
+        :rtype: bool
+        """
+        if destination not in self._opened_at:
+            return True
+        if destination in self._half_open or self.time_until_retry(destination) > 0:
+            return False
+        self._half_open.add(destination)
+        return True
+
+    def record_success(self, destination):
+        """
+        Record a successful attempt for `destination`. This closes the circuit.
+
+        :param destination: Destination
+        :type destination: str
+        """
+        self._failures.pop(destination, None)
+        self._half_open.discard(destination)
+        if self._opened_at.pop(destination, None) is not None:
+            LOGGER.info(__name__, f"Circuit closed for destination '{destination}'.")
+
+    def record_failure(self, destination):
+        """
+        Record a failed attempt for `destination`. The circuit is opened if the number of consecutive failures reaches
+        the threshold, or if the attempt was made while the circuit was half-open.
+
+        :param destination: Destination
+        :type destination: str
+        """
+        self._failures[destination] = self._failures.get(destination, 0) + 1
+        was_half_open = destination in self._half_open
+        self._half_open.discard(destination)
+        if was_half_open or self._failures[destination] >= self.failure_threshold:
+            if destination not in self._opened_at or was_half_open:
+                LOGGER.warning(__name__, f"Circuit opened for destination '{destination}' after "
+                                         f"{self._failures[destination]} consecutive failure(s). Retries are paused "
+                                         f"for {self.reset_timeout} s.")
+            self._opened_at[destination] = time.monotonic()
@@ -1,26 +1,136 @@
-import os
+import time
+import signal
+import threading
+from concurrent import futures
+import multiprocessing
 
 import config
 from src.Logger import LOGGER
+from src.MemoryBudget import MEMORY_BUDGET
 from src.io import save
 from src.io import exif_util
+from src.io import image_codecs
+from src.io import mask_formats
 from src.io.file_access_guard import wait_until_path_is_found
+from src.io.directory_cache import DIRECTORY_CACHE
 
 
 ERROR_RETVAL = -1
 
+#: Warm state for the current worker process. Set once by `init_worker_process` when the process is started, and
+#: reused by all tasks dispatched to the process.
+WORKER_STATE = {}
+
+
+def get_worker_settings():
+    """
+    Collect the configuration used by the CPU-bound parts of the workers. This is evaluated in the main process, and
+    sent once to each worker process, instead of with every task.
+
+    :return: Worker settings
+    :rtype: dict
+    """
+    # When the masks are stored in the .json files, the SaveWorker run-length encodes the mask for the EXIFWorker, and
+    # no mask files are written.
+    mask_files = mask_formats.get_mask_extension(config.mask_format) is not None
+    return dict(
+        render_args=dict(draw_mask=config.draw_mask,
+                         encode_mask=mask_files and (config.local_mask or config.remote_mask),
+                         mask_color=config.mask_color, blur=config.blur, gray_blur=config.gray_blur,
+                         normalized_gray_blur=config.normalized_gray_blur, encoder=image_codecs.get_encoder_name(),
+                         encoder_params=image_codecs.get_encoder_params(), selective_reencode=config.selective_reencode,
+                         mask_format=config.mask_format),
+        version=config.version,
+    )
+
+
+def init_worker_process(settings):
+    """
+    Initializer for the worker processes. Stores `settings` in `WORKER_STATE`, and creates the encoders, so they can be
+    reused for all tasks in the process.
+
+    :param settings: Worker settings from `get_worker_settings`.
+    :type settings: dict
+    """
+    # Ctrl+C sends SIGINT to the whole process group. The main process handles the shutdown, and lets the workers
+    # finish the dispatched tasks.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    WORKER_STATE.clear()
+    WORKER_STATE.update(settings)
+    image_codecs.get_codec(settings["render_args"]["encoder"])
+    mask_formats.get_mask_encoder_config()
+
+
+def create_worker_pool(processes):
+    """
+    Create a pool of long-lived worker processes, which are initialized with the current worker settings.
+
+    :param processes: Number of processes
+    :type processes: int
+    :return: Worker pool
+    :rtype: multiprocessing.Pool
+    """
+    return multiprocessing.Pool(processes=processes, initializer=init_worker_process,
+                                initargs=(get_worker_settings(),))
+
+
+def run_task(task_name, payload, settings=None):
+    """
+    Run a task. This is the function applied in the worker processes. A task is identified by its name in `TASKS`, and
+    `payload` contains only the data which is specific to the image.
+
+    :param task_name: Name of the task. Must be a key in `TASKS`.
+    :type task_name: str
+    :param payload: Task arguments
+    :type payload: tuple
+    :param settings: Worker settings. If this is None, the warm state of the process will be used.
+    :type settings: dict | None
+    :return: Return value from the task function.
+    :rtype:
+    """
+    if settings is None:
+        if not WORKER_STATE:
+            # The process was not started with `init_worker_process`.
+            init_worker_process(get_worker_settings())
+        settings = WORKER_STATE
+    return TASKS[task_name](settings, *payload)
+
+
+def run_timed_task(task_name, payload):
+    """
+    Run a task with `run_task`, and record when the task was started in the worker process. The time a task waits in the
+    pool's queue is then not counted as worker time.
+
+    :param task_name: Name of the task. Must be a key in `TASKS`.
+    :type task_name: str
+    :param payload: Task arguments
+    :type payload: tuple
+    :return: Time when the task was started, and the return value from the task function.
+    :rtype: tuple
+    """
+    return time.time(), run_task(task_name, payload)
+
 
 class BaseWorker:
     """
     Base class for asynchronous workers. Should be subclassed, and not used as-is.
 
-    :param pool: multiprocessing.Pool to apply async workers in. Can be None if `config.enable_async = False`.
+    A worker consists of a CPU-bound part (`async_func`), which is applied in the multiprocessing pool, and an I/O-bound
+    part (`io_func`), which is submitted to a thread pool when the CPU-bound part is finished. Slow writes to network
+    shares will then not occupy the worker processes.
+
+    :param pool: Pool to apply async workers in. Should be created with `create_worker_pool`. Can be None if
+                 `config.enable_async = False`.
     :type pool: multiprocessing.Pool | None
     :param paths: Paths object representing the image file.
     :type paths: src.io.TreeWalker.Paths
+    :param io_executor: Thread pool to run the I/O-bound part in. If this is None, the I/O-bound part will be called
+                        in `BaseWorker.get`.
+    :type io_executor: concurrent.futures.ThreadPoolExecutor | None
     """
-    def __init__(self, pool, paths):
+    def __init__(self, pool, paths, io_executor=None):
         self.pool = pool
+        self.io_executor = io_executor
         self.paths = paths
         self.n_starts = 0
 
@@ -28,62 +138,198 @@ class BaseWorker:
         self.error_message = "Got error while processing image '{image_path}':\n{err}"
         self.finished_message = "Worker finished. File: 'image_path'"
         self.async_worker = None
-
+        self.io_future = None
+        self._io_submitted = threading.Event()
+        #: Exception raised when the I/O-bound part was submitted. Re-raised in `BaseWorker.get`.
+        self._io_error = None
+        #: Time when the worker was (re)started, and when both parts of the worker were finished.
+        self.start_time = None
+        self.finish_time = None
+        #: Time when the CPU-bound part was started in the worker process. This is later than `start_time` if the task
+        #: had to wait for a free worker process.
+        self.task_start_time = None
+
+        #: Name of the CPU-bound task in `TASKS`.
+        self.task_name = None
         self.args = tuple()
+        self.io_args = tuple()
 
     @staticmethod
-    def async_func(*args):
+    def async_func(settings, *args):
         """
-        Function to apply asynchronously. Implement this in subclasses.
+        CPU-bound function to apply asynchronously. Implement this in subclasses, and register it in `TASKS`.
 
+        :param settings: Worker settings. See `get_worker_settings`.
+        :type settings: dict
         :param args: Function arguments
         :type args: list
         """
         raise NotImplementedError
 
+    @staticmethod
+    def io_func(result, *io_args):
+        """
+        I/O-bound function, which is called with the result of `async_func`. Override this in subclasses. The default
+        implementation returns `result`.
+
+        :param result: Result from `async_func`.
+        :type result:
+        :param io_args: Additional function arguments
+        :type io_args: list
+        """
+        return result
+
     def result_is_valid(self, result):
         """
-        Check that `result` is a valid result from `self.async_func`. Implement this in subclasses. Should return a
+        Check that `result` is a valid result from `self.io_func`. Implement this in subclasses. Should return a
         boolean.
 
-        :param result: Result from `async_func`.
+        :param result: Result from `io_func`.
         :type result:
         """
         raise NotImplementedError
 
+    def on_finished(self, result):
+        """
+        Called in the main process when `self.async_func` has finished, successfully or not. When running
+        asynchronously, this is called from the thread which handles the results of the multiprocessing pool, so it
+        should be quick. Override this in subclasses.
+
+        :param result: Result from `async_func`, or the exception raised by `async_func`.
+        :type result:
+        """
+        pass
+
+    def on_done(self):
+        """
+        Called when both parts of the worker are finished, successfully or not. When running asynchronously, this is
+        called from the I/O thread pool or from the thread which handles the results of the multiprocessing pool, so it
+        should be quick. Override this in subclasses.
+        """
+        pass
+
+    def _async_callback(self, timed_result):
+        # Called by the multiprocessing pool when `async_func` is finished. Submit the I/O-bound part.
+        self.task_start_time, result = timed_result
+        self.on_finished(result)
+        try:
+            if self.io_executor is not None:
+                self.io_future = self.io_executor.submit(self.io_func, result, *self.io_args)
+                self.io_future.add_done_callback(self._set_finish_time)
+        except Exception as err:
+            # The I/O-bound part could not be submitted, e.g. because the thread pool has been shut down. Exceptions
+            # raised here would be swallowed by the multiprocessing pool, so the worker is marked as finished, and the
+            # exception is stored, to be re-raised in `get`.
+            self._io_error = err
+            self._set_finish_time()
+        finally:
+            self._io_submitted.set()
+
+    def _async_error_callback(self, err):
+        self.on_finished(err)
+        self._set_finish_time()
+        self._io_submitted.set()
+
+    def _set_finish_time(self, *_):
+        self.finish_time = time.time()
+        self.on_done()
+
+    @property
+    def elapsed_time(self):
+        """
+        Number of seconds from the CPU-bound part was started in the worker process until the worker was finished. The
+        time spent waiting for a free worker process is not included. None if the worker is not finished, or if the
+        CPU-bound part failed.
+
+        :rtype: float | None
+        """
+        if self.task_start_time is None or self.finish_time is None:
+            return None
+        return self.finish_time - self.task_start_time
+
     def start(self):
         """
-        Start the async worker. If `config.enable_async = False`, `self.async_func` will be called directly.
+        Start the async worker. If `config.enable_async = False`, `self.async_func` and `self.io_func` will be called
+        directly.
         """
         self.n_starts += 1
+        self.io_future = None
+        self._io_error = None
+        self._io_submitted.clear()
+        self.start_time = time.time()
+        self.finish_time = None
+        self.task_start_time = None
+
         if self.pool is not None:
             # Spawn an asynchronous worker
-            self.async_worker = self.pool.apply_async(self.async_func, args=self.args)
+            self.async_worker = self.pool.apply_async(run_timed_task, args=(self.task_name, self.args),
+                                                      callback=self._async_callback,
+                                                      error_callback=self._async_error_callback)
         else:
-            # Try to call the function directly. If it raises an exception, handle the exception.
+            # Try to call the functions directly. If they raise an exception, handle the exception.
+            result = None
+            self.task_start_time = self.start_time
             try:
-                self.async_worker = self.async_func(*self.args)
-                assert self.result_is_valid(self.async_worker), f"Invalid result: '{self.async_worker}'"
+                try:
+                    result = run_task(self.task_name, self.args, settings=get_worker_settings())
+                finally:
+                    self.on_finished(result)
+                result = self.io_func(result, *self.io_args)
+                assert self.result_is_valid(result), f"Invalid result: '{result}'"
+                self.async_worker = result
             except self.worker_exceptions as err:
                 self.handle_error(err)
                 self.async_worker = ERROR_RETVAL
+            finally:
+                self._set_finish_time()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the worker to finish, without getting the result.
+
+        :param timeout: Maximum number of seconds to wait. If this is None, wait until the worker is finished.
+        :type timeout: int | float | None
+        :return: True if the worker is finished, False if the timeout was reached.
+        :rtype: bool
+        """
+        if self.pool is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._io_submitted.wait(timeout):
+            return False
+        if self.io_future is None:
+            return True
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        done, _ = futures.wait([self.io_future], timeout=remaining)
+        return bool(done)
 
     def get(self):
         """
         Get the result from the worker.
 
-        :return: Return value from `self.async_func`.
+        :return: Return value from `self.io_func`.
         :rtype:
         """
         if self.pool is not None:
             # Try to get the result from the asynchronous worker. If it raises an exception, handle the exception.
             try:
-                result = self.async_worker.get()
+                _, result = self.async_worker.get()
+                if self.io_executor is not None:
+                    # Wait for the callback to submit the I/O-bound part, and then wait for it to finish.
+                    self._io_submitted.wait()
+                    if self._io_error is not None:
+                        raise self._io_error
+                    result = self.io_future.result()
+                else:
+                    result = self.io_func(result, *self.io_args)
                 assert self.result_is_valid(result), f"Invalid result: '{result}'"
 
             except self.worker_exceptions as err:
                 self.handle_error(err)
                 return ERROR_RETVAL
+            finally:
+                if self.finish_time is None:
+                    self._set_finish_time()
         else:
             # The execution was not run asynchronously, which means that the result is stored in `self.async_worker`.
             result = self.async_worker
@@ -98,6 +344,11 @@ class BaseWorker:
         :param err: Exception raised by the worker
         :type err: BaseException
         """
+        if isinstance(err, OSError):
+            # The directories might have been removed, or the share might be unreachable. Make sure that the
+            # directories are verified again if the worker is restarted.
+            DIRECTORY_CACHE.invalidate(self.paths.input_dir, *self.paths.base_mirror_dirs)
+
         # Get the current state of the logger
         current_logger_state = LOGGER.get_state()
 
@@ -112,7 +363,9 @@ class BaseWorker:
 
 class SaveWorker(BaseWorker):
     """
-    Worker which saves the masked image, and archives it if archiving is enabled.
+    Worker which saves the masked image, and archives it if archiving is enabled. The image is rendered and encoded in
+    the multiprocessing pool, and the files are written in the I/O thread pool. When the masks are stored in the .json
+    files, the run-length encoded mask is passed on to the `EXIFWorker` for the image. See `SaveWorker.get_mask_rle`.
 
     :param pool: multiprocessing.Pool to apply async workers in. Can be None if `config.enable_async = False`.
     :type pool: multiprocessing.Pool | None
@@ -122,9 +375,14 @@ class SaveWorker(BaseWorker):
     :type img: np.ndarray
     :param mask_results: Results from `src.Masker.Masker.mask`
     :type mask_results: dict
+    :param io_executor: Thread pool to write the files in.
+    :type io_executor: concurrent.futures.ThreadPoolExecutor | None
+    :param original_data: Contents of the input file. Used for selective re-encoding when
+                          `config.selective_reencode = True`.
+    :type original_data: bytes | None
     """
-    def __init__(self, pool, paths, img, mask_results):
-        super().__init__(pool, paths)
+    def __init__(self, pool, paths, img, mask_results, io_executor=None, original_data=None):
+        super().__init__(pool, paths, io_executor=io_executor)
 
         self.error_message = "Got error while saving masked image '{image_path}': {err}"
         self.finished_message = "Saved masked image and mask. File: {image_file}"
@@ -136,55 +394,131 @@ class SaveWorker(BaseWorker):
         )
 
         # Arguments to async. function
-        save_args = dict(draw_mask=config.draw_mask, local_mask=config.local_mask, remote_mask=config.remote_mask,
-                         mask_color=config.mask_color, blur=config.blur, gray_blur=config.gray_blur,
-                         normalized_gray_blur=config.normalized_gray_blur)
-        archive_args = dict(archive_json=config.archive_json, archive_mask=config.archive_mask, assert_output_mask=True)
-        self.args = (img, mask_results, self.paths, save_args, archive_args)
+        mask_files = mask_formats.get_mask_extension(config.mask_format) is not None
+        write_args = dict(local_mask=(mask_files and config.local_mask),
+                          remote_mask=(mask_files and config.remote_mask), checksums=config.output_checksums)
+        archive_args = dict(archive_json=config.archive_json, archive_mask=(mask_files and config.archive_mask),
+                            assert_output_mask=mask_files, checksums=config.output_checksums,
+                            method=config.archive_method, chunk_size=int(config.archive_chunk_size_mb * 2 ** 20),
+                            kernel_copy=config.archive_kernel_copy)
+        #: Number of bytes released from `src.MemoryBudget.MEMORY_BUDGET` when the worker finished.
+        self.released_bytes = 0
+        # Run-length encoded mask from the latest run of the CPU-bound part. See `SaveWorker.get_mask_rle`.
+        self._mask_rle = None
+        self._mask_rle_ready = threading.Event()
+        self.task_name = "save"
+        self.args = (img, mask_results, original_data)
+        self.io_args = (self.paths, write_args, archive_args)
 
         self.start()
 
     def result_is_valid(self, result):
-        return result == 0
+        return isinstance(result, dict) and "files" in result
+
+    def start(self):
+        self._mask_rle_ready.clear()
+        super().start()
+
+    def on_finished(self, result):
+        # The rendered files are only passed on to the I/O-bound part, except for the run-length encoded mask, which is
+        # written by the EXIFWorker.
+        self._mask_rle = result.get("mask_rle") if isinstance(result, dict) else None
+        self._mask_rle_ready.set()
+
+    def get_mask_rle(self):
+        """
+        Wait for the CPU-bound part to finish, and get the run-length encoded mask. The aggregated mask is computed once
+        per image, in the SaveWorker, so the EXIFWorker gets the encoded mask from here, instead of from the detection
+        masks. This is called from the I/O-bound part of the EXIFWorker.
+
+        :return: Run-length encoded mask. See `src.io.mask_formats.rle_encode`.
+        :rtype: dict
+        """
+        self._mask_rle_ready.wait()
+        assert self._mask_rle is not None, f"The mask was not encoded, since the SaveWorker failed for image " \
+                                           f"'{self.paths.input_file}'."
+        return self._mask_rle
+
+    def on_done(self):
+        # The output files have been written (or the worker failed), so the memory reserved for the image can be
+        # released. The released bytes are reserved again if the worker is retried. See `SaveWorker.reserve_memory`.
+        self.released_bytes += MEMORY_BUDGET.release(self.paths.input_file)
+
+    def reserve_memory(self, timeout=None):
+        """
+        Reserve the memory released when the worker finished, before the worker is retried.
+
+        :param timeout: Maximum number of seconds to wait. See `src.MemoryBudget.MemoryBudget.acquire`.
+        :type timeout: float | None
+        :return: True if the memory was reserved, False otherwise.
+        :rtype: bool
+        """
+        if self.released_bytes == 0:
+            return True
+        if not MEMORY_BUDGET.acquire(self.paths.input_file, self.released_bytes, timeout=timeout):
+            return False
+        self.released_bytes = 0
+        return True
 
     @staticmethod
-    def async_func(img, mask_results, paths, save_args, archive_args):
+    def async_func(settings, img, mask_results, original_data=None):
         """
-        Save the result files and do archiving.
+        Draw the masks on the image, and encode the output files.
 
+        :param settings: Worker settings. See `get_worker_settings`.
+        :type settings: dict
         :param img: Input image
         :type img: np.ndarray
         :param mask_results: Results from `src.Masker.Masker.mask`. applied to `image`.
         :type mask_results: dict
+        :param original_data: Contents of the input file, or None.
+        :type original_data: bytes | None
+
+        :return: Encoded output files. See `src.io.save.render_processed_img`.
+        :rtype: dict
+        """
+        return save.render_processed_img(img, mask_results, original_data=original_data, **settings["render_args"])
+
+    @staticmethod
+    def io_func(rendered, paths, write_args, archive_args):
+        """
+        Write the encoded output files and do archiving.
+
+        :param rendered: Encoded output files from `SaveWorker.async_func`.
+        :type rendered: dict
         :param paths: Paths object representing the image file.
         :type paths: src.io.TreeWalker.Paths
-        :param save_args: Additional keyword-arguments to `src.io.save.save_processed_img`
-        :type save_args: dict
+        :param write_args: Additional keyword-arguments to `src.io.save.write_processed_img`
+        :type write_args: dict
         :param archive_args: Additional keyword-arguments to `src.io.save.archive`
         :type archive_args: dict
 
-        :return: 0
-        :rtype: int
+        :return: Dict with the manifest of the written files (key "files"). See `src.io.save.get_manifest_entry`.
+        :rtype: dict
         """
-        # Wait if we can't find the input image or the output path. Here we wait for the base output directory, since
-        # `output_path` might be a folder which does not yet exist.
-        wait_until_path_is_found([paths.input_file, paths.base_output_dir])
+        # Wait if we can't find the output path. Here we wait for the base output directory, since `output_path` might
+        # be a folder which does not yet exist.
+        DIRECTORY_CACHE.wait_until_found([paths.base_output_dir])
         # Save
-        save.save_processed_img(img, mask_results, paths, **save_args)
+        manifest = save.write_processed_img(rendered, paths, **write_args)
 
         if paths.archive_dir is not None:
             # Wait if we can't find the input image, the output path or the archive path
-            wait_until_path_is_found([paths.input_file, paths.output_dir, paths.base_archive_dir])
+            wait_until_path_is_found([paths.input_file])
+            DIRECTORY_CACHE.wait_until_found([paths.output_dir, paths.base_archive_dir])
             # Archive
-            save.archive(paths, **archive_args)
+            manifest.update(save.archive(paths, **archive_args))
 
-        return 0
+        return {"files": manifest}
 
 
 class EXIFWorker(BaseWorker):
     """
-   Worker which reads the EXIF data from the input image using `src.io.exif_util`. The EXIF dict will then be written
-   to the specified location(s).
+   Worker which adds the detected objects to the EXIF data of the input image. The EXIF dict will then be written to
+   the specified location(s). The EXIF data is parsed by the pipeline's read stage, so the worker does not access the
+   input file. The detected objects are added in the multiprocessing pool, and the JSON files are written in the I/O
+   thread pool. When the masks are stored in the .json files, the run-length encoded mask is taken from the image's
+   `SaveWorker` before the JSON files are written.
 
    :param pool: multiprocessing.Pool to apply async workers in. Can be None if `config.enable_async = False`.
    :type pool: multiprocessing.Pool | None
@@ -192,9 +526,15 @@ class EXIFWorker(BaseWorker):
    :type paths: src.io.TreeWalker.Paths
    :param mask_results: Results from `src.Masker.Masker.mask`
    :type mask_results: dict
+   :param exif: EXIF data parsed from the input image. See `src.io.exif_util.get_exif`.
+   :type exif: dict
+   :param io_executor: Thread pool to write the files in.
+   :type io_executor: concurrent.futures.ThreadPoolExecutor | None
+   :param save_worker: SaveWorker for the image. Required when `config.mask_format = "rle"`.
+   :type save_worker: SaveWorker | None
    """
-    def __init__(self, pool, paths, mask_results):
-        super().__init__(pool, paths)
+    def __init__(self, pool, paths, mask_results, exif, io_executor=None, save_worker=None):
+        super().__init__(pool, paths, io_executor=io_executor)
 
         self.error_message = "Got error while processing EXIF data for image '{image_path}': {err}"
         self.finished_message = "Saved EXIF to JSON. File: {image_file}"
@@ -204,49 +544,100 @@ class EXIFWorker(BaseWorker):
             PermissionError,
             OSError,
         )
-        self.args = (self.paths, mask_results, config.local_json, config.remote_json, config.version)
+        self.task_name = "exif"
+        self.args = (exif, get_exif_mask_results(mask_results))
+        mask_rle_source = save_worker if config.mask_format == "rle" else None
+        self.io_args = (self.paths, config.local_json, config.remote_json, config.output_checksums, mask_rle_source)
         self.start()
 
     def result_is_valid(self, result):
-        return isinstance(result, dict)
+        return isinstance(result, dict) and isinstance(result.get("exif"), dict)
 
     @staticmethod
-    def async_func(paths, mask_results, local_json, remote_json, version):
+    def async_func(settings, exif, mask_results):
         """
-        Run the EXIF processing: Read the EXIF data, add the required fields, and save it. File exports are controlled
-        in `config`.
+        Add the required fields to the EXIF data.
 
-        :param paths: Paths object representing the image file.
-        :type paths: src.io.TreeWalker.Paths
+        :param settings: Worker settings. See `get_worker_settings`.
+        :type settings: dict
+        :param exif: EXIF data parsed from the input image.
+        :type exif: dict
         :param mask_results: Results from `src.Masker.Masker.mask`
         :type mask_results: dict
-        :param local_json: Write JSON file to the input (local) directory?
-        :type local_json: bool
-        :param remote_json: Write JSON file to the output (remote) directory?
-        :type remote_json: bool
-        :param version: Version tag for the application. Will be written to the JSON-file
-        :type version: str
-        :return: EXIF dict written to the specified locations
+        :return: EXIF dict
         :rtype: dict
         """
-        wait_until_path_is_found([paths.input_file])
-        # Get the EXIF data
-        exif = exif_util.exif_from_file(paths.input_file)
         # Insert detected objects
         if mask_results is not None:
             exif["detekterte_objekter"] = exif_util.get_detected_objects_dict(mask_results)
         else:
             exif["detekterte_objekter"] = None
         # Insert the version number
-        exif["versjon"] = str(version)
+        exif["versjon"] = str(settings["version"])
+        return exif
+
+    @staticmethod
+    def io_func(exif, paths, local_json, remote_json, checksums, mask_rle_source=None):
+        """
+        Write the EXIF data to the JSON file(s). File exports are controlled in `config`.
+
+        :param exif: EXIF dict from `EXIFWorker.async_func`
+        :type exif: dict
+        :param paths: Paths object representing the image file.
+        :type paths: src.io.TreeWalker.Paths
+        :param local_json: Write JSON file to the input (local) directory?
+        :type local_json: bool
+        :param remote_json: Write JSON file to the output (remote) directory?
+        :type remote_json: bool
+        :param checksums: Include checksums in the manifest?
+        :type checksums: bool
+        :param mask_rle_source: SaveWorker to get the run-length encoded mask from, if the masks are stored in the .json
+                                files.
+        :type mask_rle_source: SaveWorker | None
+        :return: Dict with the EXIF dict written to the specified locations (key "exif"), and the manifest of the
+                 written files (key "files"). See `src.io.save.get_manifest_entry`.
+        :rtype: dict
+        """
+        if mask_rle_source is not None:
+            exif[mask_formats.RLE_JSON_KEY] = mask_rle_source.get_mask_rle()
 
+        manifest = {}
+        json_files = []
         if local_json:
             # Write EXIF to input directory
-            exif_util.write_exif(exif, paths.input_json)
+            json_files.append(paths.input_json)
         if remote_json:
             # Write EXIF to output directory
-            wait_until_path_is_found([paths.base_output_dir])
-            os.makedirs(paths.output_dir, exist_ok=True)
-            exif_util.write_exif(exif, paths.output_json)
+            DIRECTORY_CACHE.wait_until_found([paths.base_output_dir])
+            DIRECTORY_CACHE.makedirs(paths.output_dir)
+            json_files.append(paths.output_json)
 
-        return exif
+        for json_file in json_files:
+            data = exif_util.write_exif(exif, json_file)
+            checksum = save.get_checksum(data=data) if checksums else None
+            manifest[json_file] = save.get_manifest_entry(len(data), checksum)
+
+        return {"exif": exif, "files": manifest}
+
+
+def get_exif_mask_results(mask_results):
+    """
+    Get the parts of the masking results which are used by `EXIFWorker`. The masks are not needed for the EXIF data, so
+    they are not sent to the worker process. When the masks are stored in the .json files, the run-length encoded mask
+    is taken from the `SaveWorker` instead.
+
+    :param mask_results: Results from `src.Masker.Masker.mask`, or None.
+    :type mask_results: dict | None
+    :return: Masking results for `EXIFWorker`, or None if `mask_results` is None.
+    :rtype: dict | None
+    """
+    if mask_results is None:
+        return None
+    return {"detection_classes": mask_results["detection_classes"]}
+
+
+#: CPU-bound tasks which can be dispatched to the worker processes. <task name>: <function>
+TASKS = {
+    "save": SaveWorker.async_func,
+    "exif": EXIFWorker.async_func,
+}
@@ -1,5 +1,6 @@
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 import cx_Oracle as cxo
 
 import config
@@ -248,19 +249,11 @@ def clear_db_cache():
     if not os.path.isdir(DB_CACHE_DIR):
         return
 
-    rows = []
-    files = []
-    for filename in os.listdir(DB_CACHE_DIR):
-        if not filename.endswith(".pkl"):
-            continue
-
-        cache_file = os.path.join(DB_CACHE_DIR, filename)
-        LOGGER.debug(__name__, f"Found database cache file: {cache_file}")
-        # Load the cached row and append it to `rows`
-        with open(cache_file, "rb") as f:
-            rows.append(pickle.load(f))
-        # Store the path to the cached row
-        files.append(cache_file)
+    files = [os.path.join(DB_CACHE_DIR, filename) for filename in os.listdir(DB_CACHE_DIR)
+             if filename.endswith(".pkl")]
+    # Load the cached rows in parallel
+    with ThreadPoolExecutor(max_workers=config.RECOVERY_MAX_THREADS) as executor:
+        rows = list(executor.map(_load_cached_row, files))
 
     # Return if we didn't find any valid rows.
     if not rows:
@@ -275,8 +268,14 @@ def clear_db_cache():
             raise DatabaseError(f"Got error '{err}' when inserting cached rows into the database.") from err
 
     # Remove the cache files
-    for cache_file in files:
-        os.remove(cache_file)
+    with ThreadPoolExecutor(max_workers=config.RECOVERY_MAX_THREADS) as executor:
+        list(executor.map(os.remove, files))
+
+
+def _load_cached_row(cache_file):
+    LOGGER.debug(__name__, f"Found database cache file: {cache_file}")
+    with open(cache_file, "rb") as f:
+        return pickle.load(f)
 
 
 def split_errors_on_code(errors, code):
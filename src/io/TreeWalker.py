@@ -1,8 +1,5 @@
 import os
-import json
-from uuid import uuid4
 
-import config
 from src.Logger import LOGGER
 
 
@@ -22,8 +19,11 @@ class Paths:
     :type mirror_dirs: list of str
     :param filename: Name of file represented by the object
     :type filename: str
+    :param mask_ext: Extension of the mask files. If this is None, the mask is stored in the .json file, and the mask
+                     file paths are None. See `src.io.mask_formats`.
+    :type mask_ext: str | None
     """
-    def __init__(self, base_input_dir, base_mirror_dirs, input_dir, mirror_dirs, filename):
+    def __init__(self, base_input_dir, base_mirror_dirs, input_dir, mirror_dirs, filename, mask_ext="webp"):
 
         self.base_input_dir = base_input_dir
         self.base_mirror_dirs = base_mirror_dirs
@@ -32,14 +32,14 @@ class Paths:
         self.mirror_dirs = mirror_dirs
         self.filename = filename
 
-        # Names of .json and .webp files.
+        # Names of .json and mask files.
         self.json_filename = os.path.splitext(filename)[0] + ".json"
-        self.webp_filename = os.path.splitext(filename)[0] + ".webp"
+        self.mask_filename = os.path.splitext(filename)[0] + "." + mask_ext if mask_ext is not None else None
 
         # Paths to input files
         self.input_file = os.path.join(self.input_dir, self.filename)
         self.input_json = os.path.join(self.input_dir, self.json_filename)
-        self.input_webp = os.path.join(self.input_dir, self.webp_filename)
+        self.input_mask = _join_optional(self.input_dir, self.mask_filename)
 
         # Paths to output files
         if len(self.mirror_dirs) > 0:
@@ -47,10 +47,10 @@ class Paths:
             self.output_dir = self.mirror_dirs[0]
             self.output_file = os.path.join(self.output_dir, self.filename)
             self.output_json = os.path.join(self.output_dir, self.json_filename)
-            self.output_webp = os.path.join(self.output_dir, self.webp_filename)
+            self.output_mask = _join_optional(self.output_dir, self.mask_filename)
         else:
             self.base_output_dir = self.output_dir = None
-            self.output_file = self.output_json = self.output_webp = None
+            self.output_file = self.output_json = self.output_mask = None
 
         # Paths to archive files
         if len(self.mirror_dirs) > 1:
@@ -58,10 +58,10 @@ class Paths:
             self.archive_dir = self.mirror_dirs[1]
             self.archive_file = os.path.join(self.archive_dir, self.filename)
             self.archive_json = os.path.join(self.archive_dir, self.json_filename)
-            self.archive_webp = os.path.join(self.archive_dir, self.webp_filename)
+            self.archive_mask = _join_optional(self.archive_dir, self.mask_filename)
         else:
             self.base_archive_dir = self.archive_dir = None
-            self.archive_file = self.archive_json = self.archive_webp = None
+            self.archive_file = self.archive_json = self.archive_mask = None
 
         # Remaining mirror paths
         if len(self.mirror_dirs) > 2:
@@ -69,8 +69,6 @@ class Paths:
         else:
             self.remaining_mirror_dirs = None
 
-        self.cache_file = os.path.join(config.CACHE_DIRECTORY, str(uuid4()) + ".json")
-
     @property
     def error_output_dir(self):
         error_extension = "_error"
@@ -94,16 +92,9 @@ class Paths:
             relative_input_dir = relative_input_dir[1:]
         return relative_input_dir
 
-    def create_cache_file(self):
-        json_contents = {k: v for k, v in self.__dict__.items() if isinstance(k, str) or k is None}
-        with open(self.cache_file, "w") as f:
-            json.dump(json_contents, f)
 
-    def remove_cache_file(self):
-        if os.path.isfile(self.cache_file):
-            os.remove(self.cache_file)
-        else:
-            LOGGER.warning(__name__, f"Attempted to remove cache file '{self.cache_file}', but is does not exist.")
+def _join_optional(directory, filename):
+    return os.path.join(directory, filename) if filename is not None else None
 
 
 class TreeWalker:
@@ -114,34 +105,40 @@ class TreeWalker:
     :type input_folder: str
     :param mirror_folders: List of directories to traverse in parallel to `input_folders`.
     :type mirror_folders: list of str
-    :param skip_webp: Skip images that already have an associated .webp file in `output_folder`.
-    :type skip_webp: bool
+    :param skip_masked: Skip images that already have an associated mask file (or .json file, if `mask_ext` is None) in
+                        `output_folder`.
+    :type skip_masked: bool
     :param precompute_paths: Traverse the whole tree during initialization? When this is true, `TreeWalker.walk`
                              will return an iterator. Otherwise it will return a generator.
     :type precompute_paths: bool
     :param ext: File extension for files returned by `TreeWalker.walk`.
     :type ext: str
+    :param mask_ext: Extension of the mask files. See `src.io.TreeWalker.Paths`.
+    :type mask_ext: str | None
     """
-    def __init__(self, input_folder, mirror_folders, skip_webp=True, precompute_paths=True, ext="jpg"):
+    def __init__(self, input_folder, mirror_folders, skip_masked=True, precompute_paths=True, ext="jpg",
+                 mask_ext="webp"):
         LOGGER.info(__name__, f"Searching for {ext}-files in '{input_folder}'.")
         self.input_folder = input_folder
         self.mirror_folders = mirror_folders
-        self.skip_webp = skip_webp
+        self.skip_masked = skip_masked
         self.precompute_paths = precompute_paths
         self.ext = ext
+        self.mask_ext = mask_ext
         self.n_valid_images = self.n_skipped_images = 0
 
         if self.precompute_paths:
             self.paths = [p for p in self._walk()]
             LOGGER.info(__name__, f"Found {self.n_valid_images} valid {ext}-files.")
             if self.n_skipped_images > 0:
-                LOGGER.info(__name__, f"Found {self.n_skipped_images} files with associated webp-files. "
-                                      f"These will be skipped.")
+                LOGGER.info(__name__, f"Found {self.n_skipped_images} files with associated "
+                                      f"{self.mask_ext or 'json'}-files. These will be skipped.")
         else:
             self.paths = None
 
-    def _to_webp(self, path):
-        return path[:-len(self.ext)] + "webp"
+    def _to_mask(self, path):
+        # When the masks are stored in the .json files, the .json file marks the image as masked.
+        return path[:-len(self.ext)] + (self.mask_ext or "json")
 
     def _get_mirror_dirs(self, input_dir):
         return [input_dir.replace(self.input_folder, mirror_base, 1) for mirror_base in self.mirror_folders]
@@ -155,10 +152,10 @@ class TreeWalker:
             LOGGER.info(__name__, f"Could not read image file '{input_filepath}'")
             return False
 
-        if self.skip_webp:
-            webp_path = os.path.join(mirror_dirs[0], self._to_webp(filename))
-            if os.path.exists(webp_path):
-                LOGGER.debug(__name__, f"Mask already found for '{input_filepath}' at '{webp_path}'.")
+        if self.skip_masked:
+            mask_path = os.path.join(mirror_dirs[0], self._to_mask(filename))
+            if os.path.exists(mask_path):
+                LOGGER.debug(__name__, f"Mask already found for '{input_filepath}' at '{mask_path}'.")
                 self.n_skipped_images += 1
                 return False
 
@@ -171,7 +168,8 @@ class TreeWalker:
             for filename in file_names:
                 if self._path_is_valid(input_dir, mirror_dirs, filename):
                     yield Paths(base_input_dir=self.input_folder, base_mirror_dirs=self.mirror_folders,
-                                input_dir=input_dir, mirror_dirs=mirror_dirs, filename=filename)
+                                input_dir=input_dir, mirror_dirs=mirror_dirs, filename=filename,
+                                mask_ext=self.mask_ext)
 
     def walk(self):
         """
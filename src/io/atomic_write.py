@@ -0,0 +1,164 @@
+"""
+Atomic file writes. Files are written to a temporary file in the destination directory, which is then renamed to the
+destination path. Readers will therefore only ever see complete files, and a file at its final path is never partially
+written, even if the process is killed during the write.
+
+The durability of the written files is controlled by `config.fsync_policy`:
+
+* "none": Do not call `fsync`. The files are complete if the process is killed, but a power loss or an operating system
+  crash can leave empty or incomplete files.
+* "file": `fsync` each file before it is renamed, and its directory after it is renamed.
+* "directory": `fsync` each file before it is renamed. The directories are synced in a batch with `sync_directories`,
+  so each directory is only synced once, no matter how many files were written to it.
+"""
+import os
+import uuid
+import threading
+
+import config
+from src.Logger import LOGGER
+
+#: Valid values for `config.fsync_policy`.
+FSYNC_POLICIES = ("none", "file", "directory")
+
+# Directories with renamed files which have not been synced yet. Only used with `fsync_policy = "directory"`.
+_pending_directories = set()
+_pending_lock = threading.Lock()
+
+
+def write_atomic(data, file_path, fsync_policy=None):
+    """
+    Atomically write `data` to `file_path`. An existing file at `file_path` is replaced.
+
+    :param data: Data to write
+    :type data: bytes
+    :param file_path: Path to output file. The parent directory must exist.
+    :type file_path: str
+    :param fsync_policy: fsync policy. See `FSYNC_POLICIES`. If None, `config.fsync_policy` will be used.
+    :type fsync_policy: str | None
+    """
+    fsync_policy = _get_fsync_policy(fsync_policy)
+    temp_path = get_temp_path(file_path)
+    try:
+        with open(temp_path, "xb") as f:
+            f.write(data)
+            if fsync_policy != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        _replace(temp_path, file_path, fsync_policy)
+    except BaseException:
+        _remove_if_exists(temp_path)
+        raise
+
+
+def commit_temp_file(temp_path, file_path, fsync_policy=None):
+    """
+    Rename a complete file from `get_temp_path` to its final path. This is used for files which are not written with
+    `write_atomic`, e.g. copies and links.
+
+    :param temp_path: Path to the temporary file
+    :type temp_path: str
+    :param file_path: Final path. An existing file will be replaced.
+    :type file_path: str
+    :param fsync_policy: fsync policy. See `FSYNC_POLICIES`. If None, `config.fsync_policy` will be used.
+    :type fsync_policy: str | None
+    """
+    fsync_policy = _get_fsync_policy(fsync_policy)
+    try:
+        if fsync_policy != "none":
+            # Windows requires write access for `fsync`. Elsewhere, the file is opened read-only, since a hard link to a
+            # read-only input file can not be opened for writing.
+            fd = os.open(temp_path, os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        _replace(temp_path, file_path, fsync_policy)
+    except BaseException:
+        _remove_if_exists(temp_path)
+        raise
+
+
+def sync_directories():
+    """
+    Sync the directories with files written since the last call, when `config.fsync_policy = "directory"`. Does nothing
+    for the other policies.
+    """
+    with _pending_lock:
+        directories = list(_pending_directories)
+        _pending_directories.clear()
+    for directory in directories:
+        _sync_directory(directory)
+
+
+def get_temp_path(file_path):
+    """
+    Get a unique path to a temporary file in the same directory as `file_path`.
+
+    :param file_path: Final path of the file.
+    :type file_path: str
+    :return: Path to temporary file
+    :rtype: str
+    """
+    directory, filename = os.path.split(file_path)
+    return os.path.join(directory, f".{filename}.{uuid.uuid4().hex[:12]}{config.ATOMIC_WRITE_TMP_SUFFIX}")
+
+
+def get_temp_target(filename):
+    """
+    Get the final filename for a temporary file from `get_temp_path`.
+
+    :param filename: Name of a file, without the directory.
+    :type filename: str
+    :return: Name of the final file, or None if `filename` is not a temporary file.
+    :rtype: str | None
+    """
+    suffix = config.ATOMIC_WRITE_TMP_SUFFIX
+    if not (filename.startswith(".") and filename.endswith(suffix)):
+        return None
+    target, sep, _ = filename[1:-len(suffix)].rpartition(".")
+    return target if (sep and target) else None
+
+
+def _get_fsync_policy(fsync_policy):
+    if fsync_policy is None:
+        fsync_policy = config.fsync_policy
+    if fsync_policy not in FSYNC_POLICIES:
+        raise ValueError(f"Unknown fsync policy '{fsync_policy}'. Must be one of {list(FSYNC_POLICIES)}.")
+    return fsync_policy
+
+
+def _replace(temp_path, file_path, fsync_policy):
+    os.replace(temp_path, file_path)
+    # `rename` does nothing if the files are hard links to the same file, which leaves the temporary file behind.
+    _remove_if_exists(temp_path)
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    if fsync_policy == "file":
+        _sync_directory(directory)
+    elif fsync_policy == "directory":
+        with _pending_lock:
+            _pending_directories.add(directory)
+
+
+def _sync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError as err:
+        # Directories can not be opened on Windows.
+        LOGGER.debug(__name__, f"Could not open directory '{directory}' for syncing: {err}")
+        return
+    try:
+        os.fsync(fd)
+    except OSError as err:
+        # Some file systems do not support syncing directories.
+        LOGGER.debug(__name__, f"Could not sync directory '{directory}': {err}")
+    finally:
+        os.close(fd)
+
+
+def _remove_if_exists(file_path):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,94 @@
+import os
+import threading
+
+from src.io.file_access_guard import wait_until_path_is_found
+
+
+class DirectoryCache:
+    """
+    Process-local cache of directories which are known to exist. Directories are created and verified once, and later
+    calls for the same directory return without touching the file system. This avoids a network round trip for every
+    image when the directories are located on a network share.
+
+    Entries should be invalidated (with `DirectoryCache.invalidate`) when a directory might have been removed, or when a
+    file operation in a cached directory fails.
+    """
+    def __init__(self):
+        self._known = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        if isinstance(path, bytes):
+            path = path.decode("utf-8")
+        return os.path.normcase(os.path.abspath(path))
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._key(path) in self._known
+
+    def __len__(self):
+        with self._lock:
+            return len(self._known)
+
+    def _add(self, key):
+        # `key` exists, so all its parents exist as well.
+        with self._lock:
+            while key not in self._known:
+                self._known.add(key)
+                parent = os.path.dirname(key)
+                if parent == key:
+                    break
+                key = parent
+
+    def makedirs(self, path):
+        """
+        Create the directory `path` (and its parents) unless it is known to exist. Equivalent to
+        `os.makedirs(path, exist_ok=True)`.
+
+        :param path: Directory to create
+        :type path: str
+        """
+        key = self._key(path)
+        with self._lock:
+            if key in self._known:
+                return
+        os.makedirs(path, exist_ok=True)
+        self._add(key)
+
+    def wait_until_found(self, paths):
+        """
+        Wait until all directories in `paths` are found, using `src.io.file_access_guard.wait_until_path_is_found`.
+        Directories which are known to exist are not checked.
+
+        :param paths: Directories to wait for
+        :type paths: list of str
+        :return: 0, if the existence of all directories is confirmed before the timeout is reached.
+        :rtype: int
+        """
+        unknown = [path for path in paths if path not in self]
+        if unknown:
+            wait_until_path_is_found(unknown)
+            for path in unknown:
+                self._add(self._key(path))
+        return 0
+
+    def invalidate(self, *paths):
+        """
+        Remove `paths`, and all directories below them, from the cache. If no paths are given, the whole cache is
+        cleared.
+
+        :param paths: Directories to remove from the cache.
+        :type paths: str
+        """
+        with self._lock:
+            if not paths:
+                self._known.clear()
+                return
+            for path in paths:
+                key = self._key(path)
+                prefix = os.path.join(key, "")
+                self._known = {k for k in self._known if k != key and not k.startswith(prefix)}
+
+
+DIRECTORY_CACHE = DirectoryCache()
@@ -1,4 +1,5 @@
 """From: https://github.com/vegvesen/vegbilder/blob/master/trinn1_lagmetadata/vegbilder_lesexif.py"""
+import io
 import os
 import re
 import json
@@ -12,6 +13,7 @@ from datetime import datetime
 
 import config
 from src.Logger import LOGGER
+from src.io.atomic_write import write_atomic
 
 
 #: Tags from Viatech
@@ -114,9 +116,35 @@ def exif_from_file(image_path):
     return exif
 
 
+def exif_from_bytes(data, image_path):
+    """
+    Retrieve the EXIF-data from the contents of an image file. Only the image header is parsed.
+
+    :param data: Contents of the image file
+    :type data: bytes
+    :param image_path: Path to input image. Used to recreate metadata when EXIF-header is missing
+    :type image_path: str
+    :return: EXIF data
+    :rtype: dict
+    """
+    with Image.open(io.BytesIO(data)) as pil_img:
+        return get_exif(pil_img, image_path=image_path)
+
+
 def write_exif(exif, output_filepath):
-    with open(output_filepath, "w", encoding="utf-8") as out_file:
-        json.dump(exif, out_file, indent=4, ensure_ascii=False)
+    """
+    Atomically write the EXIF dict to a JSON file. See `src.io.atomic_write`.
+
+    :param exif: EXIF dict
+    :type exif: dict
+    :param output_filepath: Path to output JSON file
+    :type output_filepath: str
+    :return: The contents written to the file
+    :rtype: bytes
+    """
+    data = json.dumps(exif, indent=4, ensure_ascii=False).encode("utf-8")
+    write_atomic(data, output_filepath)
+    return data
 
 
 def get_detected_objects_dict(mask_results):
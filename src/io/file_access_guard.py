@@ -1,5 +1,7 @@
 import time
 import os
+import random
+import threading
 import numpy as np
 
 import config
@@ -30,32 +32,252 @@ def all_exists(paths, exists_func=os.path.exists):
     return exists
 
 
+class ReachabilityMonitor:
+    """
+    Central monitor for the reachability of the base directories (the input, output and archive roots).
+
+    - A base directory which has been found is assumed to be reachable for `ttl` seconds, so it is not checked again.
+    - When a base directory cannot be reached, it is marked as down. A single thread probes the directory, with
+      exponential backoff and jitter, while all other threads waiting for paths under that directory block until it
+      is reachable again. The outage is logged once, instead of by every waiting thread.
+    - Paths which are not located under a registered base directory are retried with exponential backoff.
+    - New images are not read or dispatched to the workers while a base directory is down. See
+      `wait_until_reachable`.
+
+    The monitor is process-local.
+
+    :param ttl: Number of seconds a base directory is assumed to be reachable after it was last found.
+    :type ttl: int | float
+    :param max_retry_interval: Maximum number of seconds between two attempts.
+    :type max_retry_interval: int | float
+    :param jitter: Relative random jitter added to the retry interval.
+    :type jitter: float
+    :param exists_func: Function which checks if a path exists.
+    :type exists_func: function
+    """
+    def __init__(self, ttl=5, max_retry_interval=120, jitter=0.2, exists_func=os.path.exists):
+        self.ttl = ttl
+        self.max_retry_interval = max_retry_interval
+        self.jitter = jitter
+        self.exists_func = exists_func
+
+        self._base_dirs = []
+        self._last_found = {}
+        self._down = {}
+        self._probing = set()
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def register_base_dirs(self, base_dirs):
+        """
+        Register base directories to monitor.
+
+        :param base_dirs: Base directories
+        :type base_dirs: list of str
+        """
+        with self._cond:
+            for base_dir in base_dirs:
+                key = self._key(base_dir)
+                if key not in self._base_dirs:
+                    self._base_dirs.append(key)
+            # Check the longest directories first, so nested base directories are matched correctly.
+            self._base_dirs.sort(key=len, reverse=True)
+
+    def base_dir_of(self, path):
+        """
+        Get the registered base directory containing `path`.
+
+        :param path: Path to file or directory
+        :type path: str
+        :return: Base directory, or None if `path` is not located under a registered base directory.
+        :rtype: str | None
+        """
+        key = self._key(path)
+        for base_dir in self._base_dirs:
+            if key == base_dir or key.startswith(os.path.join(base_dir, "")):
+                return base_dir
+        return None
+
+    def is_down(self, base_dir=None):
+        """
+        Check if a base directory is currently marked as unreachable.
+
+        :param base_dir: Base directory to check. If None, check if any base directory is unreachable.
+        :type base_dir: str | None
+        :return: True if the directory is marked as unreachable.
+        :rtype: bool
+        """
+        with self._cond:
+            if base_dir is None:
+                return bool(self._down)
+            return self._key(base_dir) in self._down
+
+    def wait_while_down(self, retry_interval, timeout):
+        """
+        Block while any of the base directories are marked as unreachable, for `timeout` seconds. See
+        `wait_until_reachable`.
+
+        :param retry_interval: Initial number of seconds to wait between each retry.
+        :type retry_interval: int | float
+        :param timeout: Total number of seconds to wait.
+        :type timeout: int | float
+        :return: 0, if all base directories are reachable before the timeout is reached.
+        :rtype: int
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            down = list(self._down)
+        for base_dir in down:
+            self._wait_until_up(base_dir, retry_interval, deadline, [base_dir], timeout)
+        return 0
+
+    def _exists(self, path, use_ttl=True):
+        key = self._key(path)
+        if use_ttl:
+            with self._cond:
+                last_found = self._last_found.get(key)
+            if last_found is not None and (time.monotonic() - last_found) < self.ttl:
+                return True
+        exists = self.exists_func(path)
+        if exists and key in self._base_dirs:
+            with self._cond:
+                self._last_found[key] = time.monotonic()
+        return exists
+
+    def _retry_interval(self, interval):
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _mark_down(self, base_dir):
+        with self._cond:
+            self._last_found.pop(base_dir, None)
+            if base_dir in self._down:
+                return
+            self._down[base_dir] = time.monotonic()
+        LOGGER.warning(__name__, f"Directory '{base_dir}' could not be reached. Pausing access to files in the "
+                                 f"directory until it can be reached again.")
+
+    def _mark_up(self, base_dir):
+        with self._cond:
+            self._last_found[base_dir] = time.monotonic()
+            down_since = self._down.pop(base_dir, None)
+        if down_since is not None:
+            LOGGER.info(__name__, f"Directory '{base_dir}' can be reached again after "
+                                  f"{time.monotonic() - down_since:.1f} s.")
+
+    def _wait_until_up(self, base_dir, retry_interval, deadline, paths, timeout):
+        with self._cond:
+            # If another thread is probing the directory, wait for it to finish.
+            while base_dir in self._probing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise _not_reachable_error(paths, timeout)
+                self._cond.wait(timeout=remaining)
+            if base_dir not in self._down:
+                return
+            self._probing.add(base_dir)
+
+        try:
+            interval = retry_interval
+            while not self.exists_func(base_dir):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise _not_reachable_error(paths, timeout)
+                time.sleep(min(self._retry_interval(interval), remaining))
+                interval = min(2 * interval, self.max_retry_interval)
+            self._mark_up(base_dir)
+        finally:
+            with self._cond:
+                self._probing.discard(base_dir)
+                self._cond.notify_all()
+
+    def wait(self, paths, retry_interval, timeout):
+        """
+        Block until all elements of `paths` exist, for `timeout` seconds. See `wait_until_path_is_found`.
+
+        :param paths: Paths to wait for.
+        :type paths: list of str
+        :param retry_interval: Initial number of seconds to wait between each retry.
+        :type retry_interval: int | float
+        :param timeout: Total number of seconds to wait.
+        :type timeout: int | float
+        :return: 0, if the existence of all paths is confirmed before the timeout is reached.
+        :rtype: int
+        """
+        deadline = time.monotonic() + timeout
+        interval = retry_interval
+
+        while True:
+            missing = [path for path in paths if not self._exists(path)]
+            if not missing:
+                return 0
+
+            # Check if the paths are missing because their base directories cannot be reached.
+            unreachable = []
+            for base_dir in {self.base_dir_of(path) for path in missing} - {None}:
+                if not self._exists(base_dir, use_ttl=False):
+                    self._mark_down(base_dir)
+                    unreachable.append(base_dir)
+
+            if unreachable:
+                for base_dir in unreachable:
+                    self._wait_until_up(base_dir, retry_interval, deadline, paths, timeout)
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise _not_reachable_error(paths, timeout)
+            LOGGER.warning(__name__, f"At least one of the paths in {paths} could not be reached. Retrying.")
+            time.sleep(min(self._retry_interval(interval), remaining))
+            interval = min(2 * interval, self.max_retry_interval)
+
+
+def _not_reachable_error(paths, timeout):
+    return PathNotReachableError(f"At least one of the paths in {paths} could not be reached in {timeout}s. Aborting.")
+
+
 def wait_until_path_is_found(paths, retry_interval=config.file_access_retry_seconds,
                              timeout=config.file_access_timeout_seconds):
     """
     Blocks execution until all elements of `paths` are valid paths, for `timeout` seconds. If the timeout is reached,
     and one or more paths still do not exist, a `PathNotReachableError` will be raised.
 
+    The waiting is coordinated by `REACHABILITY_MONITOR`. The interval between retries starts at `retry_interval`, and
+    is doubled (with random jitter) after each failed attempt.
+
     :param paths: Iterable where each element is a string of paths. The elements can also be `bytes`.
     :type paths: list of str | tuple of str | np.ndarray
-    :param retry_interval: Number of seconds to wait between each retry.
+    :param retry_interval: Initial number of seconds to wait between each retry.
     :type retry_interval: int
     :param timeout: Total number of seconds to wait.
     :type timeout: int
     :return: 0, if the existence of all paths is confirmed before the timeout is reached.
     :rtype: int
     """
-    total_wait_time = 0
-
     if not isinstance(paths, (list, tuple, np.ndarray)):
         paths = [paths]
+    paths = [path.decode("utf-8") if isinstance(path, bytes) else str(path) for path in np.ravel(paths)]
+    return REACHABILITY_MONITOR.wait(paths, retry_interval=retry_interval, timeout=timeout)
 
-    while not all_exists(paths):
-        time.sleep(retry_interval)
-        total_wait_time += retry_interval
-        if total_wait_time > timeout:
-            raise PathNotReachableError(f"At least one of the paths in {paths} could not be reached in {timeout}s. "
-                                        f"Aborting.")
-        else:
-            LOGGER.warning(__name__, f"At least one of the paths in {paths} could not be reached. Retrying.")
-    return 0
+
+def wait_until_reachable(retry_interval=config.file_access_retry_seconds, timeout=config.file_access_timeout_seconds):
+    """
+    Blocks execution while any of the base directories are marked as unreachable by `REACHABILITY_MONITOR`, for
+    `timeout` seconds. If the timeout is reached, and a directory still cannot be reached, a `PathNotReachableError`
+    will be raised. This is used to pause the dispatching of new work while a share is down.
+
+    :param retry_interval: Initial number of seconds to wait between each retry.
+    :type retry_interval: int
+    :param timeout: Total number of seconds to wait.
+    :type timeout: int
+    :return: 0, if all base directories are reachable before the timeout is reached.
+    :rtype: int
+    """
+    return REACHABILITY_MONITOR.wait_while_down(retry_interval=retry_interval, timeout=timeout)
+
+
+REACHABILITY_MONITOR = ReachabilityMonitor(ttl=config.REACHABILITY_TTL_SECONDS,
+                                           max_retry_interval=config.FILE_ACCESS_MAX_RETRY_SECONDS,
+                                           jitter=config.FILE_ACCESS_RETRY_JITTER)
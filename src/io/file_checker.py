@@ -1,13 +1,20 @@
 import os
 import json
+import random
+from concurrent.futures import ThreadPoolExecutor
 
 import config
 from src.Logger import LOGGER
 from src.io.file_access_guard import wait_until_path_is_found, PathNotReachableError
 from src.io.TreeWalker import Paths
+from src.io.directory_cache import DIRECTORY_CACHE
+from src.io.save import get_checksum
+from src.io.mask_formats import get_mask_extension
+from src.io.journal import JOURNAL, read_pending
+from src.io.atomic_write import get_temp_target
 
 
-def check_all_files_written(paths):
+def check_all_files_written(paths, manifest=None):
     """
     Check that all files for a given image have been saved correctly. The list of checked files is determined by the
     File I/O parameters in `config`. If all expected output files exist, the cache file will be deleted. If all expected
@@ -15,10 +22,16 @@ def check_all_files_written(paths):
 
     :param paths: Paths object representing the input image
     :type paths: src.io.TreeWalker.Paths
+    :param manifest: Manifest of the files written by the workers. See `src.io.save.get_manifest_entry`. If this is
+                     None, the files will be checked in the file system.
+    :type manifest: dict | None
     :return: True if all expected files were found. False otherwise
     :rtype: bool
     """
-    missing_files = find_missing_files(paths)
+    if manifest is None:
+        missing_files = find_missing_files(paths)
+    else:
+        missing_files = find_missing_files_in_manifest(paths, manifest)
     if missing_files:
         _handle_missing_files(paths, missing_files)
         return False
@@ -37,12 +50,45 @@ def find_missing_files(paths):
     :rtype: list of str
     """
     expected_files = get_expected_files(paths)
+    base_dirs = [paths.base_input_dir, *paths.base_mirror_dirs]
+
+    DIRECTORY_CACHE.wait_until_found(base_dirs)
+    missing_files = [file_path for file_path in expected_files if not _file_is_ok(file_path)]
+
+    if missing_files:
+        # The files might be missing because the base directories have become unreachable since they were cached.
+        # Verify the base directories, and check the missing files again.
+        DIRECTORY_CACHE.invalidate(*base_dirs)
+        DIRECTORY_CACHE.wait_until_found(base_dirs)
+        missing_files = [file_path for file_path in missing_files if not _file_is_ok(file_path)]
+
+    return missing_files
+
+
+def find_missing_files_in_manifest(paths, manifest, restat_fraction=None):
+    """
+    Find any missing files among the expected output files for the given image, using the manifest returned by the
+    workers. The file system is only accessed for a random sample of the images, where the sizes (and checksums, if
+    available) of the written files are verified.
+
+    :param paths: Paths object representing the input image
+    :type paths: src.io.TreeWalker.Paths
+    :param manifest: Manifest of the written files. See `src.io.save.get_manifest_entry`.
+    :type manifest: dict
+    :param restat_fraction: Fraction of the images to verify in the file system. If None,
+                            `config.output_restat_fraction` will be used.
+    :type restat_fraction: float | None
+    :return: List of missing (or incomplete) output files
+    :rtype: list of str
+    """
+    if restat_fraction is None:
+        restat_fraction = config.output_restat_fraction
+
+    expected_files = get_expected_files(paths)
+    missing_files = [file_path for file_path in expected_files if file_path not in manifest]
 
-    wait_until_path_is_found([paths.base_input_dir, *paths.base_mirror_dirs])
-    missing_files = []
-    for file_path in expected_files:
-        if not _file_is_ok(file_path):
-            missing_files.append(file_path)
+    if not missing_files and random.random() < restat_fraction:
+        missing_files = [file_path for file_path in expected_files if not _file_matches(file_path, manifest[file_path])]
 
     return missing_files
 
@@ -63,17 +109,18 @@ def get_expected_files(paths):
     if config.remote_json:
         expected_files.append(paths.output_json)
 
-    if config.local_mask:
-        expected_files.append(paths.input_webp)
-    if config.remote_mask:
-        expected_files.append(paths.output_webp)
+    # The mask paths are None when the masks are stored in the .json files.
+    if config.local_mask and paths.input_mask is not None:
+        expected_files.append(paths.input_mask)
+    if config.remote_mask and paths.output_mask is not None:
+        expected_files.append(paths.output_mask)
 
     if paths.archive_dir is not None:
         expected_files.append(paths.archive_file)
         if config.archive_json:
             expected_files.append(paths.archive_json)
-        if config.archive_mask:
-            expected_files.append(paths.archive_webp)
+        if config.archive_mask and paths.archive_mask is not None:
+            expected_files.append(paths.archive_mask)
 
     return expected_files
 
@@ -95,6 +142,27 @@ def _file_is_ok(file_path, invert=False):
     return file_exists
 
 
+def _file_matches(file_path, entry):
+    """
+    Check that the file at `file_path` matches its manifest entry.
+
+    :param file_path: Full path to file
+    :type file_path: str
+    :param entry: Manifest entry. See `src.io.save.get_manifest_entry`.
+    :type entry: dict
+    :return: True if the file exists, and its size (and checksum) matches the entry.
+    :rtype: bool
+    """
+    try:
+        if os.path.getsize(file_path) != entry["size"]:
+            return False
+    except OSError:
+        return False
+    if entry.get("checksum") is not None:
+        return get_checksum(file_path=file_path) == entry["checksum"]
+    return True
+
+
 def _handle_missing_files(paths, missing_files):
     """
     Handle any missing files identified for a given image. This will log an error, which saves the error image, and
@@ -114,9 +182,13 @@ def _handle_missing_files(paths, missing_files):
 
 def clear_cache():
     """
-    Clear the cache directory. Each JSON file in the cache directory is expected to represent an image for which the
-    export process was aborted due to a critical error. This function will clear the output files written for the
-    unfinished image, and then delete the cache file.
+    Clear the unfinished images in the cache directory. An image is unfinished if it has a "begin" record, but no
+    "commit" record in the journal (see `src.io.journal`), which means that the export process was aborted due to a
+    critical error. This function will clear the output files written for the unfinished images (see
+    `clear_unfinished_images`), and then delete the journal. Cache files written by earlier versions (one JSON file per
+    image) are cleared as well.
+
+    The output directories are listed once each, in parallel, instead of checking every expected file separately.
     """
     # Return if we couldn't find a cache directory. This probably means that this is the first time the application is
     # ran on this machine, so the cache directory has not been created yet
@@ -124,50 +196,154 @@ def clear_cache():
         return
 
     LOGGER.info(__name__, "Clearing cache files")
-    count = 0
-    for filename in os.listdir(config.CACHE_DIRECTORY):
-        if filename.endswith(".json"):
-            clear_cache_file(os.path.join(config.CACHE_DIRECTORY, filename))
-            count += 1
-    LOGGER.info(__name__, f"Found and cleared {count} cache file(s)")
+    # Make sure that all records are written, in case the journal is still open.
+    JOURNAL.close()
+    journal_file = JOURNAL.get_default_file()
+    # Records written by earlier versions have no fsync policy, and the output files were not written atomically.
+    unfinished = [(record["paths"], journal_file, record.get("fsync_policy", "none") != "none")
+                  for record in read_pending(journal_file).values()]
+
+    cache_files = [os.path.join(config.CACHE_DIRECTORY, filename) for filename in os.listdir(config.CACHE_DIRECTORY)
+                   if filename.endswith(".json")]
+    with ThreadPoolExecutor(max_workers=config.RECOVERY_MAX_THREADS) as executor:
+        for cache_file, cache_info in zip(cache_files, executor.map(_read_cache_file, cache_files)):
+            if cache_info is not None:
+                unfinished.append((cache_info, cache_file, False))
 
+    clear_unfinished_images(unfinished)
 
-def clear_cache_file(file_path):
+    # Remove the journal and the cache files
+    if os.path.isfile(journal_file):
+        os.remove(journal_file)
+    for cache_file in cache_files:
+        os.remove(cache_file)
+    LOGGER.info(__name__, f"Found and cleared {len(unfinished)} unfinished image(s)")
+
+
+def _read_cache_file(file_path):
     """
-    Clear the output files for the unfinished image whose cahce file is located at `file_path`
+    Read a cache file written by earlier versions.
 
     :param file_path: Path to cache file for unfinished image
     :type file_path: str
+    :return: Contents of the cache file, or None if the file is incomplete.
+    :rtype: dict | None
     """
-    # Read the JSON file
     try:
         with open(file_path, "r") as f:
-            cache_info = json.load(f)
+            return json.load(f)
     except json.JSONDecodeError:
         # If we got a JSONDecodeError, it was most likely because the program was killed before it finished writing the
         # file. Since cache file writing is the first step when exporting the output images, we have no output images to
-        # clean up. We therefore remove the (incomplete) cache file and continue.
-        os.remove(file_path)
-        return
+        # clean up.
+        return None
+
+
+def clear_unfinished_images(unfinished):
+    """
+    Remove the output files written for unfinished images. The base directories are checked once for each distinct
+    directory, and the expected output files are grouped by directory, so each directory is only listed once. The
+    directories are processed in a thread pool with `config.RECOVERY_MAX_THREADS` threads. Temporary files left by
+    `src.io.atomic_write` are removed as well.
+
+    The output files are written atomically, so an expected output file which exists is complete, as long as it was
+    written with an fsync policy other than "none". The files for an unfinished image which has all its expected output
+    files are therefore kept, and the input file is deleted if `config.delete_input` is True. This is not done when
+    `config.write_exif_to_db` is True, since the database rows are only written for finished images.
+
+    :param unfinished: Unfinished images. Each element is a tuple `(paths_dict, source_file, durable)`, where
+                       `paths_dict` holds the keyword-arguments required to create the `src.io.TreeWalker.Paths` object
+                       representing the image (see `src.io.journal.paths_to_dict`), `source_file` is the journal or
+                       cache file which contained the image, and `durable` is True if the output files were written
+                       atomically with an fsync policy other than "none".
+    :type unfinished: list of tuple
+    """
+    images = []
+    base_dirs = {}
+    for paths_dict, source_file, durable in unfinished:
+        # Create a `src.io.TreeWalker.Paths` object representing the image
+        paths = Paths(base_input_dir=paths_dict["base_input_dir"], base_mirror_dirs=paths_dict["base_mirror_dirs"],
+                      input_dir=paths_dict["input_dir"], mirror_dirs=paths_dict["mirror_dirs"],
+                      filename=paths_dict["filename"], mask_ext=get_mask_extension(config.mask_format))
+        for base_dir in [paths.base_input_dir, *paths.base_mirror_dirs]:
+            base_dirs.setdefault(base_dir, source_file)
+        images.append((paths, get_expected_files(paths), durable))
 
-    # Create a `src.io.TreeWalker.Paths` object representing the image
-    paths = Paths(base_input_dir=cache_info["base_input_dir"], base_mirror_dirs=cache_info["base_mirror_dirs"],
-                  input_dir=cache_info["input_dir"], mirror_dirs=cache_info["mirror_dirs"],
-                  filename=cache_info["filename"])
     # Wait for the directories if they cannot be reached
+    for base_dir, source_file in base_dirs.items():
+        try:
+            wait_until_path_is_found([base_dir])
+        except PathNotReachableError as err:
+            raise PathNotReachableError(f"The directories pointed to by the cache file '{source_file}' could not be "
+                                        f"found. If they were deleted manually, delete this cache file and run the "
+                                        f"program again") from err
+
+    directories = list({os.path.dirname(file_path) for _, expected_files, _ in images for file_path in expected_files})
+    with ThreadPoolExecutor(max_workers=config.RECOVERY_MAX_THREADS) as executor:
+        contents = dict(zip(directories, executor.map(_list_directory, directories)))
+
+    files_by_dir = {}
+    for paths, expected_files, durable in images:
+        keep = durable and not config.write_exif_to_db and all(
+            os.path.basename(file_path) in contents[os.path.dirname(file_path)] for file_path in expected_files
+        )
+        if keep:
+            _finish_complete_image(paths)
+        for expected_file in expected_files:
+            directory, filename = os.path.split(expected_file)
+            files_by_dir.setdefault(directory, {})[filename] = (paths.input_file, keep)
+
+    with ThreadPoolExecutor(max_workers=config.RECOVERY_MAX_THREADS) as executor:
+        # Consume the iterator to re-raise any errors.
+        list(executor.map(_clear_directory, files_by_dir.keys(), files_by_dir.values(),
+                          [contents[directory] for directory in files_by_dir.keys()]))
+
+
+def _list_directory(directory):
     try:
-        wait_until_path_is_found([paths.base_input_dir, *paths.base_mirror_dirs])
-    except PathNotReachableError as err:
-        raise PathNotReachableError(f"The directories pointed to by the cache file '{file_path}' could not be found. If"
-                                    f" they were deleted manually, delete this cache file and run the program again")\
-                                   from err
-
-    # Remove any expected output files if they are present
-    for expected_file in get_expected_files(paths):
-        if os.path.isfile(expected_file):
-            os.remove(expected_file)
-            LOGGER.info(__name__, f"Removed file '{expected_file}' for unfinished image '{paths.input_file}'")
+        return set(os.listdir(directory))
+    except FileNotFoundError:
+        return set()
+
+
+def _finish_complete_image(paths):
+    """
+    Finish an unfinished image which has all its expected output files. The output files are kept, and the input file
+    is deleted if `config.delete_input` is True.
+
+    :param paths: Paths object representing the input image
+    :type paths: src.io.TreeWalker.Paths
+    """
+    LOGGER.info(__name__, f"Keeping the complete output files for unfinished image '{paths.input_file}'")
+    if config.delete_input and os.path.isfile(paths.input_file):
+        os.remove(paths.input_file)
+        LOGGER.debug(__name__, f"Input file removed: {paths.input_file}")
+
+
+def _clear_directory(directory, files, existing):
+    """
+    Remove the output files, and any temporary files, for unfinished images in a directory.
+
+    :param directory: Directory to clear
+    :type directory: str
+    :param files: Expected output files in the directory. <filename>: (<path to input image>, <keep the file?>)
+    :type files: dict
+    :param existing: Names of the files in the directory
+    :type existing: set of str
+    """
+    for filename in existing:
+        target = get_temp_target(filename)
+        if target is not None and target in files:
+            os.remove(os.path.join(directory, filename))
+            LOGGER.info(__name__, f"Removed temporary file '{os.path.join(directory, filename)}' for unfinished "
+                                  f"image '{files[target][0]}'")
+
+    for filename, (input_file, keep) in files.items():
+        if keep:
+            continue
+        file_path = os.path.join(directory, filename)
+        if filename in existing:
+            os.remove(file_path)
+            LOGGER.info(__name__, f"Removed file '{file_path}' for unfinished image '{input_file}'")
         else:
-            LOGGER.debug(__name__, f"Could not find file '{expected_file}' for unfinished image '{paths.input_file}'")
-    # Remove the cache file
-    os.remove(file_path)
+            LOGGER.debug(__name__, f"Could not find file '{file_path}' for unfinished image '{input_file}'")
@@ -0,0 +1,302 @@
+"""
+Copying of files to the archive directory. When the source and destination are located on the same file system, the
+copy can be replaced by a constant-time metadata operation:
+
+* "reflink": Clone the file with the `FICLONE` ioctl (Linux, on file systems like Btrfs and XFS). The clone shares the
+  data blocks with the source until one of them is modified (copy-on-write), so it behaves exactly like a copy.
+* "link": Create a hard link with `os.link`. The archive file and the source file are then the same file. This is safe
+  when the source is not modified afterwards, and especially efficient with `delete_input`, where the link and the
+  deletion together amount to a move.
+
+If the requested method is not possible for a pair of files, the file is copied instead. The files are copied (or
+linked) to a temporary file, which is renamed to the destination path with `src.io.atomic_write.commit_temp_file`.
+
+Regular copies are done in chunks of a configurable size. On Linux, the data is copied in the kernel with
+`os.copy_file_range` or `os.sendfile`, when available. Otherwise, files larger than one chunk are read in a separate
+thread, so the reads from the source overlap with the writes to the destination. This matters on network shares, where
+each read and write has a high latency. The throughput of the copies is logged for each destination by `COPY_STATS`.
+"""
+import os
+import sys
+import time
+import errno
+import queue
+import threading
+from shutil import copystat
+
+import config
+from src.Logger import LOGGER
+from src.io import atomic_write
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+#: ioctl request code for `FICLONE` on Linux. `fcntl.FICLONE` is only available in Python >= 3.12.
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+#: Valid copy methods.
+METHODS = ("copy", "link", "reflink", "auto")
+
+#: Methods attempted, in order, when the method is "auto".
+AUTO_METHODS = ("reflink", "link", "copy")
+
+#: Functions used to copy the data in the kernel on Linux, in order of preference.
+KERNEL_COPY_FUNCS = ("copy_file_range", "sendfile")
+
+#: Error numbers indicating that a method is not supported by the file system, rather than a failure for a single file.
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS,
+                      errno.EMLINK}
+
+#: Default chunk size for regular copies, in bytes.
+DEFAULT_CHUNK_SIZE = 8 * 2 ** 20
+
+# (method, device) pairs where the method has failed with an error from `UNSUPPORTED_ERRNOS`. The method is not
+# attempted again for destinations on the device. The kernel copy functions are tracked with the same mechanism.
+_unsupported = set()
+
+
+class CopyStats:
+    """
+    Number of files, bytes and seconds spent on regular copies, for each destination. The throughput for a
+    destination is logged every `log_interval` copies.
+
+    :param log_interval: Number of copies to a destination between each throughput log message.
+    :type log_interval: int
+    """
+    def __init__(self, log_interval=100):
+        self.log_interval = log_interval
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, destination, n_bytes, seconds):
+        """
+        Add a copy to the statistics for `destination`.
+
+        :param destination: Destination name, e.g. the base archive directory.
+        :type destination: str
+        :param n_bytes: Number of bytes copied
+        :type n_bytes: int
+        :param seconds: Time spent on the copy
+        :type seconds: float
+        """
+        with self._lock:
+            stats = self._stats.setdefault(destination, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += n_bytes
+            stats[2] += seconds
+            log = stats[0] % self.log_interval == 0
+        if log:
+            self.log(destination)
+
+    def get(self, destination):
+        """
+        Get the statistics for `destination`.
+
+        :param destination: Destination name
+        :type destination: str
+        :return: Number of files, number of bytes, and seconds spent copying.
+        :rtype: tuple
+        """
+        with self._lock:
+            return tuple(self._stats.get(destination, (0, 0, 0.0)))
+
+    def log(self, destination=None):
+        """
+        Log the throughput for `destination`, or for all destinations if `destination` is None.
+
+        :param destination: Destination name
+        :type destination: str | None
+        """
+        with self._lock:
+            destinations = list(self._stats.keys()) if destination is None else [destination]
+        for dest in destinations:
+            n_files, n_bytes, seconds = self.get(dest)
+            mib = n_bytes / 2 ** 20
+            LOGGER.info(__name__, f"Copied {n_files} file(s) ({mib:.1f} MiB) to '{dest}' in {seconds:.3f} s "
+                                  f"({mib / max(seconds, 1e-9):.1f} MiB/s).")
+
+
+def copy_file(source_file, destination_file, method="copy", chunk_size=DEFAULT_CHUNK_SIZE, kernel_copy=True,
+              destination=None):
+    """
+    Copy `source_file` to `destination_file` with `method`, falling back to a regular copy (`shutil.copy2`) if the
+    method is not possible. An existing destination file is replaced atomically.
+
+    :param source_file: Path to source file
+    :type source_file: str
+    :param destination_file: Path to destination file. The parent directory must exist.
+    :type destination_file: str
+    :param method: Copy method. Must be one of `METHODS`.
+    :type method: str
+    :param chunk_size: Chunk size for regular copies, in bytes.
+    :type chunk_size: int
+    :param kernel_copy: Copy the data in the kernel on Linux, when possible?
+    :type kernel_copy: bool
+    :param destination: Destination name used for the throughput statistics in `COPY_STATS`. If None, the directory
+                        of `destination_file` is used.
+    :type destination: str | None
+    :return: The method which was used.
+    :rtype: str
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown copy method '{method}'. Must be one of {list(METHODS)}.")
+    candidates = AUTO_METHODS if method == "auto" else (method, "copy")
+
+    if candidates[0] != "copy":
+        source_dev = os.stat(source_file).st_dev
+        destination_dev = os.stat(os.path.dirname(os.path.abspath(destination_file))).st_dev
+        if source_dev != destination_dev:
+            # Linking and cloning is only possible within a file system.
+            candidates = ("copy",)
+
+    temp_path = atomic_write.get_temp_path(destination_file)
+    for candidate in candidates:
+        if candidate == "copy":
+            start_time = time.time()
+            try:
+                n_bytes = _copy_data(source_file, temp_path, chunk_size, kernel_copy)
+                # Preserve the metadata, like `shutil.copy2`.
+                copystat(source_file, temp_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            atomic_write.commit_temp_file(temp_path, destination_file)
+            if destination is None:
+                destination = os.path.dirname(os.path.abspath(destination_file))
+            COPY_STATS.add(destination, n_bytes, time.time() - start_time)
+            return candidate
+        if (candidate, destination_dev) in _unsupported:
+            continue
+        try:
+            _COPY_FUNCS[candidate](source_file, temp_path)
+        except OSError as err:
+            if err.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            _unsupported.add((candidate, destination_dev))
+            LOGGER.info(__name__, f"Copy method '{candidate}' is not supported for destination '{destination_file}' "
+                                  f"({err}). Falling back to the next method.")
+            continue
+        atomic_write.commit_temp_file(temp_path, destination_file)
+        return candidate
+
+
+def _copy_data(source_file, destination_file, chunk_size, kernel_copy):
+    """
+    Copy the contents of `source_file` to `destination_file`.
+
+    :param source_file: Path to source file
+    :type source_file: str
+    :param destination_file: Path to destination file
+    :type destination_file: str
+    :param chunk_size: Chunk size, in bytes.
+    :type chunk_size: int
+    :param kernel_copy: Copy the data in the kernel on Linux, when possible?
+    :type kernel_copy: bool
+    :return: Number of bytes copied
+    :rtype: int
+    """
+    with open(source_file, "rb") as src, open(destination_file, "wb") as dst:
+        size = os.fstat(src.fileno()).st_size
+        if kernel_copy and sys.platform.startswith("linux"):
+            device = os.fstat(dst.fileno()).st_dev
+            for name in KERNEL_COPY_FUNCS:
+                if (name, device) in _unsupported or not hasattr(os, name):
+                    continue
+                try:
+                    return _kernel_copy(name, src.fileno(), dst.fileno(), size, chunk_size)
+                except OSError as err:
+                    if err.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    _unsupported.add((name, device))
+                    LOGGER.info(__name__, f"Kernel copy with '{name}' is not supported for destination "
+                                          f"'{destination_file}' ({err}). Falling back to the next method.")
+                    # Start over, in case the failed function copied some of the data.
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+
+        if size <= chunk_size:
+            return dst.write(src.read())
+        return _copy_overlapped(src, dst, chunk_size)
+
+
+def _kernel_copy(name, src_fd, dst_fd, size, chunk_size):
+    copied = 0
+    while copied < size:
+        count = min(chunk_size, size - copied)
+        if name == "copy_file_range":
+            n = os.copy_file_range(src_fd, dst_fd, count)
+        else:
+            n = os.sendfile(dst_fd, src_fd, copied, count)
+        if n == 0:
+            # The source file was truncated during the copy.
+            break
+        copied += n
+    return copied
+
+
+def _copy_overlapped(src, dst, chunk_size):
+    # Read the chunks in a separate thread, and write them in this thread.
+    chunks = queue.Queue(maxsize=config.COPY_READ_AHEAD_CHUNKS)
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                chunk = src.read(chunk_size)
+                chunks.put(chunk)
+                if not chunk:
+                    break
+        except BaseException as err:
+            chunks.put(err)
+
+    reader = threading.Thread(target=read, name="file-copy-reader", daemon=True)
+    reader.start()
+    copied = 0
+    try:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if not chunk:
+                break
+            copied += dst.write(chunk)
+    finally:
+        # Unblock the reader if the write failed, and wait for it before the source file is closed.
+        stop.set()
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        reader.join()
+    return copied
+
+
+def _link(source_file, destination_file):
+    os.link(source_file, destination_file)
+
+
+def _reflink(source_file, destination_file):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "Reflinks are not supported on this platform")
+    with open(source_file, "rb") as src, open(destination_file, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination_file)
+            raise
+    # Preserve the metadata, like `shutil.copy2`.
+    copystat(source_file, destination_file)
+
+
+_COPY_FUNCS = {
+    "link": _link,
+    "reflink": _reflink,
+}
+COPY_STATS = CopyStats(log_interval=config.COPY_STATS_LOG_INTERVAL)
@@ -0,0 +1,417 @@
+"""
+Pluggable JPEG decoders and encoders. The codecs wrap TensorFlow, OpenCV, PIL and (optionally) TurboJPEG, which all use
+libjpeg(-turbo) under the hood, but with very different overheads. When the codec name is "auto", a small benchmark is
+ran, and the fastest available codec is selected.
+"""
+import io
+import time
+import inspect
+import numpy as np
+from PIL import Image
+import cv2
+
+from src.Logger import LOGGER
+
+#: JPEG quality used when encoding images. This is equal to the default quality in PIL, which was used to write the
+#: output images before the codecs were introduced.
+DEFAULT_JPEG_QUALITY = 75
+
+#: Chroma subsampling used when encoding images. This is equal to the default subsampling in PIL.
+DEFAULT_JPEG_SUBSAMPLING = "4:2:0"
+
+#: Valid values for the chroma subsampling.
+SUBSAMPLINGS = ("4:4:4", "4:2:2", "4:2:0")
+
+#: Shape of the synthetic image used in the codec benchmark.
+BENCHMARK_IMAGE_SHAPE = (1024, 1536, 3)
+
+#: Number of repetitions for each codec in the benchmark.
+BENCHMARK_REPETITIONS = 3
+
+
+class CodecError(ValueError):
+    """Error raised when an image cannot be decoded or encoded."""
+    pass
+
+
+class BaseCodec:
+    """
+    Base class for image codecs. Should be subclassed, and not used as-is.
+    """
+    name = None
+
+    @staticmethod
+    def is_available():
+        """
+        Check if the codec can be used in the current environment.
+
+        :return: True if the codec is available, False otherwise.
+        :rtype: bool
+        """
+        return True
+
+    def decode(self, data, get_buffer=None):
+        """
+        Decode the JPEG-encoded `data` to an RGB image.
+
+        :param data: Encoded image
+        :type data: bytes
+        :param get_buffer: Optional function which is called with the image shape, and returns a writable uint8 array
+                           with that shape. The image is decoded into the array, if the codec supports it, or copied
+                           into it otherwise. If None, a new array is allocated.
+        :type get_buffer: function | None
+        :return: Decoded image with shape (height, width, 3) and dtype uint8.
+        :rtype: np.ndarray
+        """
+        raise NotImplementedError
+
+    def encode(self, img, quality=DEFAULT_JPEG_QUALITY, subsampling=DEFAULT_JPEG_SUBSAMPLING, optimize=False,
+               progressive=False):
+        """
+        Encode the RGB image `img` as JPEG. Raises `CodecError` if the codec does not support the given parameters.
+
+        :param img: Image with shape (height, width, 3) and dtype uint8.
+        :type img: np.ndarray
+        :param quality: JPEG quality (0-100).
+        :type quality: int
+        :param subsampling: Chroma subsampling. Must be one of `SUBSAMPLINGS`.
+        :type subsampling: str
+        :param optimize: Compute optimal Huffman tables? Gives smaller files, at the cost of a slower encoding.
+        :type optimize: bool
+        :param progressive: Write a progressive JPEG?
+        :type progressive: bool
+        :return: Encoded image
+        :rtype: bytes
+        """
+        raise NotImplementedError
+
+
+class TFCodec(BaseCodec):
+    """
+    Codec using `tf.io.decode_jpeg` and `tf.io.encode_jpeg`. TensorFlow is imported lazily, in order to avoid importing
+    it in the asynchronous workers.
+    """
+    name = "tf"
+
+    def decode(self, data, get_buffer=None):
+        import tensorflow as tf
+        try:
+            return _copy_to_buffer(tf.io.decode_jpeg(data, channels=3).numpy(), get_buffer)
+        except tf.errors.InvalidArgumentError as err:
+            raise CodecError(f"TensorFlow could not decode image: {err}") from err
+
+    def encode(self, img, quality=DEFAULT_JPEG_QUALITY, subsampling=DEFAULT_JPEG_SUBSAMPLING, optimize=False,
+               progressive=False):
+        import tensorflow as tf
+        if subsampling == "4:2:2":
+            raise CodecError("TensorFlow does not support 4:2:2 chroma subsampling.")
+        return tf.io.encode_jpeg(img, quality=quality, progressive=progressive, optimize_size=optimize,
+                                 chroma_downsampling=(subsampling == "4:2:0")).numpy()
+
+
+class OpenCVCodec(BaseCodec):
+    """
+    Codec using `cv2.imdecode` and `cv2.imencode`. OpenCV is linked against libjpeg-turbo, and releases the GIL while
+    decoding/encoding.
+    """
+    name = "opencv"
+
+    def decode(self, data, get_buffer=None):
+        buf = np.frombuffer(data, dtype=np.uint8)
+        # Ignore the EXIF orientation, to get the same pixel layout as the other codecs.
+        img = cv2.imdecode(buf, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if img is None:
+            raise CodecError("OpenCV could not decode image.")
+        # OpenCV decodes to BGR. The conversion to RGB is written directly to the buffer (or in-place), so the image is
+        # not copied again.
+        dst = img if get_buffer is None else get_buffer(img.shape)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=dst)
+        return dst
+
+    def encode(self, img, quality=DEFAULT_JPEG_QUALITY, subsampling=DEFAULT_JPEG_SUBSAMPLING, optimize=False,
+               progressive=False):
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality), cv2.IMWRITE_JPEG_OPTIMIZE, int(optimize),
+                  cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)]
+        if subsampling != "4:2:0":
+            # The subsampling can only be set in OpenCV >= 4.5.5. Older versions always use 4:2:0.
+            factor_name = "IMWRITE_JPEG_SAMPLING_FACTOR_" + subsampling.replace(":", "")
+            if not hasattr(cv2, factor_name):
+                raise CodecError(f"This version of OpenCV does not support {subsampling} chroma subsampling.")
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, getattr(cv2, factor_name)]
+
+        bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        ok, buf = cv2.imencode(".jpg", bgr, params)
+        if not ok:
+            raise CodecError("OpenCV could not encode image.")
+        return buf.tobytes()
+
+
+class PILCodec(BaseCodec):
+    """
+    Codec using `PIL.Image`.
+    """
+    name = "pil"
+
+    def decode(self, data, get_buffer=None):
+        try:
+            rgb_img = Image.open(io.BytesIO(data)).convert("RGB")
+            if get_buffer is not None:
+                return _copy_to_buffer(np.asarray(rgb_img), get_buffer)
+            # `np.asarray` would give a read-only view of the PIL image. The decoded image is drawn on in place, so it
+            # must be writable.
+            return np.array(rgb_img)
+        except OSError as err:
+            raise CodecError(f"PIL could not decode image: {err}") from err
+
+    def encode(self, img, quality=DEFAULT_JPEG_QUALITY, subsampling=DEFAULT_JPEG_SUBSAMPLING, optimize=False,
+               progressive=False):
+        buf = io.BytesIO()
+        Image.fromarray(img).save(buf, format="JPEG", quality=quality, subsampling=subsampling, optimize=optimize,
+                                  progressive=progressive)
+        return buf.getvalue()
+
+
+class TurboJPEGCodec(BaseCodec):
+    """
+    Codec using the TurboJPEG API of libjpeg-turbo directly, through the optional `PyTurboJPEG` package. This avoids the
+    color conversions and copies done by the other codecs. Only available if `PyTurboJPEG` is installed, and the
+    libjpeg-turbo shared library can be found.
+    """
+    name = "turbojpeg"
+
+    def __init__(self):
+        import turbojpeg
+        self._turbojpeg = turbojpeg
+        self._jpeg = turbojpeg.TurboJPEG()
+        # Newer versions of PyTurboJPEG can decode into an existing array.
+        self._decode_to_dst = "dst" in inspect.signature(self._jpeg.decode).parameters
+
+    @staticmethod
+    def is_available():
+        try:
+            import turbojpeg
+            turbojpeg.TurboJPEG()
+        except (ImportError, OSError, RuntimeError):
+            return False
+        return True
+
+    def decode(self, data, get_buffer=None):
+        try:
+            if get_buffer is not None and self._decode_to_dst:
+                width, height, _, _ = self._jpeg.decode_header(data)
+                buffer = get_buffer((height, width, 3))
+                self._jpeg.decode(data, pixel_format=self._turbojpeg.TJPF_RGB, dst=buffer)
+                return buffer
+            return _copy_to_buffer(self._jpeg.decode(data, pixel_format=self._turbojpeg.TJPF_RGB), get_buffer)
+        except OSError as err:
+            raise CodecError(f"TurboJPEG could not decode image: {err}") from err
+
+    def encode(self, img, quality=DEFAULT_JPEG_QUALITY, subsampling=DEFAULT_JPEG_SUBSAMPLING, optimize=False,
+               progressive=False):
+        # The TurboJPEG API has no separate flag for optimized Huffman tables, but progressive JPEGs are always
+        # optimized.
+        if optimize and not progressive:
+            raise CodecError("TurboJPEG only supports optimized Huffman tables for progressive JPEGs.")
+        jpeg_subsample = getattr(self._turbojpeg, "TJSAMP_" + subsampling.replace(":", ""))
+        flags = self._turbojpeg.TJFLAG_PROGRESSIVE if progressive else 0
+        return self._jpeg.encode(img, quality=quality, pixel_format=self._turbojpeg.TJPF_RGB,
+                                 jpeg_subsample=jpeg_subsample, flags=flags)
+
+
+#: Available codecs. <codec name>: <codec class>
+CODECS = {codec.name: codec for codec in [TFCodec, OpenCVCodec, PILCodec, TurboJPEGCodec]}
+
+#: Codecs considered when the encoder is "auto". TensorFlow is excluded, since encoding happens in the asynchronous
+#: workers, where we do not want to import TensorFlow.
+AUTO_ENCODERS = ("opencv", "pil", "turbojpeg")
+
+#: Codecs considered when the decoder is "auto".
+AUTO_DECODERS = ("tf", "opencv", "pil", "turbojpeg")
+
+#: Default encoder parameters. See `BaseCodec.encode`.
+DEFAULT_ENCODER_PARAMS = dict(quality=DEFAULT_JPEG_QUALITY, subsampling=DEFAULT_JPEG_SUBSAMPLING, optimize=False,
+                              progressive=False)
+
+# Codec instances and selected codec names (and encoder parameters) for the current process.
+_instances = {}
+_selected = {"decoder": "tf", "encoder": "pil", "encoder_params": DEFAULT_ENCODER_PARAMS}
+
+
+def get_codec(name):
+    """
+    Get the codec named `name`. Codec instances are cached for the lifetime of the process.
+
+    :param name: Codec name. Must be a key in `CODECS`.
+    :type name: str
+    :return: Codec instance
+    :rtype: BaseCodec
+    """
+    if name not in CODECS:
+        raise ValueError(f"Unknown image codec '{name}'. Must be one of {list(CODECS.keys())}.")
+    if name not in _instances:
+        codec_cls = CODECS[name]
+        if not codec_cls.is_available():
+            raise RuntimeError(f"Image codec '{name}' is not available.")
+        _instances[name] = codec_cls()
+    return _instances[name]
+
+
+def get_decoder():
+    """
+    Get the selected decoder. Defaults to the TensorFlow codec if `select_codecs` has not been called.
+
+    :return: Decoder
+    :rtype: BaseCodec
+    """
+    return get_codec(_selected["decoder"])
+
+
+def get_encoder_name():
+    """
+    Get the name of the selected encoder. The name (not the instance) should be passed to the asynchronous workers.
+
+    :return: Encoder name
+    :rtype: str
+    """
+    return _selected["encoder"]
+
+
+def get_encoder_params():
+    """
+    Get the parameters for the selected encoder. Like the encoder name, the parameters should be passed to the
+    asynchronous workers.
+
+    :return: Keyword-arguments to `BaseCodec.encode`.
+    :rtype: dict
+    """
+    return dict(_selected["encoder_params"])
+
+
+def select_codecs(decoder="auto", encoder="auto", encoder_params=None):
+    """
+    Select the decoder and encoder for the current process. When a codec name is "auto", the fastest available codec is
+    chosen with `benchmark_codecs`.
+
+    :param decoder: Decoder name, or "auto"
+    :type decoder: str
+    :param encoder: Encoder name, or "auto"
+    :type encoder: str
+    :param encoder_params: Keyword-arguments to `BaseCodec.encode`. Missing parameters are taken from
+                           `DEFAULT_ENCODER_PARAMS`. When `encoder` is "auto", only encoders which support the
+                           parameters are considered.
+    :type encoder_params: dict | None
+    :return: Names of the selected decoder and encoder
+    :rtype: tuple of str
+    """
+    encoder_params = {**DEFAULT_ENCODER_PARAMS, **(encoder_params or {})}
+    if decoder == "auto" or encoder == "auto":
+        decode_times, encode_times = benchmark_codecs(encoder_params=encoder_params)
+    if decoder == "auto":
+        decoder = _fastest(decode_times, AUTO_DECODERS)
+    if encoder == "auto":
+        encoder = _fastest(encode_times, AUTO_ENCODERS)
+
+    # Make sure that the codecs are valid and available, and that the encoder supports the parameters.
+    get_codec(decoder)
+    get_codec(encoder).encode(_synthetic_image((16, 16, 3)), **encoder_params)
+
+    _selected["decoder"] = decoder
+    _selected["encoder"] = encoder
+    _selected["encoder_params"] = encoder_params
+    LOGGER.info(__name__, f"Using image decoder '{decoder}' and image encoder '{encoder}' with parameters "
+                          f"{encoder_params}.")
+    return decoder, encoder
+
+
+def benchmark_codecs(shape=BENCHMARK_IMAGE_SHAPE, repetitions=BENCHMARK_REPETITIONS, encoder_params=None):
+    """
+    Run a micro-benchmark of decoding and encoding for all available codecs, using a synthetic image.
+
+    :param shape: Shape of the synthetic image
+    :type shape: tuple of int
+    :param repetitions: Number of repetitions for each codec. The fastest repetition is used.
+    :type repetitions: int
+    :param encoder_params: Keyword-arguments to `BaseCodec.encode`.
+    :type encoder_params: dict | None
+    :return: Two dicts with the best decoding and encoding time (in seconds) for each available codec. Codecs which
+             failed (for instance because they do not support `encoder_params`) are left out.
+    :rtype: tuple of dict
+    """
+    img = _synthetic_image(shape)
+    data = PILCodec().encode(img)
+    decode_times, encode_times = {}, {}
+
+    for name, codec_cls in CODECS.items():
+        if not codec_cls.is_available():
+            continue
+        codec = get_codec(name)
+        for times, kind, func in ((decode_times, "decoding", lambda: codec.decode(data)),
+                                  (encode_times, "encoding", lambda: codec.encode(img, **(encoder_params or {})))):
+            try:
+                times[name] = _best_time(func, repetitions)
+            except Exception as err:
+                LOGGER.warning(__name__, f"Got error '{err}' while benchmarking {kind} with image codec '{name}'. The "
+                                         f"codec will not be selected automatically for {kind}.")
+        LOGGER.debug(__name__, f"Codec '{name}': decode {1000 * decode_times.get(name, float('nan')):.1f} ms, encode "
+                               f"{1000 * encode_times.get(name, float('nan')):.1f} ms.")
+    return decode_times, encode_times
+
+
+def benchmark_encoder(codec, images, repetitions=BENCHMARK_REPETITIONS, **encoder_params):
+    """
+    Measure the encoding time and output size for `codec` with the given parameters.
+
+    :param codec: Codec instance
+    :type codec: BaseCodec
+    :param images: Images to encode, each with shape (height, width, 3) and dtype uint8.
+    :type images: list of np.ndarray
+    :param repetitions: Number of repetitions for each image. The fastest repetition is used.
+    :type repetitions: int
+    :param encoder_params: Keyword-arguments to `BaseCodec.encode`.
+    :type encoder_params:
+    :return: Mean encoding time (in seconds) and mean output size (in bytes) per image.
+    :rtype: tuple of float
+    """
+    times, sizes = [], []
+    for img in images:
+        times.append(_best_time(lambda: codec.encode(img, **encoder_params), repetitions))
+        sizes.append(len(codec.encode(img, **encoder_params)))
+    return float(np.mean(times)), float(np.mean(sizes))
+
+
+def _copy_to_buffer(img, get_buffer):
+    # Fallback for decoders which can not decode into an existing array.
+    if get_buffer is None:
+        return img
+    buffer = get_buffer(img.shape)
+    np.copyto(buffer, img)
+    return buffer
+
+
+def _fastest(times, candidates):
+    times = {name: t for name, t in times.items() if name in candidates}
+    if not times:
+        raise RuntimeError(f"None of the image codecs {list(candidates)} are available.")
+    return min(times, key=times.get)
+
+
+def _best_time(func, repetitions):
+    # Warm-up call. Some codecs do lazy initialization on the first call.
+    func()
+    best = float("inf")
+    for _ in range(repetitions):
+        start_time = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def _synthetic_image(shape):
+    # Smooth gradients with some noise, to get a compression ratio roughly similar to natural images.
+    height, width, _ = shape
+    rows = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    cols = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    channels = np.array([0.2, 0.5, 0.8], dtype=np.float32)[None, None, :]
+    noise = np.random.RandomState(42).randint(0, 16, size=shape).astype(np.float32)
+    img = (channels * rows + (1 - channels) * cols + noise)
+    return np.clip(img, 0, 255).astype(np.uint8)
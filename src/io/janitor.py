@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+
+from src.Logger import LOGGER
+from src.io.file_access_guard import wait_until_path_is_found, PathNotReachableError
+from src.io.directory_cache import DIRECTORY_CACHE
+
+# Sentinel which stops the janitor thread.
+_STOP = object()
+
+
+class Janitor:
+    """
+    Background thread which deletes input images, and removes the input folders which become empty.
+
+    Images are submitted with `Janitor.submit` after all their output files have been verified. The submitted images
+    are deleted in batches, grouped by input directory, so the directory only has to be checked once per batch. Empty
+    folders are pruned once the janitor has moved on to images in another directory (or when the janitor is closed), so
+    each directory is only pruned once it is done, instead of after every image.
+    """
+    def __init__(self):
+        self.n_deleted = 0
+        self._queue = queue.Queue()
+        # Directories with deleted images, which have not been pruned yet. <input directory>: <base input directory>
+        self._unpruned_dirs = {}
+        self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+        self._thread.start()
+
+    def submit(self, paths):
+        """
+        Submit an image for deletion. Only submit images whose output files have been verified.
+
+        :param paths: Paths object representing the image file.
+        :type paths: src.io.TreeWalker.Paths
+        """
+        self._queue.put(paths)
+
+    @property
+    def n_pending(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """
+        Delete the remaining submitted images, prune the remaining folders, and stop the janitor thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            # Block until an image is submitted, and then take all images which are waiting.
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = _STOP in batch
+            batch = [paths for paths in batch if paths is not _STOP]
+            try:
+                self._process_batch(batch, prune_all=stop)
+            except Exception as err:
+                # Never let the janitor thread die, as that would leave the submitted images in place silently.
+                LOGGER.error(__name__, f"Got error while deleting input files: {err}", save=False, email=True,
+                             email_mode="error")
+
+    def _process_batch(self, batch, prune_all=False):
+        groups = {}
+        for paths in batch:
+            groups.setdefault(paths.input_dir, []).append(paths)
+
+        for input_dir, group in groups.items():
+            self._delete_group(group)
+            self._unpruned_dirs[input_dir] = group[0].base_input_dir
+
+        # Prune the directories which did not receive any new images in this batch.
+        for input_dir in list(self._unpruned_dirs):
+            if prune_all or input_dir not in groups:
+                base_input_dir = self._unpruned_dirs.pop(input_dir)
+                remove_empty_folders(start_dir=input_dir, top_dir=base_input_dir)
+
+    def _delete_group(self, group):
+        # All images in the group are located in the same directory, so it is sufficient to wait for the directory once.
+        try:
+            wait_until_path_is_found(group[0].input_dir)
+        except PathNotReachableError as err:
+            LOGGER.error(__name__, f"Could not remove {len(group)} input file(s): {err}", save=False, email=True,
+                         email_mode="error")
+            return
+
+        for paths in group:
+            try:
+                os.remove(paths.input_file)
+            except OSError as err:
+                LOGGER.error(__name__, f"Could not remove input file {paths.input_file}: {err}", save=False,
+                             email=False)
+                continue
+            self.n_deleted += 1
+            LOGGER.debug(__name__, f"Input file removed: {paths.input_file}")
+
+
+def remove_empty_folders(start_dir, top_dir):
+    """
+    Bottom-up removal of empty folders. If `start_dir` is empty, it will be removed. If `start_dir`'s parent directory
+    is empty after removing `start_dir`, it too will be removed. This process i continued until a parent is non-empty,
+    or the current directory is equal to `top_dir`. (The `top_dir` directory will not be removed).
+
+    NOTE: Use full paths when using this function, to avoid problems when comparing the current directory to `top_dir`.
+
+    :param start_dir: Path to bottom directory to remove if empty.
+    :type start_dir: str
+    :param top_dir: Top directory. Only folders under this will be deleted.
+    :type top_dir:
+    """
+    assert start_dir.startswith(top_dir), f"remove_empty_folders: Invalid top directory '{top_dir}' for start " \
+                                          f"directory '{start_dir}'"
+    current_dir = start_dir
+    while os.path.isdir(current_dir) and not os.listdir(current_dir) and current_dir != top_dir:
+        os.rmdir(current_dir)
+        DIRECTORY_CACHE.invalidate(current_dir)
+        LOGGER.debug(__name__, f"Input folder removed: {current_dir}")
+        current_dir = os.path.dirname(current_dir)
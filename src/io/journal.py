@@ -0,0 +1,167 @@
+import os
+import json
+import threading
+
+import config
+from src.Logger import LOGGER
+
+
+BEGIN = "begin"
+COMMIT = "commit"
+
+
+class Journal:
+    """
+    Append-only write-ahead journal for the images which are being exported. A "begin" record is appended before the
+    workers for an image are started, and a "commit" record is appended when all output files for the image have been
+    verified. Images with a "begin" record, but no "commit" record, were not finished, and their output files are
+    removed by `src.io.file_checker.clear_cache` on the next run. The "begin" record holds the fsync policy used to
+    write the output files, which determines whether complete output files can be kept.
+
+    Each record is a JSON object on a separate line. The journal is compacted (rewritten with only the unfinished
+    images) when the number of records exceeds `compact_threshold`.
+
+    :param compact_threshold: Number of records in the journal file which triggers compaction.
+    :type compact_threshold: int
+    """
+    def __init__(self, compact_threshold=1000):
+        self.compact_threshold = compact_threshold
+        self.file_path = None
+
+        self._file = None
+        self._pending = {}
+        self._n_records = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_default_file():
+        """
+        Get the path to the journal file in the cache directory.
+
+        :return: Path to journal file
+        :rtype: str
+        """
+        return os.path.join(config.CACHE_DIRECTORY, config.JOURNAL_FILENAME)
+
+    def open(self, file_path=None):
+        """
+        Open the journal file for appending. Unfinished images already in the journal are kept.
+
+        :param file_path: Path to journal file. If this is None, `Journal.get_default_file` will be used.
+        :type file_path: str | None
+        """
+        self.close()
+        with self._lock:
+            self.file_path = file_path if file_path is not None else self.get_default_file()
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            self._pending = read_pending(self.file_path)
+            self._n_records = len(self._pending)
+            self._rewrite()
+
+    def close(self):
+        """
+        Compact and close the journal file.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._rewrite()
+            self._file.close()
+            self._file = None
+
+    def _append(self, record):
+        if self._file is None:
+            raise RuntimeError("The journal has not been opened.")
+        self._file.write(json.dumps(record) + "\n")
+        # Flush, so the record is written even if the process is killed.
+        self._file.flush()
+        self._n_records += 1
+
+    def _rewrite(self):
+        # Rewrite the journal file with the "begin" records of the unfinished images.
+        if self._file is not None:
+            self._file.close()
+        tmp_file = self.file_path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for record in self._pending.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_file, self.file_path)
+        self._n_records = len(self._pending)
+        self._file = open(self.file_path, "a", encoding="utf-8")
+
+    def begin(self, paths):
+        """
+        Append a "begin" record for an image.
+
+        :param paths: Paths object representing the image file.
+        :type paths: src.io.TreeWalker.Paths
+        """
+        record = {"op": BEGIN, "key": paths.input_file, "paths": paths_to_dict(paths),
+                  "fsync_policy": config.fsync_policy}
+        with self._lock:
+            self._append(record)
+            self._pending[paths.input_file] = record
+
+    def commit(self, paths):
+        """
+        Append a "commit" record for an image. The journal is compacted if it has grown too large.
+
+        :param paths: Paths object representing the image file.
+        :type paths: src.io.TreeWalker.Paths
+        """
+        with self._lock:
+            if self._pending.pop(paths.input_file, None) is None:
+                LOGGER.warning(__name__, f"Attempted to commit image '{paths.input_file}', but it was not found in "
+                                         f"the journal.")
+                return
+            self._append({"op": COMMIT, "key": paths.input_file})
+            if self._n_records > self.compact_threshold:
+                self._rewrite()
+
+    @property
+    def n_pending(self):
+        return len(self._pending)
+
+
+def paths_to_dict(paths):
+    """
+    Get the arguments required to recreate a `src.io.TreeWalker.Paths` object.
+
+    :param paths: Paths object representing the image file.
+    :type paths: src.io.TreeWalker.Paths
+    :return: Keyword-arguments to `src.io.TreeWalker.Paths`.
+    :rtype: dict
+    """
+    return dict(base_input_dir=paths.base_input_dir, base_mirror_dirs=paths.base_mirror_dirs,
+                input_dir=paths.input_dir, mirror_dirs=paths.mirror_dirs, filename=paths.filename)
+
+
+def read_pending(file_path):
+    """
+    Scan the journal file and find the images which were not finished.
+
+    :param file_path: Path to journal file
+    :type file_path: str
+    :return: "begin" records for the unfinished images. <key>: <record>
+    :rtype: dict
+    """
+    pending = {}
+    if not os.path.isfile(file_path):
+        return pending
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last record might be incomplete if the program was killed while writing it. Since the record is
+                # written before any output files, there is nothing to clean up for it.
+                continue
+            if record["op"] == BEGIN:
+                pending[record["key"]] = record
+            elif record["op"] == COMMIT:
+                pending.pop(record["key"], None)
+    return pending
+
+
+JOURNAL = Journal(compact_threshold=config.JOURNAL_COMPACT_THRESHOLD)
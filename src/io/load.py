@@ -0,0 +1,99 @@
+import io
+import numpy as np
+from PIL import Image
+
+import config
+from src.Pipeline import Pipeline, Stage
+from src.MemoryBudget import MEMORY_BUDGET
+from src.BufferPool import BUFFER_POOL
+from src.io.file_access_guard import wait_until_path_is_found, wait_until_reachable
+from src.io.tf_dataset import check_input_img
+from src.io import image_codecs
+from src.io import exif_util
+
+
+def read_image_data(item):
+    """
+    Pipeline stage function which reads the (encoded) contents of the input file. Memory for the decoded image is
+    reserved in `src.MemoryBudget.MEMORY_BUDGET` before the item is passed on, so reading stops when the budget is
+    exhausted. Reading also stops while any of the base directories are unreachable.
+
+    :param item: Pipeline item representing the image.
+    :type item: src.Pipeline.PipelineItem
+    """
+    input_file = item.paths.input_file
+    # Stop prefetching while a share is unreachable. The image could not be written anyway.
+    wait_until_reachable()
+    wait_until_path_is_found([input_file])
+    with open(input_file, "rb") as f:
+        item.data = f.read()
+    MEMORY_BUDGET.acquire(input_file, estimate_decoded_bytes(item.data))
+
+
+def decode_image(item):
+    """
+    Pipeline stage function which decodes the image data with the decoder selected in `src.io.image_codecs`, and
+    checks that the image is valid. The image is decoded into a buffer from `src.BufferPool.BUFFER_POOL` (or copied into
+    it, if the decoder does not support it). The buffer is returned to the pool when the workers for the image are
+    finished. The EXIF data is also parsed from the image data, so the input file is only read once.
+
+    :param item: Pipeline item representing the image.
+    :type item: src.Pipeline.PipelineItem
+    """
+    # The buffers have a batch dimension, so the decoder gets a view of the buffer, and the buffer itself can be
+    # returned to the pool.
+    buffers = []
+
+    def _get_buffer(shape):
+        buffers.append(BUFFER_POOL.get((1, *shape), np.uint8))
+        return buffers[-1][0]
+
+    image_codecs.get_decoder().decode(item.data, get_buffer=_get_buffer)
+    img = buffers[-1]
+    check_input_img(img)
+    item.exif = exif_util.exif_from_bytes(item.data, item.paths.input_file)
+    item.image = img
+    item.pooled = True
+    if not config.selective_reencode:
+        # The encoded data is no longer needed.
+        item.data = None
+
+
+def estimate_decoded_bytes(data):
+    """
+    Estimate the number of bytes required to hold the decoded image. Only the image header is parsed.
+
+    :param data: Encoded image
+    :type data: bytes
+    :return: Estimated number of bytes. 0 if the header could not be parsed.
+    :rtype: int
+    """
+    if not MEMORY_BUDGET.enabled:
+        return 0
+    try:
+        with Image.open(io.BytesIO(data)) as pil_img:
+            width, height = pil_img.size
+    except OSError:
+        # The error will be raised (and handled) when the image is decoded.
+        return 0
+    return width * height * 3
+
+
+def get_image_pipeline(tree_walker):
+    """
+    Create the loading part of the processing pipeline: discover -> read -> decode. The number of threads and the queue
+    sizes are specified in `config`. The post-processing is not part of the pipeline. It is run by the workers in
+    `src.ImageProcessor.ImageProcessor`.
+
+    :param tree_walker: TreeWalker to use to locate images.
+    :type tree_walker: src.io.TreeWalker.TreeWalker
+    :return: Pipeline which yields `src.Pipeline.PipelineItem`s with decoded images.
+    :rtype: src.Pipeline.Pipeline
+    """
+    stages = [
+        Stage("read", read_image_data, n_workers=config.pipeline_read_threads,
+              queue_size=config.pipeline_queue_size),
+        Stage("decode", decode_image, n_workers=config.pipeline_decode_threads,
+              queue_size=config.pipeline_queue_size),
+    ]
+    return Pipeline(tree_walker.walk(), stages, source_name="discover", queue_size=config.pipeline_queue_size)
@@ -0,0 +1,181 @@
+"""
+Encoding and decoding of the masks written for each image. The format is selected with `config.mask_format`:
+
+* "webp_rgb": Lossy WebP, with the mask repeated in all three color channels. This is the original mask format.
+* "webp": Lossless RGB WebP. WebP has no grayscale mode, so the single-channel mask is converted to RGB before it is
+  encoded. The three channels are identical, and lossless WebP compresses the channel correlation and the large uniform
+  areas well, so the files are still much smaller than the lossy "webp_rgb" files.
+* "png": 1-bit PNG.
+* "rle": COCO-style run-length encoding, stored in the EXIF JSON file under the key `RLE_JSON_KEY`. No separate mask
+  file is written.
+"""
+import io
+import webp
+import numpy as np
+from PIL import Image
+
+#: Supported mask formats. <format name>: <file extension, or None if the mask is stored in the EXIF JSON file>
+MASK_FORMATS = {
+    "webp_rgb": "webp",
+    "webp": "webp",
+    "png": "png",
+    "rle": None,
+}
+
+#: Key of the run-length encoded mask in the EXIF JSON file, when `config.mask_format = "rle"`.
+RLE_JSON_KEY = "maske_rle"
+
+_mask_encoder_config = None
+
+
+def get_mask_extension(mask_format):
+    """
+    Get the file extension for mask files in the format `mask_format`.
+
+    :param mask_format: Mask format. Must be a key in `MASK_FORMATS`.
+    :type mask_format: str
+    :return: File extension, without the leading dot. None if the mask is stored in the EXIF JSON file.
+    :rtype: str | None
+    """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format '{mask_format}'. Must be one of {list(MASK_FORMATS.keys())}.")
+    return MASK_FORMATS[mask_format]
+
+
+def get_mask_encoder_config():
+    """
+    Get the WebP encoder configuration used for "webp_rgb" mask files. The configuration is created once per process.
+
+    :return: WebP encoder configuration
+    :rtype: webp.WebPConfig
+    """
+    global _mask_encoder_config
+    if _mask_encoder_config is None:
+        _mask_encoder_config = webp.WebPConfig.new()
+    return _mask_encoder_config
+
+
+def encode_mask(mask, mask_format):
+    """
+    Encode `mask` as a mask file.
+
+    :param mask: Boolean mask with shape (height, width)
+    :type mask: np.ndarray
+    :param mask_format: Mask format. Must be a key in `MASK_FORMATS`, with a file extension.
+    :type mask_format: str
+    :return: Contents of the mask file
+    :rtype: bytes
+    """
+    if mask_format == "webp_rgb":
+        rgb_mask = np.tile(mask[:, :, None], (1, 1, 3)).astype(np.uint8)
+        picture = webp.WebPPicture.from_numpy(rgb_mask, pilmode="RGB")
+        return bytes(picture.encode(get_mask_encoder_config()).buffer())
+
+    buf = io.BytesIO()
+    if mask_format == "webp":
+        # In lossless mode, `quality` and `method` control the compression effort. For binary masks, the lowest quality
+        # with method 1 gives (almost) the smallest files, at a fraction of the encoding time of the higher settings.
+        Image.fromarray(mask.astype(np.uint8) * 255).save(buf, format="WEBP", lossless=True, quality=0, method=1)
+    elif mask_format == "png":
+        # Boolean arrays are converted to 1-bit images.
+        Image.fromarray(mask.astype(bool)).save(buf, format="PNG")
+    else:
+        raise ValueError(f"Mask format '{mask_format}' can not be written to a mask file.")
+    return buf.getvalue()
+
+
+def decode_mask(data, mask_format):
+    """
+    Decode a mask file written with `encode_mask`.
+
+    :param data: Contents of the mask file
+    :type data: bytes
+    :param mask_format: Mask format. Must be a key in `MASK_FORMATS`, with a file extension.
+    :type mask_format: str
+    :return: Boolean mask with shape (height, width)
+    :rtype: np.ndarray
+    """
+    if get_mask_extension(mask_format) is None:
+        raise ValueError(f"Mask format '{mask_format}' can not be read from a mask file.")
+    img = np.asarray(Image.open(io.BytesIO(data)))
+    if img.ndim == 3:
+        img = img[:, :, 0]
+    if img.dtype == bool:
+        return img
+    # The "webp_rgb" masks have the values 0 and 1, and the "webp" masks have the values 0 and 255.
+    return img > (0 if mask_format == "webp_rgb" else 127)
+
+
+def rle_encode(mask):
+    """
+    Run-length encode `mask` in the compressed COCO RLE format. The result can be decoded with `rle_decode`, or with
+    `pycocotools.mask.decode`.
+
+    :param mask: Boolean mask with shape (height, width)
+    :type mask: np.ndarray
+    :return: Dict with the mask shape as [height, width] (key "size"), and the compressed run-lengths (key "counts").
+    :rtype: dict
+    """
+    height, width = mask.shape
+    # COCO RLE uses column-major order, and starts with a run of zeros.
+    flat = mask.ravel(order="F")
+    change_idx = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], change_idx, [flat.size])))
+    if flat.size > 0 and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [int(height), int(width)], "counts": _counts_to_string(counts.tolist())}
+
+
+def rle_decode(rle):
+    """
+    Decode a run-length encoded mask from `rle_encode`.
+
+    :param rle: Run-length encoded mask
+    :type rle: dict
+    :return: Boolean mask with shape (height, width)
+    :rtype: np.ndarray
+    """
+    height, width = rle["size"]
+    counts = _string_to_counts(rle["counts"])
+    values = np.arange(len(counts)) % 2 == 1
+    flat = np.repeat(values, counts)
+    assert flat.size == height * width, f"Invalid RLE: Got {flat.size} values for mask of size {rle['size']}."
+    return flat.reshape((height, width), order="F")
+
+
+def _counts_to_string(counts):
+    # The compressed COCO RLE string (`rleToString` in pycocotools). Counts are delta-coded against the count two
+    # positions back (the previous run of the same value), and written as 5-bit groups in printable characters.
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def _string_to_counts(string):
+    # Inverse of `_counts_to_string` (`rleFrString` in pycocotools).
+    counts = []
+    pos = 0
+    while pos < len(string):
+        x, k, more = 0, 0, True
+        while more:
+            c = ord(string[pos]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            pos += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
@@ -1,19 +1,21 @@
 import os
-import webp
+import hashlib
 import numpy as np
-from shutil import copy2
-from PIL import Image
 import cv2
 
 import config
 from src.Logger import LOGGER
-from src.io.file_access_guard import wait_until_path_is_found
+from src.BufferPool import BUFFER_POOL
+from src.io.directory_cache import DIRECTORY_CACHE
+from src.io import atomic_write, file_copy, image_codecs, mask_formats, selective_jpeg
 
 
 def save_processed_img(img, mask_results, paths, draw_mask=False, local_mask=False, remote_mask=False, mask_color=None,
-                       blur=None, gray_blur=True, normalized_gray_blur=True):
+                       blur=None, gray_blur=True, normalized_gray_blur=True, encoder="pil", encoder_params=None,
+                       selective_reencode=False, original_data=None, mask_format="webp_rgb"):
     """
-    Save an image which has been processed by the masker.
+    Save an image which has been processed by the masker. This renders the image with `render_processed_img`, and
+    writes the results with `write_processed_img`.
 
     :param img: Input image
     :type img: np.ndarray
@@ -39,37 +41,166 @@ def save_processed_img(img, mask_results, paths, draw_mask=False, local_mask=Fal
     :param normalized_gray_blur: Normalize the gray level within each mask after blurring? This will make bright colors
                                  indistinguishable from dark colors. NOTE: Requires gray_blur=True.
     :type normalized_gray_blur: bool
+    :param encoder: Name of the codec used to encode the output image. See `src.io.image_codecs.CODECS`.
+    :type encoder: str
+    :param encoder_params: Keyword-arguments to the encoder. See `src.io.image_codecs.BaseCodec.encode`.
+    :type encoder_params: dict | None
+    :param selective_reencode: Only re-encode the parts of the image which intersect the masks? See
+                               `src.io.selective_jpeg`.
+    :type selective_reencode: bool
+    :param original_data: Contents of the original image file. Required for selective re-encoding.
+    :type original_data: bytes | None
+    :param mask_format: Format of the mask file. Must be a key in `src.io.mask_formats.MASK_FORMATS`, with a file
+                        extension.
+    :type mask_format: str
     :returns: 0
     :rtype: int
     """
-    # Make the output directory
-    os.makedirs(paths.output_dir, exist_ok=True)
+    rendered = render_processed_img(img, mask_results, draw_mask=draw_mask, encode_mask=(local_mask or remote_mask),
+                                    mask_color=mask_color, blur=blur, gray_blur=gray_blur,
+                                    normalized_gray_blur=normalized_gray_blur, encoder=encoder,
+                                    encoder_params=encoder_params, selective_reencode=selective_reencode,
+                                    original_data=original_data, mask_format=mask_format)
+    write_processed_img(rendered, paths, local_mask=local_mask, remote_mask=remote_mask)
+    return 0
 
-    # Compute a single boolean mask from all the detection masks.
-    detection_masks = mask_results["detection_masks"]
-    agg_mask = (detection_masks > 0).any(axis=1)
+
+def render_processed_img(img, mask_results, draw_mask=False, encode_mask=False, mask_color=None, blur=None,
+                         gray_blur=True, normalized_gray_blur=True, encoder="pil", encoder_params=None,
+                         selective_reencode=False, original_data=None, mask_format="webp_rgb"):
+    """
+    Draw the masks on the image, and encode the output image and the mask file. This is the CPU-bound part of
+    `save_processed_img`. No files are written.
+
+    :param img: Input image
+    :type img: np.ndarray
+    :param mask_results: Dictionary containing masking results. Format must be as returned by Masker.mask.
+    :type mask_results: dict
+    :param draw_mask: Draw the mask on the image?
+    :type draw_mask: bool
+    :param encode_mask: Encode the mask file?
+    :type encode_mask: bool
+    :param mask_color: See `save_processed_img`.
+    :type mask_color: list | None
+    :param blur: See `save_processed_img`.
+    :type blur: int | float | None
+    :param gray_blur: See `save_processed_img`.
+    :type gray_blur: bool
+    :param normalized_gray_blur: See `save_processed_img`.
+    :type normalized_gray_blur: bool
+    :param encoder: Name of the codec used to encode the output image. See `src.io.image_codecs.CODECS`.
+    :type encoder: str
+    :param encoder_params: See `save_processed_img`.
+    :type encoder_params: dict | None
+    :param selective_reencode: See `save_processed_img`. The image is encoded with `encoder` if selective re-encoding
+                               is not possible.
+    :type selective_reencode: bool
+    :param original_data: See `save_processed_img`.
+    :type original_data: bytes | None
+    :param mask_format: See `save_processed_img`.
+    :type mask_format: str
+    :return: Dict with the encoded output image (key "image"), the encoded mask file (key "mask") and the run-length
+             encoded mask (key "mask_rle"). The mask is None if `encode_mask` is False, and the run-length encoded mask
+             is None unless `mask_format` is "rle".
+    :rtype: dict
+    """
+    # The aggregated mask, and the bounding rectangles of its connected components, are shared by the drawing, the
+    # blurring, the selective re-encoding and the mask encoding (including the run-length encoding for the EXIF data).
+    agg_mask = get_aggregated_mask(mask_results)
+    rects = get_mask_rects(agg_mask[0]) if mask_results["num_detections"] > 0 else []
 
     if draw_mask and mask_results["num_detections"] > 0:
         if blur is not None:
             _blur_mask_on_img(img, agg_mask, blur_factor=blur, gray_blur=gray_blur,
-                              normalized_gray_blur=normalized_gray_blur)
+                              normalized_gray_blur=normalized_gray_blur, rects=rects)
         else:
-            _draw_mask_on_img(img, mask_results, mask_color=mask_color)
+            _draw_mask_on_img(img, mask_results, mask_color=mask_color, agg_mask=agg_mask, rects=rects)
+
+    image_data = None
+    if selective_reencode and original_data is not None:
+        image_data = _encode_selective(img[0].astype(np.uint8), agg_mask[0], original_data, rects=rects)
+    if image_data is None:
+        image_data = image_codecs.get_codec(encoder).encode(img[0].astype(np.uint8), **(encoder_params or {}))
+
+    return {
+        "image": image_data,
+        "mask": mask_formats.encode_mask(agg_mask[0], mask_format) if encode_mask else None,
+        "mask_rle": mask_formats.rle_encode(agg_mask[0]) if mask_format == "rle" else None,
+    }
+
+
+def get_aggregated_mask(mask_results):
+    """
+    Get a single boolean mask from all the detection masks. If `mask_results` already contains the aggregated mask (key
+    "aggregated_mask"), it is returned without recomputing it.
+
+    :param mask_results: Dictionary containing masking results. Format must be as returned by Masker.mask.
+    :type mask_results: dict
+    :return: Boolean mask with shape (1, height, width)
+    :rtype: np.ndarray
+    """
+    if "aggregated_mask" in mask_results:
+        return mask_results["aggregated_mask"]
+    detection_masks = mask_results["detection_masks"]
+    if detection_masks.dtype != bool:
+        detection_masks = detection_masks > 0
+    return np.any(detection_masks, axis=1)
+
+
+def _encode_selective(img, mask, original_data, rects=None):
+    # Returns None if selective re-encoding is not possible, or not worthwhile.
+    jpeg_info = selective_jpeg.get_jpeg_info(original_data)
+    if jpeg_info is None or jpeg_info["size"] != (img.shape[1], img.shape[0]):
+        return None
+
+    regions = get_mask_regions(mask, pad=0, align=jpeg_info["mcu_size"], rects=rects)
+    if not regions:
+        return selective_jpeg.encode_selective(original_data, img, None, jpeg_info)
+
+    # jpegtran inserts one region per pass over the file, so the regions are replaced by their bounding rectangle, which
+    # is inserted in a single pass.
+    region = (min(r[0] for r in regions), max(r[1] for r in regions),
+              min(r[2] for r in regions), max(r[3] for r in regions))
+    if (region[1] - region[0]) * (region[3] - region[2]) > config.SELECTIVE_REENCODE_MAX_FRACTION * mask.size:
+        return None
+    return selective_jpeg.encode_selective(original_data, img, region, jpeg_info)
+
+
+def write_processed_img(rendered, paths, local_mask=False, remote_mask=False, checksums=False):
+    """
+    Write the results from `render_processed_img` to the output (and input) directory. This is the I/O-bound part of
+    `save_processed_img`.
+
+    :param rendered: Results from `render_processed_img`.
+    :type rendered: dict
+    :param paths: Paths object representing the image file.
+    :type paths: src.io.TreeWalker.Paths
+    :param local_mask: Write the Mask file to the input directory?
+    :type local_mask: bool
+    :param remote_mask: Write the Mask file to the output directory?
+    :type remote_mask: bool
+    :param checksums: Include checksums in the manifest?
+    :type checksums: bool
+    :returns: Manifest of the written files. See `get_manifest_entry`.
+    :rtype: dict
+    """
+    manifest = {}
+    # Make the output directory
+    DIRECTORY_CACHE.makedirs(paths.output_dir)
 
     # Save masked image
-    pil_img = Image.fromarray(img[0].astype(np.uint8))
-    pil_img.save(paths.output_file)
+    write_bytes(rendered["image"], paths.output_file, manifest=manifest, checksums=checksums)
 
     if local_mask:
-        wait_until_path_is_found([paths.input_dir])
-        _save_mask(agg_mask, paths.input_webp)
+        DIRECTORY_CACHE.wait_until_found([paths.input_dir])
+        write_bytes(rendered["mask"], paths.input_mask, manifest=manifest, checksums=checksums)
     if remote_mask:
-        wait_until_path_is_found([paths.output_dir])
-        _save_mask(agg_mask, paths.output_webp)
-    return 0
+        write_bytes(rendered["mask"], paths.output_mask, manifest=manifest, checksums=checksums)
+    return manifest
 
 
-def archive(paths, archive_mask=False, archive_json=False, assert_output_mask=True):
+def archive(paths, archive_mask=False, archive_json=False, assert_output_mask=True, checksums=False, method="copy",
+            chunk_size=file_copy.DEFAULT_CHUNK_SIZE, kernel_copy=True):
     """
     Copy the input image file (and possibly some output files) to the archive directory.
 
@@ -81,75 +212,292 @@ def archive(paths, archive_mask=False, archive_json=False, assert_output_mask=Tr
     :type archive_json: bool
     :param assert_output_mask: Assert that the output mask exists before archiving?
     :type assert_output_mask: bool
-    :returns: 0
-    :rtype: int
+    :param checksums: Include checksums in the manifest?
+    :type checksums: bool
+    :param method: Method used to copy the files. See `src.io.file_copy.METHODS`.
+    :type method: str
+    :param chunk_size: Chunk size for regular copies, in bytes.
+    :type chunk_size: int
+    :param kernel_copy: Copy the data in the kernel on Linux, when possible? See `src.io.file_copy.copy_file`.
+    :type kernel_copy: bool
+    :returns: Manifest of the written files. See `get_manifest_entry`.
+    :rtype: dict
     """
-    os.makedirs(paths.archive_dir, exist_ok=True)
+    manifest = {}
+    DIRECTORY_CACHE.makedirs(paths.archive_dir)
 
     if assert_output_mask:
-        assert os.path.isfile(paths.output_webp), f"Archiving aborted. Output mask '{paths.output_webp}' not found."
+        assert os.path.isfile(paths.output_mask), f"Archiving aborted. Output mask '{paths.output_mask}' not found."
 
-    _copy_file(paths.input_file, paths.archive_file)
+    copy_args = dict(method=method, chunk_size=chunk_size, kernel_copy=kernel_copy, destination=paths.base_archive_dir)
+    _copy_file(paths.input_file, paths.archive_file, manifest=manifest, checksums=checksums, **copy_args)
     if archive_mask:
-        _copy_file(paths.output_webp, paths.archive_webp)
+        _copy_file(paths.output_mask, paths.archive_mask, manifest=manifest, checksums=checksums, **copy_args)
     if archive_json:
-        _copy_file(paths.output_json, paths.archive_json)
-    return 0
+        _copy_file(paths.output_json, paths.archive_json, manifest=manifest, checksums=checksums, **copy_args)
+    return manifest
 
 
-def _copy_file(source_file, destination_file):
+def get_manifest_entry(size, checksum=None):
+    """
+    Create a manifest entry for a written file. A manifest is a dict `<file path>: <entry>`, which is returned by the
+    functions writing output files, and used by `src.io.file_checker` to verify the output files without accessing
+    the file system.
+
+    :param size: Size of the file in bytes
+    :type size: int
+    :param checksum: SHA-256 checksum of the file contents, or None if checksums are disabled.
+    :type checksum: str | None
+    :return: Manifest entry
+    :rtype: dict
+    """
+    return {"size": int(size), "checksum": checksum}
+
+
+def get_checksum(data=None, file_path=None):
+    """
+    Compute the SHA-256 checksum of `data`, or of the contents of the file at `file_path`.
+
+    :param data: Data to compute the checksum of.
+    :type data: bytes | None
+    :param file_path: File to compute the checksum of. Used if `data` is None.
+    :type file_path: str | None
+    :return: Hex digest
+    :rtype: str
+    """
+    sha = hashlib.sha256()
+    if data is not None:
+        sha.update(data)
+    else:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def write_bytes(data, file_path, manifest=None, checksums=False):
+    """
+    Atomically write `data` to `file_path` (see `src.io.atomic_write`), and add the file to `manifest`.
+
+    :param data: Data to write
+    :type data: bytes
+    :param file_path: Path to output file
+    :type file_path: str
+    :param manifest: Manifest to add the file to. Ignored if None.
+    :type manifest: dict | None
+    :param checksums: Include the checksum in the manifest entry?
+    :type checksums: bool
+    """
+    atomic_write.write_atomic(data, file_path)
+    if manifest is not None:
+        manifest[file_path] = get_manifest_entry(len(data), get_checksum(data=data) if checksums else None)
+
+
+def _copy_file(source_file, destination_file, manifest=None, checksums=False, **copy_args):
     if os.path.exists(destination_file):
         LOGGER.warning(__name__, f"Archive file {destination_file} already exists. The existing file will be "
                                  f"overwritten.")
-    copy2(source_file, destination_file)
+    used_method = file_copy.copy_file(source_file, destination_file, **copy_args)
+    LOGGER.debug(__name__, f"Archived '{source_file}' to '{destination_file}' with method '{used_method}'.")
+    if manifest is not None:
+        # The manifest describes the written copy, so an incomplete copy is caught when the output files are checked.
+        checksum = get_checksum(file_path=destination_file) if checksums else None
+        manifest[destination_file] = get_manifest_entry(os.path.getsize(destination_file), checksum)
 
 
-def _draw_mask_on_img(img, mask_results, mask_color=None):
-    detection_masks = mask_results["detection_masks"]
+def _draw_mask_on_img(img, mask_results, mask_color=None, agg_mask=None, rects=None):
     if mask_color is not None:
-        mask = (detection_masks > 0).any(axis=1)
-        img[mask] = np.array(mask_color)
-    else:
-        detection_classes = mask_results["detection_classes"][0]
-        for i in range(len(detection_classes)):
-            detected_label = detection_classes[i]
-            mask = detection_masks[:, i, ...] > 0
-            img[mask] = config.LABEL_COLORS.get(detected_label, config.DEFAULT_COLOR)
+        if agg_mask is None:
+            agg_mask = get_aggregated_mask(mask_results)
+        if rects is None:
+            rects = get_mask_rects(agg_mask[0])
+        # Fill the masked pixels within each component's bounding rectangle, instead of indexing the full image.
+        color = np.array(mask_color, dtype=img.dtype)
+        for x, y, w, h in rects:
+            np.copyto(img[0, y:y + h, x:x + w], color, where=agg_mask[0, y:y + h, x:x + w, None])
+        return
+
+    detection_masks = mask_results["detection_masks"]
+    detection_classes = mask_results["detection_classes"][0]
+    # Detections with non-empty masks, as (index, mask, bounding rectangle) tuples.
+    detections = []
+    for i in range(len(detection_classes)):
+        mask = detection_masks[0, i]
+        if mask.dtype != bool:
+            mask = mask > 0
+        rect = cv2.boundingRect(mask.view(np.uint8))
+        if rect[2] > 0 and rect[3] > 0:
+            detections.append((i, mask, rect))
+    if not detections:
+        return
+
+    # Only draw within the bounding rectangle of all the masks.
+    x0 = min(x for _, _, (x, _, _, _) in detections)
+    y0 = min(y for _, _, (_, y, _, _) in detections)
+    x1 = max(x + w for _, _, (x, _, w, _) in detections)
+    y1 = max(y + h for _, _, (_, y, _, h) in detections)
+
+    # Label map with the index (+1) of the detection to draw at each pixel. The detections are written in order, so
+    # later detections overwrite earlier ones, like when the masks are drawn one by one.
+    label_map = np.zeros((y1 - y0, x1 - x0), dtype=(np.uint8 if len(detection_classes) < 255 else np.uint16))
+    for i, mask, (x, y, w, h) in detections:
+        np.copyto(label_map[y - y0:y + h - y0, x - x0:x + w - x0], i + 1, where=mask[y:y + h, x:x + w])
+
+    # Look up the colors for all pixels at once, and copy them to the labelled pixels.
+    palette = np.array([config.DEFAULT_COLOR] + [config.LABEL_COLORS.get(label, config.DEFAULT_COLOR)
+                                                 for label in detection_classes], dtype=img.dtype)
+    colors = palette[label_map]
+    cv2.copyTo(colors, (label_map > 0).view(np.uint8), img[0, y0:y1, x0:x1])
 
 
-def _blur_mask_on_img(img, mask, blur_factor, gray_blur=True, normalized_gray_blur=True):
+def _blur_mask_on_img(img, mask, blur_factor, gray_blur=True, normalized_gray_blur=True, rects=None):
     ksize = int((blur_factor / 1000) * img.shape[2])
     if ksize < 3:
         # Return if the kernel size is very small. Filtering with this kernel size would have no effect.
         return
     if gray_blur and normalized_gray_blur:
-        _apply_normalized_gray_blur(img, mask, ksize)
+        apply_blur, max_ksize = _apply_normalized_gray_blur, int(1.2 * ksize)
     elif gray_blur:
-        _apply_gray_blur(img, mask, ksize)
+        apply_blur, max_ksize = _apply_gray_blur, ksize
     else:
-        _apply_color_blur(img, mask, ksize)
+        apply_blur, max_ksize = _apply_color_blur, ksize
 
+    # Only blur the regions around the masked pixels. The regions are padded with the kernel size, so the blurred values
+    # at the masked pixels are identical to the values obtained by blurring the full image.
+    regions = get_mask_regions(mask[0], pad=max_ksize, rects=rects)
+    full_frame = (len(regions) == 1 and regions[0] == (0, img.shape[1], 0, img.shape[2]))
+    for y0, y1, x0, x1 in regions:
+        apply_blur(img[:, y0:y1, x0:x1], mask[:, y0:y1, x0:x1], ksize, pooled=full_frame)
 
-def _apply_color_blur(img, mask, ksize):
-    blurred = cv2.blur(img[0], (ksize, ksize))[None, ...]
-    img[mask] = blurred[mask]
+
+def get_mask_rects(mask):
+    """
+    Get the bounding rectangles of the connected components in `mask`.
+
+    :param mask: Boolean mask with shape (height, width)
+    :type mask: np.ndarray
+    :return: Bounding rectangles as (x, y, width, height) tuples.
+    :rtype: list of tuple
+    """
+    # The bounding rectangles of the external contours are the bounding rectangles of the connected components. This is
+    # considerably faster than `cv2.connectedComponentsWithStats`, since the pixels inside the components are skipped.
+    mask = mask.view(np.uint8) if mask.dtype == bool else mask.astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(contour) for contour in contours]
+
+
+def get_mask_regions(mask, pad=0, align=(1, 1), rects=None):
+    """
+    Get rectangular regions which cover the pixels in `mask`. Each region is the bounding rectangle of a connected
+    component in `mask`, padded with `pad` pixels on each side, expanded to the grid given by `align`, and clipped to
+    the image. Overlapping regions are merged, so the returned regions are disjoint, and can be processed independently.
+
+    :param mask: Boolean mask with shape (height, width)
+    :type mask: np.ndarray
+    :param pad: Number of pixels to pad the bounding rectangles with. When blurring, this should be at least half the
+                kernel size.
+    :type pad: int
+    :param align: Grid size (width, height) to align the regions to. The region boundaries will be multiples of the grid
+                  size, except at the right and bottom edges of the image.
+    :type align: tuple of int
+    :param rects: Bounding rectangles of the connected components in `mask`, from `get_mask_rects`. Computed from
+                  `mask` if None.
+    :type rects: list of tuple | None
+    :return: Regions as (y_start, y_stop, x_start, x_stop) tuples.
+    :rtype: list of tuple
+    """
+    height, width = mask.shape
+    align_x, align_y = align
+    if rects is None:
+        rects = get_mask_rects(mask)
+    regions = []
+    for x, y, w, h in rects:
+        y0, y1 = _align_down(max(y - pad, 0), align_y), min(_align_up(y + h + pad, align_y), height)
+        x0, x1 = _align_down(max(x - pad, 0), align_x), min(_align_up(x + w + pad, align_x), width)
+        regions.append((y0, y1, x0, x1))
+
+    merged = True
+    while merged:
+        merged = False
+        disjoint = []
+        for region in regions:
+            for i, other in enumerate(disjoint):
+                if region[0] < other[1] and other[0] < region[1] and region[2] < other[3] and other[2] < region[3]:
+                    disjoint[i] = (min(region[0], other[0]), max(region[1], other[1]),
+                                   min(region[2], other[2]), max(region[3], other[3]))
+                    merged = True
+                    break
+            else:
+                disjoint.append(region)
+        regions = disjoint
+    return [tuple(int(v) for v in region) for region in regions]
+
+
+def _align_down(value, size):
+    return (value // size) * size
 
 
-def _apply_gray_blur(img, mask, ksize):
-    gray = cv2.cvtColor(img[0], cv2.COLOR_RGB2GRAY)
-    blurred = cv2.blur(gray, (ksize, ksize))[None, :, :, None]
-    img[mask] = blurred[mask]
+def _align_up(value, size):
+    return -(-value // size) * size
 
 
-def _apply_normalized_gray_blur(img, mask, ksize):
+def _get_buffer(shape, dtype, pooled):
+    # Buffers for the full image are reused from the pool. Buffers for smaller regions have arbitrary shapes, so they
+    # are allocated instead.
+    return BUFFER_POOL.get(shape, dtype) if pooled else np.empty(shape, dtype=dtype)
+
+
+def _put_buffers(buffers, pooled):
+    if pooled:
+        for buffer in buffers:
+            BUFFER_POOL.put(buffer)
+
+
+def _apply_color_blur(img, mask, ksize, pooled=True):
+    blurred = _get_buffer(img.shape[1:], img.dtype, pooled)
+    cv2.blur(img[0], (ksize, ksize), dst=blurred)
+    _copy_masked(blurred, mask, img, pooled)
+    _put_buffers([blurred], pooled)
+
+
+def _apply_gray_blur(img, mask, ksize, pooled=True):
+    gray = _to_gray(img, pooled)
+    blurred = _get_buffer(gray.shape, gray.dtype, pooled)
+    cv2.blur(gray, (ksize, ksize), dst=blurred)
+    _copy_masked(blurred, mask, img, pooled)
+    _put_buffers([gray, blurred], pooled)
+
+
+def _apply_normalized_gray_blur(img, mask, ksize, pooled=True):
     large_ksize = int(1.2 * ksize)
     default_gray_value = 100
-    gray = cv2.cvtColor(img[0], cv2.COLOR_RGB2GRAY)
-    blurred = cv2.blur(gray, (ksize, ksize))[None, :, :, None]
-    blurred_large = cv2.blur(gray, (large_ksize, large_ksize))[None, :, :, None]
-    img[mask] = blurred[mask] - blurred_large[mask] + default_gray_value
+    gray = _to_gray(img, pooled)
+    blurred = _get_buffer(gray.shape, gray.dtype, pooled)
+    blurred_large = _get_buffer(gray.shape, gray.dtype, pooled)
+    cv2.blur(gray, (ksize, ksize), dst=blurred)
+    cv2.blur(gray, (large_ksize, large_ksize), dst=blurred_large)
+    # Normalize the whole region in place. For integer images, the arithmetic wraps around, like it does when only the
+    # masked pixels are normalized.
+    np.subtract(blurred, blurred_large, out=blurred)
+    blurred += default_gray_value
+    _copy_masked(blurred, mask, img, pooled)
+    _put_buffers([gray, blurred, blurred_large], pooled)
+
+
+def _copy_masked(values, mask, img, pooled=True):
+    # Copy `values` to `img` at the masked pixels. Gray values are copied to all color channels. `cv2.copyTo` writes
+    # directly to the masked pixels, which is an order of magnitude faster than assigning with a boolean index.
+    if values.ndim == 3:
+        cv2.copyTo(values, mask[0].view(np.uint8), img[0])
+        return
+    color_values = _get_buffer(img.shape[1:], img.dtype, pooled)
+    cv2.cvtColor(values, cv2.COLOR_GRAY2RGB, dst=color_values)
+    cv2.copyTo(color_values, mask[0].view(np.uint8), img[0])
+    _put_buffers([color_values], pooled)
 
 
-def _save_mask(mask, output_webp):
-    mask = np.tile(mask[0, :, :, None], (1, 1, 3)).astype(np.uint8)
-    webp.imwrite(output_webp, mask, pilmode="RGB")
+def _to_gray(img, pooled=True):
+    # Convert to grayscale, using a buffer from the pool if `pooled` is True.
+    gray = _get_buffer(img.shape[1:3], img.dtype, pooled)
+    cv2.cvtColor(img[0], cv2.COLOR_RGB2GRAY, dst=gray)
+    return gray
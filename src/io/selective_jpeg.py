@@ -0,0 +1,144 @@
+"""
+Selective re-encoding of JPEG images. Instead of re-encoding the full anonymised image, only the MCU-aligned rectangle
+around the masks is encoded, and inserted into the original image at the coefficient level with a single
+`jpegtran -drop` pass. The DCT coefficients outside the rectangle are copied from the original file, so the output is
+lossless outside the rectangle, and the encoding cost is proportional to the area of the rectangle.
+
+`jpegtran` with support for `-drop` (IJG libjpeg 9 or newer) must be available. If it is not available, or the input
+image is not compatible, `encode_selective` returns None, and the caller should fall back to encoding the full image.
+"""
+import io
+import os
+import shutil
+import tempfile
+import functools
+import subprocess
+from PIL import Image, JpegImagePlugin
+
+import config
+from src.Logger import LOGGER
+
+#: MCU size (width, height) for the chroma subsampling values returned by `PIL.JpegImagePlugin.get_sampling`.
+MCU_SIZES = {
+    0: (8, 8),    # 4:4:4
+    1: (16, 8),   # 4:2:2
+    2: (16, 16),  # 4:2:0
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_jpegtran(executable=config.JPEGTRAN_EXECUTABLE):
+    """
+    Find a `jpegtran` executable which supports the `-drop` option. The result is cached for the lifetime of the
+    process.
+
+    :param executable: Name of, or path to, the `jpegtran` executable.
+    :type executable: str
+    :return: Path to the executable, or None if it was not found, or if it does not support `-drop`.
+    :rtype: str | None
+    """
+    path = shutil.which(executable)
+    if path is None:
+        return None
+    try:
+        # jpegtran prints the usage to stderr, and exits with a non-zero status.
+        proc = subprocess.run([path, "-help"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    usage = (proc.stdout + proc.stderr).decode("utf-8", errors="replace")
+    if "-drop" not in usage:
+        LOGGER.warning(__name__, f"'{path}' does not support the -drop option. Selective re-encoding is disabled.")
+        return None
+    return path
+
+
+def is_available():
+    """
+    Check if selective re-encoding can be used in the current environment.
+
+    :return: True if a `jpegtran` executable with support for `-drop` was found.
+    :rtype: bool
+    """
+    return get_jpegtran() is not None
+
+
+def get_jpeg_info(data):
+    """
+    Get the information required to re-encode regions of a JPEG image with `encode_selective`.
+
+    :param data: Contents of the JPEG file.
+    :type data: bytes
+    :return: Dict with the image size as (width, height) (key "size"), the MCU size as (width, height) (key
+             "mcu_size"), the quantization tables (key "qtables") and the subsampling (key "subsampling"). None if the
+             image is not a 3-component JPEG with standard subsampling.
+    :rtype: dict | None
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as pil_img:
+            if pil_img.format != "JPEG" or pil_img.mode != "RGB":
+                return None
+            subsampling = JpegImagePlugin.get_sampling(pil_img)
+            if subsampling not in MCU_SIZES:
+                return None
+            return dict(size=pil_img.size, mcu_size=MCU_SIZES[subsampling], qtables=pil_img.quantization,
+                        subsampling=subsampling)
+    except OSError:
+        return None
+
+
+def encode_selective(original_data, img, region, jpeg_info):
+    """
+    Encode the anonymised image `img` by re-encoding only `region`, and copying the remaining DCT coefficients from
+    `original_data`. Metadata from the original file is not copied. The file is processed with a single `jpegtran` pass.
+
+    :param original_data: Contents of the original JPEG file.
+    :type original_data: bytes
+    :param img: Anonymised image with shape (height, width, 3). Must have the same pixel layout as the original file.
+    :type img: np.ndarray
+    :param region: Region which contains all differences from the original image, as a (y_start, y_stop, x_start,
+                   x_stop) tuple. The region must be aligned to the MCU grid, except at the right and bottom edges of
+                   the image. If None, only the metadata is stripped.
+    :type region: tuple | None
+    :param jpeg_info: Information about the original file, from `get_jpeg_info`.
+    :type jpeg_info: dict
+    :return: Encoded image, or None if selective re-encoding failed.
+    :rtype: bytes | None
+    """
+    jpegtran = get_jpegtran()
+    if jpegtran is None:
+        return None
+
+    # Strip the metadata, like a full re-encode would.
+    args = [jpegtran, "-copy", "none"]
+    drop_file = None
+    try:
+        if region is not None:
+            # Encode the region with the original quantization tables and subsampling, so the coefficients can be
+            # inserted without re-quantization.
+            y0, y1, x0, x1 = region
+            buf = io.BytesIO()
+            Image.fromarray(img[y0:y1, x0:x1]).save(buf, format="JPEG", qtables=jpeg_info["qtables"],
+                                                    subsampling=jpeg_info["subsampling"])
+            drop_file = _write_temp_file(buf.getvalue())
+            args += ["-drop", f"+{x0}+{y0}", drop_file]
+        data = _run_jpegtran(args, original_data)
+    except (OSError, subprocess.CalledProcessError) as err:
+        LOGGER.warning(__name__, f"Selective re-encoding failed: {err}. Re-encoding the full image.")
+        return None
+    finally:
+        if drop_file is not None:
+            os.remove(drop_file)
+    return data
+
+
+def _write_temp_file(data):
+    # The file is closed before it is passed to jpegtran, since open files can not be opened again on Windows.
+    fd, file_path = tempfile.mkstemp(suffix=".jpg")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return file_path
+
+
+def _run_jpegtran(args, data):
+    proc = subprocess.run(args, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return proc.stdout
@@ -3,11 +3,13 @@ import tensorflow as tf
 
 import config
 from src.io.file_access_guard import wait_until_path_is_found
+from src.io import image_codecs
 
 
 def prepare_img(input_file):
     """
-    Load the image named `filename` from `input_dir`, and check that is is valid.
+    Load the image named `filename` from `input_dir`, and check that is is valid. The image is decoded with the decoder
+    selected in `src.io.image_codecs`.
 
     :param input_file: Path to input image
     :type input_file: tf.string
@@ -16,7 +18,15 @@ def prepare_img(input_file):
     """
     tf.numpy_function(wait_until_path_is_found, [input_file], tf.int32)
     img_data = tf.io.read_file(input_file)
-    img = tf.image.decode_jpeg(img_data)
+
+    decoder = image_codecs.get_decoder()
+    if isinstance(decoder, image_codecs.TFCodec):
+        img = tf.image.decode_jpeg(img_data)
+    else:
+        # Decode with the selected codec. A `CodecError` is converted to a `tf.errors.InvalidArgumentError`, just like
+        # the errors raised by `tf.image.decode_jpeg`.
+        img = tf.numpy_function(decoder.decode, [img_data], tf.uint8)
+        img.set_shape([None, None, 3])
     img = tf.expand_dims(img, 0)
 
     check_input_img_tf(img)
@@ -1,7 +1,9 @@
 import os
 import sys
 import time
+import signal
 import logging
+import threading
 import argparse
 from datetime import datetime, timedelta
 from socket import gethostname
@@ -11,15 +13,24 @@ import tensorflow as tf
 
 import config
 from src.io.TreeWalker import TreeWalker
-from src.io.tf_dataset import get_tf_dataset
+from src.io.load import get_image_pipeline
 from src.io.file_checker import clear_cache
+from src.io.directory_cache import DIRECTORY_CACHE
+from src.io.file_access_guard import REACHABILITY_MONITOR, PathNotReachableError, wait_until_reachable
+from src.io.journal import JOURNAL
+from src.io.image_codecs import select_codecs, CODECS, SUBSAMPLINGS
+from src.io.mask_formats import MASK_FORMATS, get_mask_extension
+from src.io import file_copy
+from src.io.atomic_write import FSYNC_POLICIES
 from src.Masker import Masker
 from src.Logger import LOGGER, LOG_SEP, config_string, logger_excepthook
 from src.ImageProcessor import ImageProcessor
+from src.MemoryBudget import MEMORY_BUDGET
 
 # Exceptions to catch when processing an image
 PROCESSING_EXCEPTIONS = (
     SystemError,
+    PathNotReachableError,
     tf.errors.InvalidArgumentError,
     tf.errors.UnknownError,
     tf.errors.NotFoundError,
@@ -57,6 +68,17 @@ def check_config(args):
         raise ValueError("Parameter 'archive_json' requires remote_json=True.")
     if config.archive_mask and not config.remote_mask:
         raise ValueError("Parameter 'archive_mask' requires remote_mask=True.")
+    if config.fsync_policy not in FSYNC_POLICIES:
+        raise ValueError(f"Parameter 'fsync_policy' must be one of {list(FSYNC_POLICIES)}.")
+    if config.archive_method not in file_copy.METHODS:
+        raise ValueError(f"Parameter 'archive_method' must be one of {list(file_copy.METHODS)}.")
+    if config.archive_chunk_size_mb <= 0:
+        raise ValueError("Parameter 'archive_chunk_size_mb' must be positive.")
+    if config.mask_format not in MASK_FORMATS:
+        raise ValueError(f"Parameter 'mask_format' must be one of {list(MASK_FORMATS.keys())}.")
+    if get_mask_extension(config.mask_format) is None and not config.remote_json:
+        # The masks are stored in the .json files, which are also used to detect the images which are already masked.
+        raise ValueError(f"Parameter mask_format='{config.mask_format}' requires remote_json=True.")
 
     if config.delete_input:
         LOGGER.warning(__name__, "Parameter 'delete_input' is enabled. This will permanently delete the original"
@@ -68,6 +90,12 @@ def check_config(args):
         # Otherwise this will raise an exception prompting the user to create the file.
         import src.email_sender
 
+    valid_codecs = ["auto", *CODECS.keys()]
+    assert config.image_decoder in valid_codecs, f"config.image_decoder must be one of {valid_codecs}"
+    assert config.image_encoder in valid_codecs, f"config.image_encoder must be one of {valid_codecs}"
+    assert 0 <= config.jpeg_quality <= 100, "config.jpeg_quality must be in [0, 100]"
+    assert config.jpeg_subsampling in SUBSAMPLINGS, f"config.jpeg_subsampling must be one of {list(SUBSAMPLINGS)}"
+
     valid_log_levels = ["DEBUG", "INFO", "WARNING", "ERROR"]
     assert config.log_level in valid_log_levels, f"config.log_level must be one of {valid_log_levels}"
 
@@ -91,13 +119,39 @@ def set_excepthook(hooks):
     sys.excepthook = excepthook
 
 
+def set_signal_handlers(pipeline, shutdown_event):
+    """
+    Handle SIGTERM and SIGINT by stopping the loading pipeline and setting `shutdown_event`, so the main loop can stop
+    masking new images, and drain the dispatched workers. A second signal stops the program immediately.
+
+    :param pipeline: Loading pipeline
+    :type pipeline: src.Pipeline.Pipeline
+    :param shutdown_event: Event which is set when a shutdown is requested.
+    :type shutdown_event: threading.Event
+    :return: The previous signal handlers. <signal number>: <handler>
+    :rtype: dict
+    """
+    def handler(signum, _frame):
+        if shutdown_event.is_set():
+            raise KeyboardInterrupt(f"Received signal {signum} during shutdown.")
+        shutdown_event.set()
+        pipeline.stop()
+        LOGGER.warning(__name__, f"Received signal {signum}. Stopping after the dispatched images are finished. Send "
+                                 f"the signal again to stop immediately.")
+
+    previous_handlers = {}
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        previous_handlers[signum] = signal.signal(signum, handler)
+    return previous_handlers
+
+
 def initialize():
     """
-    Get command line arguments, and initialize the TreeWalker and Masker.
+    Get command line arguments, and initialize the TreeWalker, the loading pipeline and the ImageProcessor.
 
-    :return: Command line arguments, an instance of `TreeWalker` initialized at the specified directories, and an
-             instance of `Masker` ready for masking.
-    :rtype: argparse.Namespace, TreeWalker, Masker
+    :return: Command line arguments, an instance of `TreeWalker` initialized at the specified directories, an instance
+             of `ImageProcessor` ready for masking, and the (not yet started) loading pipeline.
+    :rtype: argparse.Namespace, TreeWalker, ImageProcessor, src.Pipeline.Pipeline
     """
     # Register the logging excepthook
     except_hooks = [logger_excepthook]
@@ -144,31 +198,40 @@ def initialize():
     base_output_dir = os.path.abspath(args.output_folder)
     mirror_dirs = [base_output_dir]
     # Make the output directory
-    os.makedirs(base_output_dir, exist_ok=True)
+    DIRECTORY_CACHE.makedirs(base_output_dir)
 
     if args.archive_folder is not None:
         base_archive_dir = os.path.abspath(args.archive_folder)
         mirror_dirs.append(base_archive_dir)
         # Make the archive directory
-        os.makedirs(base_archive_dir, exist_ok=True)
+        DIRECTORY_CACHE.makedirs(base_archive_dir)
 
-    # Make the cache directory
+    # Make the cache directory, and open the journal
     os.makedirs(config.CACHE_DIRECTORY, exist_ok=True)
+    JOURNAL.open()
+
+    # Monitor the reachability of the base directories
+    REACHABILITY_MONITOR.register_base_dirs([base_input_dir, *mirror_dirs])
 
     # Configure the logger
     LOGGER.base_input_dir = base_input_dir
     LOGGER.base_output_dir = base_output_dir
 
+    # Select the image decoder and encoder. This will run a small benchmark if one of them is "auto".
+    encoder_params = dict(quality=config.jpeg_quality, subsampling=config.jpeg_subsampling,
+                          optimize=config.jpeg_optimize, progressive=config.jpeg_progressive)
+    select_codecs(decoder=config.image_decoder, encoder=config.image_encoder, encoder_params=encoder_params)
+
     # Initialize the walker
-    tree_walker = TreeWalker(base_input_dir, mirror_dirs, skip_webp=(not config.force_remask),
-                             precompute_paths=(not config.lazy_paths))
+    tree_walker = TreeWalker(base_input_dir, mirror_dirs, skip_masked=(not config.force_remask),
+                             precompute_paths=(not config.lazy_paths), mask_ext=get_mask_extension(config.mask_format))
     # Initialize the masker
     masker = Masker(mask_dilation_pixels=config.mask_dilation_pixels, max_num_pixels=config.max_num_pixels)
-    # Create the TensorFlow datatset
-    dataset_iterator = iter(get_tf_dataset(tree_walker))
+    # Create the loading pipeline (discover -> read -> decode)
+    pipeline = get_image_pipeline(tree_walker)
     # Initialize the ImageProcessor
     image_processor = ImageProcessor(masker=masker, max_num_async_workers=config.max_num_async_workers)
-    return args, tree_walker, image_processor, dataset_iterator
+    return args, tree_walker, image_processor, pipeline
 
 
 def get_estimated_done(time_at_iter_start, n_imgs, n_masked):
@@ -193,7 +256,7 @@ def get_estimated_done(time_at_iter_start, n_imgs, n_masked):
     return est_done
 
 
-def get_summary(tree_walker, image_processor, start_datetime):
+def get_summary(tree_walker, image_processor, start_datetime, n_unfinished=None):
     """
     Log a summary of the masking process.
 
@@ -203,6 +266,9 @@ def get_summary(tree_walker, image_processor, start_datetime):
     :type image_processor: src.ImageProcessor.ImageProcessor
     :param start_datetime: Datetime object indicating when the program started.
     :type start_datetime: datetime.datetime
+    :param n_unfinished: Number of dispatched images which were not finished when the program was stopped. None if
+                         the program was not stopped by a signal.
+    :type n_unfinished: int | None
     """
 
     lines = [
@@ -213,6 +279,10 @@ def get_summary(tree_walker, image_processor, start_datetime):
         f"Images skipped due to processing errors: {tree_walker.n_valid_images - image_processor.n_completed}",
         f"Masked images: {image_processor.n_completed}",
     ]
+    if n_unfinished is not None:
+        # Images which were not processed before the program was stopped should not be reported as processing errors.
+        lines[4] = f"Stopped by signal. Dispatched images which were not finished: {n_unfinished}. The remaining " \
+                   f"images will be processed in the next run."
     if len(tree_walker.mirror_folders) > 1:
         lines.insert(2, f"Archive folder: {tree_walker.mirror_folders[1]}")
     if len(tree_walker.mirror_folders) > 0:
@@ -231,31 +301,75 @@ def get_summary(tree_walker, image_processor, start_datetime):
     return summary
 
 
+def get_stage_depths(pipeline, image_processor):
+    """
+    Get the number of items waiting in each stage of the processing pipeline.
+
+    :param pipeline: Loading pipeline
+    :type pipeline: src.Pipeline.Pipeline
+    :param image_processor: `src.ImageProcessor.ImageProcessor` instance used when processing the images.
+    :type image_processor: src.ImageProcessor.ImageProcessor
+    :return: String-formatted queue depths
+    :rtype: str
+    """
+    depths = pipeline.queue_depths()
+    depths.update(image_processor.queue_depths())
+    return ", ".join(f"{name}={depth}" for name, depth in depths.items())
+
+
+def handle_processing_error(err, paths):
+    """
+    Log an error raised while processing an image. This saves the error image, and sends an error-email, if email
+    sending is enabled.
+
+    :param err: Exception raised while processing the image
+    :type err: BaseException
+    :param paths: Paths object representing the image file.
+    :type paths: src.io.TreeWalker.Paths
+    """
+    error_msg = f"'{str(err)}'. File: {paths.input_file}"
+    LOGGER.error(__name__, error_msg, save=True, email=True, email_mode="error")
+    # Release the memory reserved for the failed image.
+    MEMORY_BUDGET.release(paths.input_file)
+
+
 def main():
     """Run the masking."""
     # Initialize
     start_datetime = datetime.now()
-    args, tree_walker, image_processor, dataset_iterator = initialize()
+    args, tree_walker, image_processor, pipeline = initialize()
     n_imgs = "?" if config.lazy_paths else (tree_walker.n_valid_images + tree_walker.n_skipped_images)
 
-    # Mask images
+    # Mask images. The images are discovered, read and decoded in the pipeline's threads, while the masking is done
+    # in the main thread. Rendering, encoding and writing are done by the ImageProcessor's workers.
     time_at_iter_start = time.time()
-    for i, paths in enumerate(tree_walker.walk()):
+    shutdown_event = threading.Event()
+    previous_handlers = set_signal_handlers(pipeline, shutdown_event)
+    for i, item in enumerate(pipeline):
+        # Images which are loaded, but not masked, when a shutdown is requested, are processed in the next run.
+        if shutdown_event.is_set():
+            break
+
+        paths = item.paths
         count_str = f"{tree_walker.n_skipped_images + i + 1} of {n_imgs}"
         start_time = time.time()
         LOGGER.set_state(paths)
         LOGGER.info(__name__, LOG_SEP)
         LOGGER.info(__name__, f"Iteration: {count_str}.")
+        LOGGER.debug(__name__, f"Stage queue depths: {get_stage_depths(pipeline, image_processor)}")
+
+        # Errors raised while reading or decoding the image.
+        if item.error is not None:
+            handle_processing_error(item.error, paths)
+            continue
 
         # Catch potential exceptions raised while processing the image
         try:
-            # Get the image
-            img = next(dataset_iterator)
-            # Do the processing
-            image_processor.process_image(img, paths)
+            # Do not dispatch new workers while a share is unreachable. They would only fail and be retried.
+            wait_until_reachable()
+            image_processor.process_image(item.image, paths, item.exif, data=item.data, pooled=item.pooled)
         except PROCESSING_EXCEPTIONS as err:
-            error_msg = f"'{str(err)}'. File: {paths.input_file}"
-            LOGGER.error(__name__, error_msg, save=True, email=True, email_mode="error")
+            handle_processing_error(err, paths)
             continue
 
         est_done = get_estimated_done(time_at_iter_start, n_imgs, i+1)
@@ -263,13 +377,24 @@ def main():
         LOGGER.info(__name__, f"Iteration finished in {iter_time_delta} s.")
         LOGGER.info(__name__, f"Estimated completion: {est_done}")
 
-    # Close the image_processor. This will make sure that all exports are finished before we continue.
+    # Close the image_processor. This will make sure that all exports are finished before we continue. If a shutdown
+    # was requested, the workers are only given `config.shutdown_timeout_seconds` to finish.
     LOGGER.info(__name__, LOG_SEP)
     LOGGER.info(__name__, f"Writing output files for the remaining images.")
-    image_processor.close()
+    is_shutdown = shutdown_event.is_set()
+    n_unfinished = image_processor.close(timeout=(config.shutdown_timeout_seconds if is_shutdown else None))
+    pipeline.log_stats()
+    file_copy.COPY_STATS.log()
+    # Write the checkpoint. The journal is compacted, so it only contains the images which were not finished. Their
+    # output files are removed in the next run, before they are processed again.
+    LOGGER.info(__name__, f"Closing the journal with {JOURNAL.n_pending} unfinished image(s).")
+    JOURNAL.close()
+    for signum, previous_handler in previous_handlers.items():
+        signal.signal(signum, previous_handler)
 
     # Summary
-    summary_str = get_summary(tree_walker, image_processor, start_datetime)
+    summary_str = get_summary(tree_walker, image_processor, start_datetime,
+                              n_unfinished=(n_unfinished if is_shutdown else None))
     LOGGER.info(__name__, LOG_SEP)
     LOGGER.info(__name__, summary_str, email=True, email_mode="finished")
 
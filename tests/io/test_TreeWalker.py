@@ -13,13 +13,13 @@ EXPECTED_FILES = [
 ]
 
 
-@pytest.mark.parametrize("precompute_paths,skip_webp", [
+@pytest.mark.parametrize("precompute_paths,skip_masked", [
     (True, True),
     (True, False),
     (False, True),
     (False, False)
 ])
-def test_TreeWalker_find_files(get_tmp_data_dir, precompute_paths, skip_webp):
+def test_TreeWalker_find_files(get_tmp_data_dir, precompute_paths, skip_masked):
     """
     Check that the TreeWalker finds all the files it is supposed to find.
     """
@@ -29,7 +29,7 @@ def test_TreeWalker_find_files(get_tmp_data_dir, precompute_paths, skip_webp):
     base_output_dir = os.path.join(tmp_dir, "out")
 
     expected_files = EXPECTED_FILES.copy()
-    if skip_webp:
+    if skip_masked:
         # Copy ææå\test_1.webp to the corresponding output directory to simulate an already masked image
         output_dir = os.path.join(base_output_dir, "åæø")
         os.makedirs(output_dir)
@@ -41,7 +41,7 @@ def test_TreeWalker_find_files(get_tmp_data_dir, precompute_paths, skip_webp):
     expected_files = [os.path.join(base_input_dir, f) for f in expected_files]
 
     # Instantiate the TreeWalker
-    tree_walker = TreeWalker(input_folder=base_input_dir, mirror_folders=[base_output_dir], skip_webp=skip_webp,
+    tree_walker = TreeWalker(input_folder=base_input_dir, mirror_folders=[base_output_dir], skip_masked=skip_masked,
                              precompute_paths=precompute_paths)
 
     # Check files
@@ -49,6 +49,28 @@ def test_TreeWalker_find_files(get_tmp_data_dir, precompute_paths, skip_webp):
     assert set(found_files) == set(expected_files), "Found files do not match"
 
 
+@pytest.mark.parametrize("mask_ext", ["png", None])
+def test_TreeWalker_skip_masked_mask_ext(tmp_path, mask_ext):
+    base_input_dir = os.path.join(str(tmp_path), "in")
+    base_output_dir = os.path.join(str(tmp_path), "out")
+    os.makedirs(base_input_dir)
+    os.makedirs(base_output_dir)
+    for name in ["foo", "bar"]:
+        open(os.path.join(base_input_dir, name + ".jpg"), "w").close()
+    # 'foo' has a mask file, or a .json file if the masks are stored in the .json files.
+    open(os.path.join(base_output_dir, "foo." + (mask_ext or "json")), "w").close()
+    # A .webp file should not mark 'bar' as masked.
+    open(os.path.join(base_output_dir, "bar.webp"), "w").close()
+
+    tree_walker = TreeWalker(input_folder=base_input_dir, mirror_folders=[base_output_dir], mask_ext=mask_ext)
+    paths = list(tree_walker.walk())
+    assert [p.filename for p in paths] == ["bar.jpg"]
+    if mask_ext is None:
+        assert paths[0].output_mask is None
+    else:
+        assert paths[0].output_mask == os.path.join(base_output_dir, "bar.png")
+
+
 def test_TreeWalker_input_output_correspondence():
     """
     Make sure that the the mirror paths from the TreeWalker are correct.
@@ -0,0 +1,56 @@
+import os
+import pytest
+
+from src.io import atomic_write
+
+
+@pytest.mark.parametrize("fsync_policy", atomic_write.FSYNC_POLICIES)
+def test_write_atomic(tmp_path, fsync_policy):
+    file_path = os.path.join(str(tmp_path), "foo.jpg")
+    with open(file_path, "wb") as f:
+        f.write(b"old content which is longer than the new content")
+
+    atomic_write.write_atomic(b"new content", file_path, fsync_policy=fsync_policy)
+    atomic_write.sync_directories()
+    with open(file_path, "rb") as f:
+        assert f.read() == b"new content"
+    # No temporary files should be left behind.
+    assert os.listdir(str(tmp_path)) == ["foo.jpg"]
+
+
+def test_write_atomic_error(tmp_path):
+    file_path = os.path.join(str(tmp_path), "foo.jpg")
+    with open(file_path, "wb") as f:
+        f.write(b"old content")
+
+    # Writing a str to a binary file fails after the temporary file has been created.
+    with pytest.raises(TypeError):
+        atomic_write.write_atomic("new content", file_path, fsync_policy="none")
+    with open(file_path, "rb") as f:
+        assert f.read() == b"old content"
+    assert os.listdir(str(tmp_path)) == ["foo.jpg"]
+
+
+def test_write_atomic_invalid_policy(tmp_path):
+    with pytest.raises(ValueError):
+        atomic_write.write_atomic(b"foo", os.path.join(str(tmp_path), "foo.jpg"), fsync_policy="always")
+
+
+def test_commit_temp_file_same_file(tmp_path):
+    # Replacing a file with a hard link to itself should not leave the temporary file behind.
+    file_path = os.path.join(str(tmp_path), "foo.jpg")
+    with open(file_path, "wb") as f:
+        f.write(b"foo")
+    temp_path = atomic_write.get_temp_path(file_path)
+    os.link(file_path, temp_path)
+
+    atomic_write.commit_temp_file(temp_path, file_path, fsync_policy="file")
+    assert os.listdir(str(tmp_path)) == ["foo.jpg"]
+
+
+@pytest.mark.parametrize("file_path", ["foo.jpg", "foo.bar.json", ".foo"])
+def test_get_temp_target(file_path):
+    temp_path = atomic_write.get_temp_path(os.path.join("out", file_path))
+    assert os.path.dirname(temp_path) == "out"
+    assert atomic_write.get_temp_target(os.path.basename(temp_path)) == file_path
+    assert atomic_write.get_temp_target(file_path) is None
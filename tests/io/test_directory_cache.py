@@ -0,0 +1,45 @@
+import os
+from unittest import mock
+
+from src.io.directory_cache import DirectoryCache
+
+
+def test_DirectoryCache_makedirs(tmp_path):
+    cache = DirectoryCache()
+    new_dir = os.path.join(str(tmp_path), "foo", "bar")
+
+    cache.makedirs(new_dir)
+    assert os.path.isdir(new_dir)
+    assert new_dir in cache
+    # Parent directories should also be known.
+    assert os.path.join(str(tmp_path), "foo") in cache
+
+    # A known directory should not be created again.
+    with mock.patch("src.io.directory_cache.os.makedirs") as makedirs:
+        cache.makedirs(new_dir)
+    makedirs.assert_not_called()
+
+
+def test_DirectoryCache_wait_until_found(tmp_path):
+    cache = DirectoryCache()
+    with mock.patch("src.io.directory_cache.wait_until_path_is_found") as wait:
+        cache.wait_until_found([str(tmp_path)])
+        cache.wait_until_found([str(tmp_path)])
+    wait.assert_called_once_with([str(tmp_path)])
+
+
+def test_DirectoryCache_invalidate(tmp_path):
+    cache = DirectoryCache()
+    foo = os.path.join(str(tmp_path), "foo")
+    foobar = os.path.join(str(tmp_path), "foobar")
+    cache.makedirs(os.path.join(foo, "bar"))
+    cache.makedirs(foobar)
+
+    cache.invalidate(foo)
+    assert foo not in cache
+    assert os.path.join(foo, "bar") not in cache
+    assert foobar in cache
+    assert str(tmp_path) in cache
+
+    cache.invalidate()
+    assert len(cache) == 0
@@ -22,6 +22,15 @@ def test_get_exif_bad_img(get_tmp_data_dir):
     assert exif["exif_kvalitet"] == exif_util.EXIF_QUALITIES["nonexistent"]
 
 
+def test_exif_from_bytes(get_tmp_data_dir):
+    tmp_dir = get_tmp_data_dir(subdirs=["fake"])
+    image_path = os.path.join(tmp_dir, "fake", "test_2.jpg")
+    with open(image_path, "rb") as f:
+        data = f.read()
+
+    assert exif_util.exif_from_bytes(data, image_path) == exif_util.exif_from_file(image_path)
+
+
 def test_get_detected_objects_dict():
     detection_classes = np.array([6, 3, 6, 2, 6, 3, 4, 8, 8, 2, 2, 1, 6])
     expected_result = {
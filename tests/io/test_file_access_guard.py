@@ -0,0 +1,100 @@
+import os
+import threading
+import pytest
+
+from src.io.file_access_guard import ReachabilityMonitor, PathNotReachableError
+
+BASE_DIR = os.path.abspath("base")
+FILE = os.path.join(BASE_DIR, "foo", "bar.jpg")
+
+
+class FakeFileSystem:
+    def __init__(self, n_down_checks=0):
+        self.n_down_checks = n_down_checks
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def exists(self, path):
+        with self.lock:
+            self.calls.append(path)
+            if self.n_down_checks > 0:
+                self.n_down_checks -= 1
+                return False
+        return True
+
+
+def test_ReachabilityMonitor_ttl():
+    fs = FakeFileSystem()
+    monitor = ReachabilityMonitor(ttl=60, exists_func=fs.exists)
+    monitor.register_base_dirs([BASE_DIR])
+
+    monitor.wait([BASE_DIR], retry_interval=0.01, timeout=1)
+    monitor.wait([BASE_DIR], retry_interval=0.01, timeout=1)
+    assert fs.calls == [BASE_DIR]
+
+
+def test_ReachabilityMonitor_shared_down_state():
+    fs = FakeFileSystem(n_down_checks=4)
+    monitor = ReachabilityMonitor(ttl=60, max_retry_interval=0.05, exists_func=fs.exists)
+    monitor.register_base_dirs([BASE_DIR])
+
+    errors = []
+
+    def _wait():
+        try:
+            monitor.wait([FILE], retry_interval=0.01, timeout=10)
+        except Exception as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=_wait) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert not monitor.is_down()
+
+
+def test_ReachabilityMonitor_timeout():
+    fs = FakeFileSystem(n_down_checks=10 ** 6)
+    monitor = ReachabilityMonitor(ttl=60, max_retry_interval=0.02, exists_func=fs.exists)
+    monitor.register_base_dirs([BASE_DIR])
+
+    with pytest.raises(PathNotReachableError):
+        monitor.wait([FILE], retry_interval=0.01, timeout=0.2)
+    assert monitor.is_down(BASE_DIR)
+
+    # Paths outside the registered base directories are retried until the timeout.
+    with pytest.raises(PathNotReachableError):
+        monitor.wait([os.path.abspath("other")], retry_interval=0.01, timeout=0.1)
+
+
+def test_ReachabilityMonitor_wait_while_down():
+    fs = FakeFileSystem(n_down_checks=10 ** 6)
+    monitor = ReachabilityMonitor(ttl=60, max_retry_interval=0.02, exists_func=fs.exists)
+    monitor.register_base_dirs([BASE_DIR])
+    # Nothing is down, so this should not block.
+    monitor.wait_while_down(retry_interval=0.01, timeout=0)
+
+    with pytest.raises(PathNotReachableError):
+        monitor.wait([FILE], retry_interval=0.01, timeout=0.1)
+    assert monitor.is_down()
+    with pytest.raises(PathNotReachableError):
+        monitor.wait_while_down(retry_interval=0.01, timeout=0.1)
+
+    # Dispatching should be paused until the directory can be reached again.
+    dispatched = threading.Event()
+
+    def _dispatch():
+        monitor.wait_while_down(retry_interval=0.01, timeout=10)
+        dispatched.set()
+
+    thread = threading.Thread(target=_dispatch)
+    thread.start()
+    assert not dispatched.wait(timeout=0.1)
+    with fs.lock:
+        fs.n_down_checks = 0
+    thread.join()
+    assert dispatched.is_set()
+    assert not monitor.is_down()
@@ -0,0 +1,152 @@
+import os
+import json
+import pytest
+from unittest import mock
+
+from src.io import save
+from src.io.file_checker import find_missing_files_in_manifest, clear_cache
+from src.io.journal import Journal, paths_to_dict
+from src.io.TreeWalker import Paths
+
+
+@pytest.fixture
+def paths(tmp_path):
+    input_dir = os.path.join(str(tmp_path), "in")
+    output_dir = os.path.join(str(tmp_path), "out")
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    return Paths(base_input_dir=input_dir, base_mirror_dirs=[output_dir], input_dir=input_dir,
+                 mirror_dirs=[output_dir], filename="foo.jpg")
+
+
+def _write_outputs(paths, checksums=False):
+    manifest = {}
+    save.write_bytes(b"image", paths.output_file, manifest=manifest, checksums=checksums)
+    save.write_bytes(b"{}", paths.output_json, manifest=manifest, checksums=checksums)
+    return manifest
+
+
+@pytest.mark.parametrize("checksums", [False, True])
+def test_find_missing_files_in_manifest(get_config, paths, checksums):
+    config = get_config(remote_json=True, remote_mask=False, local_json=False, local_mask=False)
+    manifest = _write_outputs(paths, checksums=checksums)
+
+    with mock.patch("src.io.file_checker.config", new=config):
+        assert find_missing_files_in_manifest(paths, manifest, restat_fraction=0) == []
+        assert find_missing_files_in_manifest(paths, manifest, restat_fraction=1) == []
+
+        # Files missing from the manifest should be reported without accessing the file system.
+        del manifest[paths.output_json]
+        with mock.patch("src.io.file_checker.os.path.getsize") as getsize:
+            assert find_missing_files_in_manifest(paths, manifest, restat_fraction=0) == [paths.output_json]
+        getsize.assert_not_called()
+
+
+def test_find_missing_files_in_manifest_rle(get_config, tmp_path):
+    # With mask_format="rle", the masks are stored in the .json files, so no mask files are expected.
+    config = get_config(remote_json=True, remote_mask=True, local_json=False, local_mask=True, mask_format="rle")
+    input_dir, output_dir = str(tmp_path / "in"), str(tmp_path / "out")
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    paths = Paths(base_input_dir=input_dir, base_mirror_dirs=[output_dir], input_dir=input_dir,
+                  mirror_dirs=[output_dir], filename="foo.jpg", mask_ext=None)
+    manifest = _write_outputs(paths)
+
+    with mock.patch("src.io.file_checker.config", new=config):
+        assert find_missing_files_in_manifest(paths, manifest, restat_fraction=1) == []
+
+
+def test_find_missing_files_in_manifest_restat(get_config, paths):
+    config = get_config(remote_json=True, remote_mask=False, local_json=False, local_mask=False)
+    manifest = _write_outputs(paths, checksums=True)
+
+    # Truncate one of the files after it was written.
+    with open(paths.output_file, "wb") as f:
+        f.write(b"im")
+
+    with mock.patch("src.io.file_checker.config", new=config):
+        assert find_missing_files_in_manifest(paths, manifest, restat_fraction=0) == []
+        assert find_missing_files_in_manifest(paths, manifest, restat_fraction=1) == [paths.output_file]
+
+
+def test_clear_cache(tmp_path, get_config):
+    cache_dir = os.path.join(str(tmp_path), "_cache")
+    config = get_config(CACHE_DIRECTORY=cache_dir, remote_json=True, remote_mask=True, local_json=False,
+                        local_mask=False)
+    input_dir = os.path.join(str(tmp_path), "in")
+    output_dir = os.path.join(str(tmp_path), "out")
+
+    all_paths = []
+    for sub_dir in ["a", "b", "c"]:
+        os.makedirs(os.path.join(input_dir, sub_dir))
+        os.makedirs(os.path.join(output_dir, sub_dir))
+        for i in range(5):
+            all_paths.append(Paths(base_input_dir=input_dir, base_mirror_dirs=[output_dir],
+                                   input_dir=os.path.join(input_dir, sub_dir),
+                                   mirror_dirs=[os.path.join(output_dir, sub_dir)], filename=f"{i}.jpg"))
+    finished, unfinished, legacy = all_paths[:5], all_paths[5:13], all_paths[13:]
+
+    with mock.patch("src.io.journal.config", new=config), mock.patch("src.io.file_checker.config", new=config):
+        journal = Journal()
+        journal.open()
+        for paths in all_paths:
+            _write_outputs(paths)
+        for paths in finished + unfinished:
+            journal.begin(paths)
+        for paths in finished:
+            journal.commit(paths)
+        journal.close()
+        # Cache files from earlier versions should also be cleared
+        for i, paths in enumerate(legacy):
+            with open(os.path.join(cache_dir, f"{i}.json"), "w") as f:
+                json.dump(paths_to_dict(paths), f)
+
+        clear_cache()
+
+    for paths in finished:
+        assert os.path.isfile(paths.output_file)
+        assert os.path.isfile(paths.output_json)
+    for paths in unfinished + legacy:
+        assert not os.path.isfile(paths.output_file)
+        assert not os.path.isfile(paths.output_json)
+    assert os.listdir(cache_dir) == []
+
+
+@pytest.mark.parametrize("fsync_policy", ["none", "directory"])
+def test_clear_cache_complete_images(tmp_path, get_config, fsync_policy):
+    cache_dir = os.path.join(str(tmp_path), "_cache")
+    config = get_config(CACHE_DIRECTORY=cache_dir, remote_json=True, remote_mask=False, local_json=False,
+                        local_mask=False, delete_input=True, write_exif_to_db=False, fsync_policy=fsync_policy)
+    input_dir = os.path.join(str(tmp_path), "in")
+    output_dir = os.path.join(str(tmp_path), "out")
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    complete, partial = [Paths(base_input_dir=input_dir, base_mirror_dirs=[output_dir], input_dir=input_dir,
+                               mirror_dirs=[output_dir], filename=f"{name}.jpg") for name in ["complete", "partial"]]
+
+    with mock.patch("src.io.journal.config", new=config), mock.patch("src.io.file_checker.config", new=config):
+        journal = Journal()
+        journal.open()
+        for paths in [complete, partial]:
+            open(paths.input_file, "w").close()
+            journal.begin(paths)
+        _write_outputs(complete)
+        save.write_bytes(b"image", partial.output_file)
+        # Emulate files which were being written when the program was killed.
+        temp_files = [os.path.join(output_dir, f".{os.path.basename(paths.output_json)}.0123456789ab.tmp")
+                      for paths in [complete, partial]]
+        for temp_file in temp_files:
+            open(temp_file, "w").close()
+        journal.close()
+
+        clear_cache()
+
+    # The complete image is only kept when its output files were synced.
+    keep = fsync_policy != "none"
+    assert os.path.isfile(complete.output_file) == keep
+    assert os.path.isfile(complete.output_json) == keep
+    assert os.path.isfile(complete.input_file) != keep
+    assert not os.path.isfile(partial.output_file)
+    assert os.path.isfile(partial.input_file)
+    for temp_file in temp_files:
+        assert not os.path.exists(temp_file)
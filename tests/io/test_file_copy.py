@@ -0,0 +1,94 @@
+import os
+import pytest
+
+from src.io import file_copy
+
+
+def _write_source(tmp_path, content=b"foo bar baz"):
+    source_file = os.path.join(str(tmp_path), "source.jpg")
+    with open(source_file, "wb") as f:
+        f.write(content)
+    return source_file, content
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_copy_file_copy(tmp_path):
+    source_file, content = _write_source(tmp_path)
+    destination_file = os.path.join(str(tmp_path), "destination.jpg")
+
+    assert file_copy.copy_file(source_file, destination_file, method="copy") == "copy"
+    assert _read(destination_file) == content
+    assert os.stat(source_file).st_ino != os.stat(destination_file).st_ino
+
+
+def test_copy_file_link(tmp_path):
+    source_file, content = _write_source(tmp_path)
+    destination_file = os.path.join(str(tmp_path), "destination.jpg")
+
+    method = file_copy.copy_file(source_file, destination_file, method="link")
+    assert _read(destination_file) == content
+    if method == "link":
+        assert os.stat(source_file).st_ino == os.stat(destination_file).st_ino
+    else:
+        # Hard links are not supported by the file system.
+        assert method == "copy"
+
+
+@pytest.mark.parametrize("method", ["copy", "link", "reflink", "auto"])
+def test_copy_file_overwrite(tmp_path, method):
+    source_file, content = _write_source(tmp_path)
+    destination_file = os.path.join(str(tmp_path), "destination.jpg")
+    with open(destination_file, "wb") as f:
+        f.write(b"old content which is longer than the new content")
+
+    used_method = file_copy.copy_file(source_file, destination_file, method=method)
+    assert used_method in file_copy.METHODS
+    assert _read(destination_file) == content
+    assert _read(source_file) == content
+
+
+@pytest.mark.parametrize("method", ["reflink", "auto"])
+def test_copy_file_fallback(tmp_path, method):
+    source_file, content = _write_source(tmp_path)
+    destination_file = os.path.join(str(tmp_path), "destination.jpg")
+
+    used_method = file_copy.copy_file(source_file, destination_file, method=method)
+    # Reflinks are only supported by some file systems, so the method used depends on the environment.
+    assert used_method in (file_copy.AUTO_METHODS if method == "auto" else ("reflink", "copy"))
+    assert _read(destination_file) == content
+
+
+def test_copy_file_invalid_method(tmp_path):
+    source_file, _ = _write_source(tmp_path)
+    with pytest.raises(ValueError):
+        file_copy.copy_file(source_file, os.path.join(str(tmp_path), "destination.jpg"), method="move")
+
+
+@pytest.mark.parametrize("kernel_copy", [False, True])
+@pytest.mark.parametrize("size", [0, 1000, 10 * 1024 + 1])
+def test_copy_file_chunks(tmp_path, kernel_copy, size):
+    source_file, content = _write_source(tmp_path, content=os.urandom(size))
+    destination_file = os.path.join(str(tmp_path), "destination.jpg")
+
+    file_copy.copy_file(source_file, destination_file, method="copy", chunk_size=1024, kernel_copy=kernel_copy)
+    assert _read(destination_file) == content
+    assert os.stat(source_file).st_mtime == os.stat(destination_file).st_mtime
+
+
+def test_copy_file_stats(tmp_path):
+    source_file, content = _write_source(tmp_path)
+    destination = str(tmp_path) + "-destination"
+    n_files, n_bytes, _ = file_copy.COPY_STATS.get(destination)
+
+    for i in range(3):
+        file_copy.copy_file(source_file, os.path.join(str(tmp_path), f"{i}.jpg"), destination=destination)
+    # Links are not counted
+    file_copy.copy_file(source_file, os.path.join(str(tmp_path), "link.jpg"), method="link", destination=destination)
+
+    new_n_files, new_n_bytes, _ = file_copy.COPY_STATS.get(destination)
+    assert new_n_files - n_files == 3
+    assert new_n_bytes - n_bytes == 3 * len(content)
@@ -0,0 +1,123 @@
+import io
+import os
+import pytest
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from src.io import image_codecs
+from config import PROJECT_ROOT
+
+IMG_FILE = os.path.join(PROJECT_ROOT, "tests", "data", "fake", "test_2.jpg")
+CORRUPTED_FILE = os.path.join(PROJECT_ROOT, "tests", "data", "fake", "corrupted.jpg")
+
+
+@pytest.mark.parametrize("codec_name", ["tf", "opencv", "pil"])
+def test_decode(codec_name):
+    """
+    Check that all codecs decode to (approximately) the same RGB image as PIL.
+    """
+    with open(IMG_FILE, "rb") as f:
+        data = f.read()
+    expected = np.array(Image.open(IMG_FILE).convert("RGB"))
+
+    img = image_codecs.get_codec(codec_name).decode(data)
+    assert img.dtype == np.uint8
+    assert img.shape == expected.shape
+    # Different libjpeg builds can give slightly different results.
+    assert np.abs(img.astype(int) - expected.astype(int)).mean() < 2
+
+
+@pytest.mark.parametrize("codec_name", list(image_codecs.CODECS.keys()))
+def test_decode_writeable(codec_name):
+    """
+    The decoded images are drawn on in place, so they must be writable.
+    """
+    if not image_codecs.CODECS[codec_name].is_available():
+        pytest.skip(f"Codec '{codec_name}' is not available.")
+    with open(IMG_FILE, "rb") as f:
+        data = f.read()
+    img = image_codecs.get_codec(codec_name).decode(data)
+    assert img.flags.writeable
+
+
+@pytest.mark.parametrize("codec_name", list(image_codecs.CODECS.keys()))
+def test_decode_to_buffer(codec_name):
+    if not image_codecs.CODECS[codec_name].is_available():
+        pytest.skip(f"Codec '{codec_name}' is not available.")
+    with open(IMG_FILE, "rb") as f:
+        data = f.read()
+    codec = image_codecs.get_codec(codec_name)
+    expected = codec.decode(data)
+
+    buffers = []
+
+    def _get_buffer(shape):
+        buffers.append(np.zeros(shape, dtype=np.uint8))
+        return buffers[-1]
+
+    img = codec.decode(data, get_buffer=_get_buffer)
+    # The image should be written to the given buffer.
+    assert len(buffers) == 1
+    assert img is buffers[0]
+    np.testing.assert_array_equal(img, expected)
+
+
+@pytest.mark.parametrize("codec_name", ["tf", "opencv", "pil"])
+def test_decode_corrupted(codec_name):
+    with open(CORRUPTED_FILE, "rb") as f:
+        data = f.read()
+    with pytest.raises(image_codecs.CodecError):
+        image_codecs.get_codec(codec_name).decode(data)
+
+
+@pytest.mark.parametrize("codec_name", ["tf", "opencv", "pil"])
+def test_encode(codec_name):
+    img = image_codecs._synthetic_image((64, 96, 3))
+    data = image_codecs.get_codec(codec_name).encode(img)
+    decoded = image_codecs.get_codec("pil").decode(data)
+    assert decoded.shape == img.shape
+    assert np.abs(decoded.astype(int) - img.astype(int)).mean() < 10
+
+
+@pytest.mark.parametrize("codec_name", ["opencv", "pil"])
+@pytest.mark.parametrize("subsampling,expected_sampling", [("4:4:4", 0), ("4:2:2", 1), ("4:2:0", 2)])
+@pytest.mark.parametrize("progressive", [False, True])
+def test_encode_params(codec_name, subsampling, expected_sampling, progressive):
+    img = image_codecs._synthetic_image((64, 96, 3))
+    codec = image_codecs.get_codec(codec_name)
+    try:
+        data = codec.encode(img, quality=90, subsampling=subsampling, optimize=True, progressive=progressive)
+    except image_codecs.CodecError:
+        pytest.skip(f"Codec '{codec_name}' does not support subsampling '{subsampling}' in this environment.")
+
+    pil_img = Image.open(io.BytesIO(data))
+    assert JpegImagePlugin.get_sampling(pil_img) == expected_sampling
+    assert bool(pil_img.info.get("progressive", False)) == progressive
+    # A higher quality should give a larger file.
+    assert len(data) > len(codec.encode(img, quality=50, subsampling=subsampling, progressive=progressive))
+
+
+def test_select_codecs_encoder_params():
+    params = dict(quality=90, subsampling="4:4:4")
+    image_codecs.select_codecs(decoder="pil", encoder="pil", encoder_params=params)
+    # Missing parameters are taken from the defaults.
+    assert image_codecs.get_encoder_params() == {**image_codecs.DEFAULT_ENCODER_PARAMS, **params}
+
+    # Reset to the defaults
+    image_codecs.select_codecs(decoder="tf", encoder="pil")
+    assert image_codecs.get_encoder_params() == image_codecs.DEFAULT_ENCODER_PARAMS
+
+
+def test_select_codecs_auto():
+    decoder, encoder = image_codecs.select_codecs(decoder="auto", encoder="auto")
+    assert decoder in image_codecs.AUTO_DECODERS
+    assert encoder in image_codecs.AUTO_ENCODERS
+    assert image_codecs.get_decoder().name == decoder
+    assert image_codecs.get_encoder_name() == encoder
+    # Reset to the defaults
+    image_codecs.select_codecs(decoder="tf", encoder="pil")
+
+
+def test_get_codec_invalid_name():
+    with pytest.raises(ValueError):
+        image_codecs.get_codec("foo")
@@ -0,0 +1,59 @@
+import os
+
+from src.io.janitor import Janitor, remove_empty_folders
+from src.io.TreeWalker import Paths
+
+
+def _create_image(base_dir, rel_dir, filename):
+    input_dir = os.path.join(base_dir, rel_dir)
+    os.makedirs(input_dir, exist_ok=True)
+    with open(os.path.join(input_dir, filename), "wb") as f:
+        f.write(b"image")
+    return Paths(base_input_dir=base_dir, base_mirror_dirs=[], input_dir=input_dir, mirror_dirs=[],
+                 filename=filename)
+
+
+def test_Janitor(tmp_path):
+    base_dir = str(tmp_path)
+    done = [_create_image(base_dir, os.path.join("a", "b"), f"{i}.jpg") for i in range(3)]
+    done += [_create_image(base_dir, "c", "0.jpg")]
+    # The image in 'd' is not submitted, so 'd' should not be removed.
+    _create_image(base_dir, "d", "0.jpg")
+    done += [_create_image(base_dir, "d", "1.jpg")]
+
+    janitor = Janitor()
+    for paths in done:
+        janitor.submit(paths)
+    janitor.close()
+
+    assert janitor.n_deleted == len(done)
+    assert all(not os.path.exists(paths.input_file) for paths in done)
+    assert sorted(os.listdir(base_dir)) == ["d"]
+    assert os.listdir(os.path.join(base_dir, "d")) == ["0.jpg"]
+
+
+def test_Janitor_missing_file(tmp_path):
+    base_dir = str(tmp_path)
+    paths = _create_image(base_dir, "a", "0.jpg")
+    missing = Paths(base_input_dir=base_dir, base_mirror_dirs=[], input_dir=paths.input_dir, mirror_dirs=[],
+                    filename="missing.jpg")
+
+    # A missing file should be logged, and should not stop the deletion of the other files.
+    janitor = Janitor()
+    janitor.submit(missing)
+    janitor.submit(paths)
+    janitor.close()
+
+    assert janitor.n_deleted == 1
+    assert os.listdir(base_dir) == []
+
+
+def test_remove_empty_folders(tmp_path):
+    base_dir = str(tmp_path)
+    os.makedirs(os.path.join(base_dir, "a", "b", "c"))
+    os.makedirs(os.path.join(base_dir, "a", "d"))
+
+    remove_empty_folders(start_dir=os.path.join(base_dir, "a", "b", "c"), top_dir=base_dir)
+    # 'a' is not empty, since it contains 'd'.
+    assert os.listdir(base_dir) == ["a"]
+    assert os.listdir(os.path.join(base_dir, "a")) == ["d"]
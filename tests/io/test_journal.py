@@ -0,0 +1,91 @@
+import os
+import pytest
+from unittest import mock
+
+from src.io.journal import Journal, read_pending
+from src.io.file_checker import clear_cache
+from src.io.TreeWalker import Paths
+
+
+def _get_paths(base_dir, filename):
+    input_dir = os.path.join(base_dir, "in")
+    output_dir = os.path.join(base_dir, "out")
+    return Paths(base_input_dir=input_dir, base_mirror_dirs=[output_dir], input_dir=input_dir,
+                 mirror_dirs=[output_dir], filename=filename)
+
+
+@pytest.fixture
+def journal_file(tmp_path):
+    return os.path.join(str(tmp_path), "_cache", "journal.jsonl")
+
+
+def test_Journal_begin_commit(tmp_path, journal_file):
+    journal = Journal()
+    journal.open(journal_file)
+    paths = [_get_paths(str(tmp_path), f"{i}.jpg") for i in range(3)]
+    for p in paths:
+        journal.begin(p)
+    journal.commit(paths[1])
+
+    # The records should be readable before the journal is closed.
+    assert set(read_pending(journal_file).keys()) == {paths[0].input_file, paths[2].input_file}
+    journal.close()
+    assert set(read_pending(journal_file).keys()) == {paths[0].input_file, paths[2].input_file}
+
+    # Unfinished images should be kept when the journal is reopened.
+    journal.open(journal_file)
+    assert journal.n_pending == 2
+    journal.close()
+
+
+def test_Journal_compaction(tmp_path, journal_file):
+    journal = Journal(compact_threshold=10)
+    journal.open(journal_file)
+    unfinished = _get_paths(str(tmp_path), "unfinished.jpg")
+    journal.begin(unfinished)
+    for i in range(100):
+        p = _get_paths(str(tmp_path), f"{i}.jpg")
+        journal.begin(p)
+        journal.commit(p)
+
+    with open(journal_file, "r") as f:
+        n_lines = len(f.readlines())
+    assert n_lines <= 11
+    assert list(read_pending(journal_file).keys()) == [unfinished.input_file]
+    journal.close()
+
+
+def test_read_pending_incomplete_record(tmp_path, journal_file):
+    journal = Journal()
+    journal.open(journal_file)
+    paths = _get_paths(str(tmp_path), "foo.jpg")
+    journal.begin(paths)
+    journal.close()
+
+    # Emulate a process which was killed while writing a record.
+    with open(journal_file, "a") as f:
+        f.write('{"op": "begin", "key": "bar.j')
+    assert list(read_pending(journal_file).keys()) == [paths.input_file]
+
+
+def test_clear_cache(tmp_path, get_config):
+    cache_dir = os.path.join(str(tmp_path), "_cache")
+    config = get_config(CACHE_DIRECTORY=cache_dir, remote_json=True, remote_mask=False, local_json=False,
+                        local_mask=False)
+    paths = _get_paths(str(tmp_path), "foo.jpg")
+    os.makedirs(paths.input_dir)
+    os.makedirs(paths.output_dir)
+
+    with mock.patch("src.io.journal.config", new=config), mock.patch("src.io.file_checker.config", new=config):
+        journal = Journal()
+        journal.open()
+        journal.begin(paths)
+        # Emulate a partially exported image
+        with open(paths.output_file, "wb") as f:
+            f.write(b"foo")
+        journal.close()
+
+        clear_cache()
+
+    assert not os.path.exists(paths.output_file)
+    assert not os.path.exists(journal.file_path)
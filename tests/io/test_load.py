@@ -0,0 +1,38 @@
+import os
+from unittest import mock
+
+from src.io import load
+from src.BufferPool import BufferPool
+from src.Pipeline import PipelineItem
+from src.io.TreeWalker import Paths
+from config import PROJECT_ROOT
+
+IMG_FILE = os.path.join(PROJECT_ROOT, "tests", "data", "fake", "test_2.jpg")
+
+
+def _decode(config, pool):
+    input_dir = os.path.dirname(IMG_FILE)
+    paths = Paths(base_input_dir=input_dir, base_mirror_dirs=[], input_dir=input_dir, mirror_dirs=[],
+                  filename=os.path.basename(IMG_FILE))
+    item = PipelineItem(paths)
+    with open(IMG_FILE, "rb") as f:
+        item.data = f.read()
+    with mock.patch("src.io.load.config", new=config), mock.patch("src.io.load.BUFFER_POOL", new=pool):
+        load.decode_image(item)
+    return item
+
+
+def test_decode_image_pooled(get_config):
+    config = get_config(selective_reencode=False)
+    pool = BufferPool(max_buffers_per_key=1)
+
+    item = _decode(config, pool)
+    assert item.pooled
+    assert item.image.ndim == 4
+    assert item.image.flags.writeable
+    assert item.data is None
+    assert item.exif is not None
+
+    # The buffer should be reused for the next image with the same shape.
+    pool.put(item.image)
+    assert _decode(config, pool).image is item.image
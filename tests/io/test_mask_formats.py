@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+
+from src.io import mask_formats
+
+
+def _get_mask(shape=(60, 80)):
+    mask = np.zeros(shape, dtype=bool)
+    mask[10:30, 20:50] = True
+    mask[40:, 70:] = True
+    return mask
+
+
+@pytest.mark.parametrize("mask_format", ["webp_rgb", "webp", "png"])
+def test_encode_decode_mask(mask_format):
+    mask = _get_mask()
+    decoded = mask_formats.decode_mask(mask_formats.encode_mask(mask, mask_format), mask_format)
+    assert decoded.shape == mask.shape
+    assert decoded.dtype == bool
+    # The "webp_rgb" format is lossy, so the mask is not preserved exactly.
+    if mask_format != "webp_rgb":
+        np.testing.assert_array_equal(decoded, mask)
+
+
+def test_encode_mask_rle_raises():
+    with pytest.raises(ValueError):
+        mask_formats.encode_mask(_get_mask(), "rle")
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (7, 5), (60, 80)])
+@pytest.mark.parametrize("fraction", [0, 0.1, 0.5, 1])
+def test_rle_encode_decode(shape, fraction):
+    mask = np.random.default_rng(0).random(shape) < fraction
+    rle = mask_formats.rle_encode(mask)
+    assert rle["size"] == list(shape)
+    np.testing.assert_array_equal(mask_formats.rle_decode(rle), mask)
+
+
+def test_rle_encode_coco_string():
+    # Column-major runs: 3 zeros, 2 ones, 1 zero. Compare with the string given by `pycocotools.mask.encode`.
+    mask = np.array([[0, 1], [0, 1], [0, 0]], dtype=bool)
+    assert mask_formats.rle_encode(mask) == {"size": [3, 2], "counts": "321"}
+
+
+def test_get_mask_extension():
+    assert mask_formats.get_mask_extension("png") == "png"
+    assert mask_formats.get_mask_extension("rle") is None
+    with pytest.raises(ValueError):
+        mask_formats.get_mask_extension("foo")
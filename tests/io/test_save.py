@@ -1,7 +1,9 @@
 import os
 import pickle
 import pytest
+import cv2
 import numpy as np
+from unittest import mock
 from PIL import Image
 
 from src.io.TreeWalker import Paths
@@ -42,8 +44,8 @@ def test_save_processed_img(image_info, local_mask, remote_mask):
                             normalized_gray_blur=True)
 
     check_file_exists(paths.output_file)
-    check_file_exists(paths.output_webp, invert=not remote_mask)
-    check_file_exists(paths.input_webp, invert=not local_mask)
+    check_file_exists(paths.output_mask, invert=not remote_mask)
+    check_file_exists(paths.input_mask, invert=not local_mask)
 
 
 @pytest.mark.parametrize("archive_mask,archive_json", [
@@ -57,7 +59,7 @@ def test_archive(image_info, archive_mask, archive_json):
 
     with open(paths.output_file, "w") as f:
         f.write("Output image")
-    with open(paths.output_webp, "w") as f:
+    with open(paths.output_mask, "w") as f:
         f.write("Output webp")
     with open(paths.output_json, "w") as f:
         f.write("Output json")
@@ -66,7 +68,7 @@ def test_archive(image_info, archive_mask, archive_json):
 
     check_file_exists(paths.archive_file)
     check_file_exists(paths.archive_json, invert=not archive_json)
-    check_file_exists(paths.archive_webp, invert=not archive_mask)
+    check_file_exists(paths.archive_mask, invert=not archive_mask)
 
 
 def test_archive_raises_assertion_error(image_info):
@@ -80,6 +82,25 @@ def test_archive_raises_assertion_error(image_info):
         save.archive(paths, archive_mask=False, archive_json=False, assert_output_mask=True)
 
 
+def test_copy_file_manifest(tmp_path):
+    source_file = os.path.join(str(tmp_path), "source.jpg")
+    destination_file = os.path.join(str(tmp_path), "destination.jpg")
+    with open(source_file, "wb") as f:
+        f.write(b"source content")
+
+    def _truncated_copy(_, dst, **__):
+        with open(dst, "wb") as f:
+            f.write(b"source")
+        return "copy"
+
+    # The manifest should describe the file which was written, and not the source file.
+    manifest = {}
+    with mock.patch("src.io.save.file_copy.copy_file", new=_truncated_copy):
+        save._copy_file(source_file, destination_file, manifest=manifest, checksums=True)
+    assert manifest[destination_file]["size"] == 6
+    assert manifest[destination_file]["checksum"] == save.get_checksum(data=b"source")
+
+
 def test_draw_mask_on_img(image_info):
     img, mask_results, _ = image_info
     mask_color = [100, 100, 100]
@@ -92,6 +113,62 @@ def test_draw_mask_on_img(image_info):
     assert np.allclose(img[~mask], masked_img[~mask]), "Expected masked image and input image to be equal outside mask."
 
 
+@pytest.mark.parametrize("n_detections", [0, 1, 5, 40])
+@pytest.mark.parametrize("dtype", [np.uint8, np.float32])
+def test_draw_mask_on_img_class_colors(n_detections, dtype):
+    rng = np.random.default_rng(n_detections)
+    img = rng.integers(0, 256, size=(1, 120, 160, 3)).astype(dtype)
+    masks = [_get_random_mask(img.shape[1:3], 2, rng)[0] for _ in range(n_detections)]
+    if n_detections > 1:
+        # An empty mask should be ignored.
+        masks[1][:] = False
+    detection_masks = np.stack(masks)[None, ...] if masks else np.zeros((1, 0, *img.shape[1:3]), dtype=bool)
+    # Include labels which are not in `config.LABEL_COLORS`.
+    detection_classes = rng.integers(1, 12, size=(1, n_detections))
+    mask_results = {"detection_masks": detection_masks.astype(np.float32), "detection_classes": detection_classes}
+
+    # Reference: Draw the masks one by one, so later detections overwrite earlier ones.
+    expected = img.copy()
+    for i, label in enumerate(detection_classes[0]):
+        expected[detection_masks[:, i]] = save.config.LABEL_COLORS.get(label, save.config.DEFAULT_COLOR)
+
+    masked_img = img.copy()
+    save._draw_mask_on_img(masked_img, mask_results)
+    np.testing.assert_array_equal(masked_img, expected)
+
+
+@pytest.mark.parametrize("share_mask", [False, True])
+def test_draw_mask_on_img_mask_color(share_mask):
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, size=(1, 120, 160, 3)).astype(np.uint8)
+    detection_masks = np.stack([_get_random_mask(img.shape[1:3], 2, rng)[0] for _ in range(3)])[None, ...]
+    mask_results = {"detection_masks": detection_masks, "detection_classes": np.ones((1, 3))}
+    mask_color = [10, 20, 30]
+
+    expected = img.copy()
+    expected[detection_masks.any(axis=1)] = mask_color
+
+    masked_img = img.copy()
+    if share_mask:
+        agg_mask = save.get_aggregated_mask(mask_results)
+        save._draw_mask_on_img(masked_img, mask_results, mask_color=mask_color, agg_mask=agg_mask,
+                               rects=save.get_mask_rects(agg_mask[0]))
+    else:
+        save._draw_mask_on_img(masked_img, mask_results, mask_color=mask_color)
+    np.testing.assert_array_equal(masked_img, expected)
+
+
+def test_get_aggregated_mask():
+    detection_masks = np.zeros((1, 2, 10, 10), dtype=np.float32)
+    detection_masks[0, 0, :5] = 0.7
+    detection_masks[0, 1, :, :5] = 1
+    agg_mask = save.get_aggregated_mask({"detection_masks": detection_masks})
+    assert agg_mask.shape == (1, 10, 10) and agg_mask.dtype == bool
+    assert agg_mask.sum() == 75
+    # An existing aggregated mask is reused.
+    assert save.get_aggregated_mask({"detection_masks": detection_masks, "aggregated_mask": agg_mask}) is agg_mask
+
+
 def test_blur_mask_on_img(image_info):
     img, mask_results, _ = image_info
 
@@ -100,3 +177,94 @@ def test_blur_mask_on_img(image_info):
     save._blur_mask_on_img(masked_img, mask, blur_factor=15, gray_blur=True, normalized_gray_blur=True)
     assert not np.allclose(masked_img[mask], img[mask]), "Input image and masked image are equal at masked locations."
     assert np.allclose(img[~mask], masked_img[~mask]), "Expected masked image and input image to be equal outside mask."
+
+
+def _get_random_mask(shape, n_blobs, rng):
+    mask = np.zeros(shape, dtype=bool)
+    for _ in range(n_blobs):
+        y, x = rng.integers(0, shape[0]), rng.integers(0, shape[1])
+        h, w = rng.integers(1, shape[0] // 4), rng.integers(1, shape[1] // 4)
+        mask[y:y + h, x:x + w] = True
+    return mask[None, ...]
+
+
+@pytest.mark.parametrize("gray_blur,normalized_gray_blur", [
+    (True, True),
+    (True, False),
+    (False, False),
+])
+@pytest.mark.parametrize("n_blobs", [0, 1, 5, 30])
+def test_blur_mask_on_img_regions(gray_blur, normalized_gray_blur, n_blobs):
+    rng = np.random.default_rng(n_blobs)
+    img = rng.integers(0, 256, size=(1, 240, 320, 3), dtype=np.uint8)
+    mask = _get_random_mask(img.shape[1:3], n_blobs, rng)
+    blur_factor = 50
+    ksize = int((blur_factor / 1000) * img.shape[2])
+
+    # Reference: Blur the full image.
+    expected = img.copy()
+    if gray_blur and normalized_gray_blur:
+        save._apply_normalized_gray_blur(expected, mask, ksize)
+    elif gray_blur:
+        save._apply_gray_blur(expected, mask, ksize)
+    else:
+        save._apply_color_blur(expected, mask, ksize)
+
+    # Blurring only the regions around the masks should give identical results.
+    masked_img = img.copy()
+    save._blur_mask_on_img(masked_img, mask, blur_factor=blur_factor, gray_blur=gray_blur,
+                           normalized_gray_blur=normalized_gray_blur)
+    np.testing.assert_array_equal(masked_img, expected)
+
+
+def test_get_mask_regions():
+    mask = np.zeros((100, 100), dtype=bool)
+    mask[10:20, 10:20] = True
+    mask[15:25, 70:80] = True
+    mask[28:35, 82:90] = True
+    mask[95:, 95:] = True
+    # The first two regions are far apart, but the third region overlaps the second one after padding. The last region
+    # should be clipped to the image.
+    regions = save.get_mask_regions(mask, pad=5)
+    assert sorted(regions) == [(5, 25, 5, 25), (10, 40, 65, 95), (90, 100, 90, 100)]
+
+    # Aligned to a 16x8 grid. The second and third regions touch, but do not overlap, so they are not merged.
+    regions = save.get_mask_regions(mask, pad=0, align=(16, 8))
+    assert sorted(regions) == [(8, 24, 0, 32), (8, 32, 64, 80), (24, 40, 80, 96), (88, 100, 80, 100)]
+
+    # No masked pixels, no regions.
+    assert save.get_mask_regions(np.zeros((10, 10), dtype=bool), pad=5) == []
+
+    # Precomputed bounding rectangles give the same regions.
+    rects = save.get_mask_rects(mask)
+    assert sorted(rects) == [(10, 10, 10, 10), (70, 15, 10, 10), (82, 28, 8, 7), (95, 95, 5, 5)]
+    assert sorted(save.get_mask_regions(mask, pad=5, rects=rects)) == sorted(save.get_mask_regions(mask, pad=5))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.float32])
+def test_apply_blur_masked_copy(dtype):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(1, 120, 160, 3)).astype(dtype)
+    mask = _get_random_mask(img.shape[1:3], 5, rng)
+    ksize = 9
+    gray = cv2.cvtColor(img[0], cv2.COLOR_RGB2GRAY)
+
+    # Reference: Assign the blurred values with a boolean index.
+    blurred = cv2.blur(gray, (ksize, ksize))
+    blurred_large = cv2.blur(gray, (int(1.2 * ksize), int(1.2 * ksize)))
+    expected = {
+        "color": cv2.blur(img[0], (ksize, ksize))[None, ...][mask],
+        "gray": blurred[None, :, :, None][mask],
+        "normalized": blurred[None, :, :, None][mask] - blurred_large[None, :, :, None][mask] + 100,
+    }
+    funcs = {
+        "color": save._apply_color_blur,
+        "gray": save._apply_gray_blur,
+        "normalized": save._apply_normalized_gray_blur,
+    }
+    for name, func in funcs.items():
+        masked_img = img.copy()
+        func(masked_img, mask, ksize)
+        expected_img = img.copy()
+        expected_img[mask] = expected[name]
+        np.testing.assert_array_equal(masked_img, expected_img, err_msg=name)
@@ -0,0 +1,85 @@
+import io
+import pytest
+import numpy as np
+from unittest import mock
+from PIL import Image
+
+from src.io import save
+from src.io import selective_jpeg
+
+
+def _encode_jpeg(img, subsampling=2, quality=90):
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, format="JPEG", subsampling=subsampling, quality=quality)
+    return buf.getvalue()
+
+
+def _decode_jpeg(data):
+    return np.array(Image.open(io.BytesIO(data)).convert("RGB"))
+
+
+@pytest.mark.parametrize("subsampling,mcu_size", [(0, (8, 8)), (1, (16, 8)), (2, (16, 16))])
+def test_get_jpeg_info(subsampling, mcu_size):
+    img = np.random.default_rng(0).integers(0, 256, size=(40, 60, 3), dtype=np.uint8)
+    info = selective_jpeg.get_jpeg_info(_encode_jpeg(img, subsampling=subsampling))
+    assert info["size"] == (60, 40)
+    assert info["mcu_size"] == mcu_size
+    assert info["subsampling"] == subsampling
+
+
+def test_get_jpeg_info_unsupported():
+    # Grayscale JPEG
+    buf = io.BytesIO()
+    Image.fromarray(np.zeros((16, 16), dtype=np.uint8)).save(buf, format="JPEG")
+    assert selective_jpeg.get_jpeg_info(buf.getvalue()) is None
+    # PNG
+    buf = io.BytesIO()
+    Image.fromarray(np.zeros((16, 16, 3), dtype=np.uint8)).save(buf, format="PNG")
+    assert selective_jpeg.get_jpeg_info(buf.getvalue()) is None
+    # Not an image
+    assert selective_jpeg.get_jpeg_info(b"not an image") is None
+
+
+def test_get_jpegtran_not_found():
+    assert selective_jpeg.get_jpegtran("jpegtran-which-does-not-exist") is None
+
+
+@pytest.mark.skipif(not selective_jpeg.is_available(), reason="jpegtran with support for -drop is not available.")
+def test_encode_selective():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, size=(96, 128, 3), dtype=np.uint8)
+    original_data = _encode_jpeg(img)
+    original = _decode_jpeg(original_data)
+
+    mask = np.zeros(img.shape[:2], dtype=bool)
+    mask[20:30, 40:50] = True
+    anonymised = original.copy()
+    anonymised[mask] = 0
+
+    jpeg_info = selective_jpeg.get_jpeg_info(original_data)
+    y0, y1, x0, x1 = save.get_mask_regions(mask, align=jpeg_info["mcu_size"])[0]
+    data = selective_jpeg.encode_selective(original_data, anonymised, (y0, y1, x0, x1), jpeg_info)
+    assert data is not None
+    decoded = _decode_jpeg(data)
+
+    # Outside the re-encoded region, the coefficients are copied from the original file. The decoded pixels can only
+    # differ at the region borders, due to chroma upsampling.
+    outside = np.ones(img.shape[:2], dtype=bool)
+    outside[max(y0 - 16, 0):y1 + 16, max(x0 - 16, 0):x1 + 16] = False
+    np.testing.assert_array_equal(decoded[outside], original[outside])
+    # The masked pixels should be close to the anonymised values.
+    assert np.abs(decoded[mask].astype(int) - anonymised[mask]).mean() < 10
+
+
+def test_encode_selective_single_region():
+    img = np.random.default_rng(0).integers(0, 256, size=(96, 128, 3), dtype=np.uint8)
+    original_data = _encode_jpeg(img)
+    mask = np.zeros(img.shape[:2], dtype=bool)
+    mask[4:10, 4:10] = True
+    mask[40:50, 60:70] = True
+
+    # The regions should be merged into their bounding rectangle, which is inserted with a single call.
+    with mock.patch("src.io.save.selective_jpeg.encode_selective", return_value=b"data") as encode_selective:
+        assert save._encode_selective(img, mask, original_data) == b"data"
+    encode_selective.assert_called_once()
+    assert encode_selective.call_args[0][2] == (0, 64, 0, 80)
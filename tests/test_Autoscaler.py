@@ -0,0 +1,37 @@
+import pytest
+
+from src.Autoscaler import Autoscaler
+
+
+def _feed(autoscaler, mask_time, worker_time, n_images):
+    for _ in range(n_images):
+        autoscaler.add_mask_time(mask_time)
+        autoscaler.add_worker_time(worker_time)
+        autoscaler.update()
+
+
+@pytest.mark.parametrize("mask_time,worker_time,expected", [
+    # Fast workers: One image in flight, plus one image of headroom.
+    (1.0, 0.5, 2),
+    # Slow workers: Enough images in flight to cover the worker time.
+    (1.0, 3.5, 5),
+    # Very slow workers: Limited by the upper bound.
+    (0.1, 10.0, 8),
+])
+def test_Autoscaler_target(mask_time, worker_time, expected):
+    autoscaler = Autoscaler(min_workers=1, max_workers=8, interval=5)
+    _feed(autoscaler, mask_time, worker_time, n_images=20)
+    assert autoscaler.n_workers == expected
+
+
+def test_Autoscaler_interval():
+    autoscaler = Autoscaler(min_workers=1, max_workers=8, interval=10)
+    # The limit should not change before `interval` images are masked.
+    _feed(autoscaler, 1.0, 0.5, n_images=9)
+    assert autoscaler.n_workers == 8
+    _feed(autoscaler, 1.0, 0.5, n_images=1)
+    assert autoscaler.n_workers == 2
+
+    # The limit should grow when the workers become slower.
+    _feed(autoscaler, 1.0, 5.0, n_images=50)
+    assert autoscaler.n_workers == 6
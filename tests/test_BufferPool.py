@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.BufferPool import BufferPool
+
+
+def test_BufferPool_reuses_buffers():
+    pool = BufferPool(max_buffers_per_key=2)
+    buf = pool.get((10, 20, 3), np.uint8)
+    assert buf.shape == (10, 20, 3) and buf.dtype == np.uint8
+
+    pool.put(buf)
+    assert pool.get((10, 20, 3), np.uint8) is buf
+    # Different shape or dtype gives a new buffer
+    pool.put(buf)
+    assert pool.get((20, 10, 3), np.uint8) is not buf
+    assert pool.get((10, 20, 3), np.float32) is not buf
+
+
+def test_BufferPool_limits():
+    pool = BufferPool(max_buffers_per_key=1)
+    buf_1 = pool.get((5, 5))
+    buf_2 = pool.get((5, 5))
+    pool.put(buf_1)
+    pool.put(buf_2)
+    assert pool.get((5, 5)) is buf_1
+    assert pool.get((5, 5)) is not buf_2
+
+
+def test_BufferPool_ignores_views():
+    pool = BufferPool()
+    buf = np.zeros((10, 10))
+    pool.put(buf[:5])
+    pool.put(None)
+    assert pool.get((5, 10), buf.dtype).base is None
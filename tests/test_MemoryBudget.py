@@ -0,0 +1,50 @@
+import time
+import threading
+
+from src.MemoryBudget import MemoryBudget
+
+
+def test_MemoryBudget_acquire_release():
+    budget = MemoryBudget(max_bytes=100)
+    assert budget.acquire("a", 60)
+    assert budget.acquire("a", 20)
+    assert not budget.acquire("b", 30, timeout=0)
+    assert budget.used_bytes == 80
+
+    assert budget.release("a") == 80
+    assert budget.used_bytes == 0
+    assert budget.acquire("b", 30, timeout=0)
+    # Releasing an unknown key does nothing.
+    assert budget.release("foo") == 0
+
+
+def test_MemoryBudget_oversized_reservation():
+    """
+    Check that a reservation larger than the whole budget is granted when nothing else is reserved.
+    """
+    budget = MemoryBudget(max_bytes=100)
+    assert budget.acquire("a", 1000, timeout=0)
+    assert not budget.acquire("b", 1, timeout=0)
+    assert budget.acquire("b", 1, force=True)
+    assert budget.used_bytes == 1001
+
+
+def test_MemoryBudget_blocks_until_released():
+    budget = MemoryBudget(max_bytes=100)
+    budget.acquire("a", 100)
+
+    def _release_later():
+        time.sleep(0.2)
+        budget.release("a")
+
+    thread = threading.Thread(target=_release_later)
+    thread.start()
+    assert budget.acquire("b", 50, timeout=5)
+    thread.join()
+    assert budget.used_bytes == 50
+
+
+def test_MemoryBudget_disabled():
+    budget = MemoryBudget(max_bytes=None)
+    assert budget.acquire("a", 10 ** 12, timeout=0)
+    assert budget.used_bytes == 0
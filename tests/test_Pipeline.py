@@ -0,0 +1,68 @@
+import time
+import pytest
+
+from src.Pipeline import Pipeline, Stage
+
+
+def _double(item):
+    item.data = 2 * item.paths
+
+
+def _add_one(item):
+    time.sleep(0.001)
+    item.data += 1
+
+
+def _fail_on_three(item):
+    if item.paths == 3:
+        raise ValueError("Got 3")
+
+
+@pytest.mark.parametrize("n_workers", [1, 3])
+def test_Pipeline_processes_all_items(n_workers):
+    stages = [
+        Stage("double", _double, n_workers=n_workers, queue_size=2),
+        Stage("add_one", _add_one, n_workers=n_workers, queue_size=2),
+    ]
+    pipeline = Pipeline(range(20), stages, queue_size=2)
+    results = {item.paths: item.data for item in pipeline}
+
+    assert results == {i: 2 * i + 1 for i in range(20)}
+    assert all(stage.n_processed == 20 for stage in stages)
+    assert set(pipeline.queue_depths().keys()) == {"discover", "double", "add_one"}
+
+
+def test_Pipeline_passes_errors_through():
+    stages = [
+        Stage("fail", _fail_on_three),
+        Stage("double", _double),
+    ]
+    items = list(Pipeline(range(5), stages))
+
+    assert len(items) == 5
+    for item in items:
+        if item.paths == 3:
+            assert isinstance(item.error, ValueError)
+            # The item should not be processed by the remaining stages.
+            assert item.data is None
+        else:
+            assert item.error is None
+            assert item.data == 2 * item.paths
+
+
+def test_Pipeline_raises_source_errors():
+    def _source():
+        yield 1
+        raise RuntimeError("Source error")
+
+    with pytest.raises(RuntimeError):
+        list(Pipeline(_source(), [Stage("double", _double)]))
+
+
+def test_Pipeline_stop():
+    pipeline = Pipeline(range(1000), [Stage("double", _double)], queue_size=1)
+    n_items = 0
+    for _ in pipeline:
+        pipeline.stop()
+        n_items += 1
+    assert n_items < 1000
@@ -0,0 +1,60 @@
+import time
+
+from src.RetryQueue import RetryQueue, CircuitBreaker
+
+
+def test_RetryQueue_delay():
+    retry_queue = RetryQueue(base_delay=2, max_delay=10, jitter=0)
+    assert [retry_queue.get_delay(n) for n in range(1, 6)] == [2, 4, 8, 10, 10]
+
+    retry_queue = RetryQueue(base_delay=2, max_delay=10, jitter=0.5)
+    for _ in range(100):
+        assert 1 <= retry_queue.get_delay(1) <= 3
+
+
+def test_RetryQueue_pop_due():
+    retry_queue = RetryQueue()
+    assert retry_queue.time_until_next() is None
+
+    retry_queue.schedule("later", delay=60)
+    retry_queue.schedule("first", delay=0)
+    retry_queue.schedule("second", delay=0)
+    assert len(retry_queue) == 3
+    # Due items should be returned in order, without the pending item.
+    assert retry_queue.pop_due() == ["first", "second"]
+    assert retry_queue.pop_due() == []
+    assert len(retry_queue) == 1
+    assert 59 < retry_queue.time_until_next() <= 60
+
+
+def test_CircuitBreaker():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.2)
+    for _ in range(2):
+        breaker.record_failure("a")
+    assert breaker.allow("a")
+    # A success should reset the number of consecutive failures.
+    breaker.record_success("a")
+    for _ in range(2):
+        breaker.record_failure("a")
+    assert not breaker.is_open("a")
+
+    # Open the circuit. Other destinations should not be affected.
+    breaker.record_failure("a")
+    assert breaker.is_open("a")
+    assert not breaker.allow("a")
+    assert breaker.allow("b")
+    assert breaker.time_until_retry("a") > 0
+
+    # After the timeout, a single attempt should be allowed. A failure should open the circuit again.
+    time.sleep(0.25)
+    assert breaker.allow("a")
+    assert not breaker.allow("a")
+    breaker.record_failure("a")
+    assert not breaker.allow("a")
+
+    # A successful attempt should close the circuit.
+    time.sleep(0.25)
+    assert breaker.allow("a")
+    breaker.record_success("a")
+    assert not breaker.is_open("a")
+    assert breaker.allow("a")
@@ -1,14 +1,20 @@
 import os
+import time
 import pytest
 from unittest import mock
 import numpy as np
 import pickle
+import threading
 from PIL import Image
-import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import ThreadPool
 
-from src.Workers import SaveWorker, EXIFWorker
+from src.Workers import BaseWorker, SaveWorker, EXIFWorker, WORKER_STATE, create_worker_pool, get_exif_mask_results
 from src.io.TreeWalker import Paths
-from src.io.exif_util import EXIF_TEMPLATE
+from src.MemoryBudget import MemoryBudget
+from src.Autoscaler import Autoscaler
+from src.io.exif_util import EXIF_TEMPLATE, exif_from_file
+from src.io import save, mask_formats
 
 from tests.helpers import check_file_exists
 
@@ -56,26 +62,30 @@ def test_SaveWorker(get_config, get_image_info, remote_mask, local_mask, enable_
     # Make the output-json to emulate the EXIFWorker
     with open(paths.output_json, "w") as f:
         f.write("Output JSON")
-    # Create a multiprocessing pool
-    if enable_async:
-        pool = multiprocessing.Pool(1)
-    else:
-        pool = None
-    # Run the worker
     with mock.patch("src.Workers.config", new=config):
-        worker = SaveWorker(pool, paths, img, mask_results)
+        # Create a worker pool and an I/O thread pool
+        if enable_async:
+            pool = create_worker_pool(1)
+            io_executor = ThreadPoolExecutor(1)
+        else:
+            pool = None
+            io_executor = None
+        # Run the worker
+        worker = SaveWorker(pool, paths, img, mask_results, io_executor=io_executor)
         result = worker.get()
-    assert result == 0
 
     # Check expected output files
     check_file_exists(paths.output_file)
-    check_file_exists(paths.input_webp, invert=not local_mask)
-    check_file_exists(paths.output_webp, invert=not remote_mask)
+    check_file_exists(paths.input_mask, invert=not local_mask)
+    check_file_exists(paths.output_mask, invert=not remote_mask)
 
     if enable_archive:
         check_file_exists(paths.archive_file)
         check_file_exists(paths.archive_json)
-        check_file_exists(paths.archive_webp)
+        check_file_exists(paths.archive_mask)
+
+    # Check that the manifest matches the written files
+    check_manifest(result["files"])
 
 
 @pytest.mark.parametrize("remote_json,local_json,enable_async", [
@@ -89,21 +99,204 @@ def test_EXIFWorker(get_config, get_image_info, remote_json, local_json, enable_
 
     img, mask_results, paths = get_image_info(enable_archive=False)
 
-    # Create a multiprocessing pool
-    if enable_async:
-        pool = multiprocessing.Pool(1)
-    else:
-        pool = None
-    # Run the worker
     with mock.patch("src.Workers.config", new=config):
-        worker = EXIFWorker(pool, paths, mask_results)
-        exif = worker.get()
+        # Create a worker pool and an I/O thread pool
+        if enable_async:
+            pool = create_worker_pool(1)
+            io_executor = ThreadPoolExecutor(1)
+        else:
+            pool = None
+            io_executor = None
+        # Run the worker
+        worker = EXIFWorker(pool, paths, mask_results, exif_from_file(paths.input_file), io_executor=io_executor)
+        result = worker.get()
 
     # Check that the exif dict contains the required keys
-    assert set(exif.keys()) == EXPECTED_EXIF_KEYS
+    assert set(result["exif"].keys()) == EXPECTED_EXIF_KEYS
     # Check expected output files
     check_file_exists(paths.input_json, invert=not local_json)
     check_file_exists(paths.output_json, invert=not remote_json)
+    # Check that the manifest matches the written files
+    assert len(result["files"]) == int(local_json) + int(remote_json)
+    check_manifest(result["files"])
+
+
+def check_manifest(manifest):
+    for file_path, entry in manifest.items():
+        assert os.path.getsize(file_path) == entry["size"]
+
+
+def _get_worker_state():
+    return dict(WORKER_STATE)
+
+
+def test_create_worker_pool(get_config):
+    config = get_config(version="test-version", blur=15)
+    with mock.patch("src.Workers.config", new=config):
+        pool = create_worker_pool(1)
+    # The settings should be sent to the worker process when it is started.
+    state = pool.apply(_get_worker_state)
+    pool.close()
+    assert state["version"] == "test-version"
+    assert state["render_args"]["blur"] == 15
+
+
+def test_BaseWorker_wait(tmp_path):
+    paths = Paths(base_input_dir=str(tmp_path), base_mirror_dirs=[], input_dir=str(tmp_path), mirror_dirs=[],
+                  filename="image.jpg")
+    release = threading.Event()
+    with ThreadPoolExecutor(1) as io_executor:
+        # The pool is not used, since the callback is called manually below.
+        worker = BaseWorker(pool=mock.MagicMock(), paths=paths, io_executor=io_executor)
+        worker.io_func = lambda result: release.wait()
+        # The CPU-bound part has not finished.
+        assert not worker.wait(timeout=0.05)
+        # The I/O-bound part has not finished.
+        worker._async_callback((time.time(), None))
+        assert not worker.wait(timeout=0.05)
+        release.set()
+        assert worker.wait(timeout=5)
+
+
+def test_BaseWorker_on_done_after_io(tmp_path):
+    paths = Paths(base_input_dir=str(tmp_path), base_mirror_dirs=[], input_dir=str(tmp_path), mirror_dirs=[],
+                  filename="image.jpg")
+    release = threading.Event()
+    done = threading.Event()
+    with ThreadPoolExecutor(1) as io_executor:
+        worker = BaseWorker(pool=mock.MagicMock(), paths=paths, io_executor=io_executor)
+        worker.io_func = lambda result: release.wait()
+        worker.on_done = done.set
+        worker._async_callback((time.time(), None))
+        # The worker is not done until the I/O-bound part has finished.
+        assert not done.wait(timeout=0.05)
+        release.set()
+        assert done.wait(timeout=5)
+
+
+def test_BaseWorker_io_submit_error(tmp_path):
+    paths = Paths(base_input_dir=str(tmp_path), base_mirror_dirs=[], input_dir=str(tmp_path), mirror_dirs=[],
+                  filename="image.jpg")
+    io_executor = ThreadPoolExecutor(1)
+    io_executor.shutdown()
+    worker = BaseWorker(pool=mock.MagicMock(), paths=paths, io_executor=io_executor)
+    worker.async_worker = mock.MagicMock()
+    worker.async_worker.get.return_value = (time.time(), None)
+    # The I/O-bound part can not be submitted to the shut down thread pool.
+    worker._async_callback((time.time(), None))
+    assert worker.wait(timeout=0)
+    assert worker.finish_time is not None
+    with pytest.raises(RuntimeError):
+        worker.get()
+
+
+def _sleep_task(settings, seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_BaseWorker_elapsed_time_saturated_pool(tmp_path):
+    paths = Paths(base_input_dir=str(tmp_path), base_mirror_dirs=[], input_dir=str(tmp_path), mirror_dirs=[],
+                  filename="image.jpg")
+    task_seconds = 0.05
+    workers = []
+    with mock.patch.dict("src.Workers.TASKS", {"sleep": _sleep_task}), \
+            mock.patch.dict("src.Workers.WORKER_STATE", {"version": "test-version"}), ThreadPool(1) as pool:
+        # Dispatch more tasks than the pool can run at once.
+        for _ in range(10):
+            worker = BaseWorker(pool=pool, paths=paths)
+            worker.task_name = "sleep"
+            worker.args = (task_seconds,)
+            worker.result_is_valid = lambda result: True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.get()
+
+    # The last worker waited in the queue for the others to finish.
+    assert workers[-1].finish_time - workers[-1].start_time > 5 * task_seconds
+    # The time spent in the queue should not drive the number of workers to the maximum.
+    autoscaler = Autoscaler(min_workers=1, max_workers=8, interval=1)
+    for worker in workers:
+        assert worker.elapsed_time < 3 * task_seconds
+        autoscaler.add_mask_time(task_seconds)
+        autoscaler.add_worker_time(worker.elapsed_time)
+        autoscaler.update()
+    assert autoscaler.n_workers < autoscaler.max_workers
+
+
+def test_SaveWorker_memory_budget(tmp_path):
+    paths = Paths(base_input_dir=str(tmp_path), base_mirror_dirs=[], input_dir=str(tmp_path), mirror_dirs=[],
+                  filename="image.jpg")
+    budget = MemoryBudget(max_bytes=100)
+    # Only the memory handling is tested, so the worker is not started.
+    worker = SaveWorker.__new__(SaveWorker)
+    worker.paths = paths
+    worker.released_bytes = 0
+
+    with mock.patch("src.Workers.MEMORY_BUDGET", new=budget):
+        budget.acquire(paths.input_file, 80)
+        worker.on_done()
+        assert budget.used_bytes == 0
+        # Another image takes the memory, so the memory for the retry can not be reserved yet.
+        budget.acquire("other", 50)
+        assert not worker.reserve_memory(timeout=0)
+        budget.release("other")
+        assert worker.reserve_memory(timeout=0)
+        assert budget.used_bytes == 80
+        # The memory is only reserved once.
+        assert worker.reserve_memory(timeout=0)
+        assert budget.used_bytes == 80
 
 
 EXPECTED_EXIF_KEYS = set(EXIF_TEMPLATE.keys())
+
+
+def test_EXIFWorker_async_func_does_not_read_input(tmp_path):
+    mask_results = {"detection_classes": np.array([[1, 1]]), "num_detections": 2}
+    settings = {"version": "test-version"}
+    # The input file does not exist, so the task fails if it tries to read it.
+    with mock.patch("src.Workers.exif_util.exif_from_file", side_effect=AssertionError("Read the input file")):
+        exif = EXIFWorker.async_func(settings, EXIF_TEMPLATE.copy(), mask_results)
+    assert exif["versjon"] == "test-version"
+    assert exif["detekterte_objekter"] is not None
+
+
+def test_get_exif_mask_results():
+    detection_masks = np.zeros((1, 2, 10, 10), dtype=bool)
+    detection_masks[0, 0, :5] = True
+    mask_results = {"detection_masks": detection_masks, "detection_classes": np.array([[1, 2]]), "num_detections": 2}
+
+    exif_mask_results = get_exif_mask_results(mask_results)
+    # The detection masks should not be sent to the EXIFWorker.
+    assert "detection_masks" not in exif_mask_results
+    np.testing.assert_array_equal(exif_mask_results["detection_classes"], mask_results["detection_classes"])
+    assert get_exif_mask_results(None) is None
+
+
+def test_rle_mask_aggregated_once(tmp_path):
+    paths = Paths(base_input_dir=str(tmp_path), base_mirror_dirs=[], input_dir=str(tmp_path), mirror_dirs=[],
+                  filename="image.jpg")
+    img = np.zeros((1, 10, 10, 3), dtype=np.uint8)
+    detection_masks = np.zeros((1, 2, 10, 10), dtype=bool)
+    detection_masks[0, 0, :5] = True
+    detection_masks[0, 1, :, 7:] = True
+    mask_results = {"detection_masks": detection_masks, "detection_classes": np.array([[1, 1]]), "num_detections": 2}
+    render_args = dict(draw_mask=True, encode_mask=False, blur=15, encoder="pil", mask_format="rle")
+    settings = {"render_args": render_args, "version": "test-version"}
+
+    # Only the tasks are tested, so the workers are not started.
+    save_worker = SaveWorker.__new__(SaveWorker)
+    save_worker.paths = paths
+    save_worker._mask_rle_ready = threading.Event()
+
+    with mock.patch("src.io.save.get_aggregated_mask", wraps=save.get_aggregated_mask) as get_aggregated_mask:
+        save_worker.on_finished(SaveWorker.async_func(settings, img, mask_results))
+        exif = EXIFWorker.async_func(settings, EXIF_TEMPLATE.copy(), get_exif_mask_results(mask_results))
+        result = EXIFWorker.io_func(exif, paths, local_json=False, remote_json=False, checksums=False,
+                                    mask_rle_source=save_worker)
+
+    # The aggregated mask should be computed once, and shared by the image and the .json file.
+    assert get_aggregated_mask.call_count == 1
+    expected_mask = np.any(detection_masks, axis=1)[0]
+    np.testing.assert_array_equal(mask_formats.rle_decode(result["exif"][mask_formats.RLE_JSON_KEY]), expected_mask)
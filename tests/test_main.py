@@ -173,8 +173,8 @@ def run_main(new_config, new_args):
         mock.patch("src.ImageProcessor.config", new=new_config),
         mock.patch("src.Masker.config", new=new_config),
         mock.patch("src.Workers.config", new=new_config),
-        mock.patch("src.io.TreeWalker.config", new=new_config),
         mock.patch("src.io.file_checker.config", new=new_config),
+        mock.patch("src.io.journal.config", new=new_config),
     ]
     for m in mockers: m.start()
     main()